@@ -0,0 +1,331 @@
+'''
+Caché de lecturas de clientes y shipments (GET /customers/{id} y GET /shipments/{id})
+    Guarda la respuesta serializada de cada entidad con la clave "{entidad}:{id}", con una caducidad de
+    CACHE_TTL_SECONDS. El almacén se elige con CACHE_BACKEND:
+      - memory: LRU en memoria del proceso (un solo worker, o varios con la invalidación del feed de cambios)
+      - redis: compartido por todos los workers y contenedores (CACHE_REDIS_URL; necesita el paquete redis)
+      - fake: almacén compartido en memoria con el comportamiento del de Redis (valores serializados), para pruebas
+      - none: sin caché
+    Invalidación: los endpoints que modifican una entidad borran su clave tras el commit, y todos los procesos
+    borran las claves de los deltas del feed de cambios (events.py, LISTEN/NOTIFY), que publican en su transacción
+    todas las escrituras (endpoints, webhook e importación); si el feed pierde deltas (resync) se vacía la caché.
+    Lecturas que terminan después de una invalidación: la caché en memoria descarta el valor con un contador de
+    invalidaciones (generation); las compartidas (redis y fake) cambian la entrada invalidada por una marca (tombstone)
+    durante CACHE_TOMBSTONE_SECONDS y solo guardan con SET NX, así que un valor leído de la DB antes del cambio no
+    sustituye a la marca y la siguiente lectura vuelve a ir a la DB.
+    Es usado por main.py y webhook.py.
+'''
+
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+import asyncio
+import json
+import logging
+import os
+import time as clock
+
+# memory / redis / fake / none
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+# Tiempo máximo que se sirve una entrada sin volver a leerla de la DB (red de seguridad de la invalidación)
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "60"))
+# Entradas como máximo en la caché en memoria del proceso
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+# Cachés compartidas: tiempo que una entrada invalidada no se puede volver a guardar (debe superar lo que tarda
+# una lectura de la DB entre get y set)
+CACHE_TOMBSTONE_SECONDS = float(os.getenv("CACHE_TOMBSTONE_SECONDS", "5"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+# Prefijo de las claves en Redis (varias instalaciones pueden compartir el servidor)
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "zarracin:")
+
+# Entidades cacheadas (las de los deltas del feed de cambios)
+ENTITIES = ("customer", "shipment")
+
+# Valor de una entrada invalidada en las cachés compartidas (no es JSON válido, no se confunde con un valor)
+TOMBSTONE = "-"
+
+logger = logging.getLogger(__name__)
+
+
+def entity_key(entity: str, entity_id) -> str:
+    return f"{entity}:{entity_id}"
+
+
+class CacheBackend:
+    """Interfaz de los almacenes; get/set/delete no deben fallar (un error cuenta como fallo de caché)"""
+
+    name = "none"
+
+    def __init__(self, ttl_seconds: float = CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.invalidations = 0
+        self.stale_sets = 0
+        self.errors = 0
+
+    def generation(self) -> Optional[int]:
+        """Contador de invalidaciones (solo en memoria): set() descarta lo leído antes de una invalidación"""
+        return None
+
+    async def get(self, key: str) -> Optional[dict]:
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: dict, generation: Optional[int] = None):
+        pass
+
+    async def delete(self, keys: List[str]):
+        pass
+
+    async def clear(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "sets": self.sets,
+            "invalidations": self.invalidations,
+            "stale_sets": self.stale_sets,
+            "errors": self.errors,
+        }
+
+
+class MemoryCache(CacheBackend):
+    """LRU del proceso; solo se usa desde el event loop, así que no necesita lock"""
+
+    name = "memory"
+
+    def __init__(self, ttl_seconds: float = CACHE_TTL_SECONDS, max_entries: int = CACHE_MAX_ENTRIES):
+        super().__init__(ttl_seconds)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._generation = 0
+        self.evictions = 0
+
+    def generation(self) -> Optional[int]:
+        return self._generation
+
+    async def get(self, key: str) -> Optional[dict]:
+        item = self._entries.get(key)
+        if item is not None and clock.monotonic() > item[1]:
+            del self._entries[key]
+            item = None
+        if item is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    async def set(self, key: str, value: dict, generation: Optional[int] = None):
+        if generation is not None and generation != self._generation:
+            self.stale_sets += 1
+            return
+        self._entries[key] = (value, clock.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        self.sets += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, keys: List[str]):
+        self._generation += 1
+        self.invalidations += 1
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def clear(self):
+        self._generation += 1
+        self.invalidations += 1
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {**super().stats(), "size": len(self._entries), "max_entries": self.max_entries, "evictions": self.evictions}
+
+
+# Almacén de FakeSharedCache: común a todas las instancias del proceso, como un servidor Redis
+_fake_store: Dict[str, tuple] = {}
+
+
+class FakeSharedCache(CacheBackend):
+    """
+    Imita el almacén compartido: los valores se guardan serializados (JSON) en un diccionario común a todas las
+    instancias, así que dos instancias se comportan como dos workers contra el mismo Redis.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        ttl_seconds: float = CACHE_TTL_SECONDS,
+        store: Optional[Dict[str, tuple]] = None,
+        tombstone_seconds: float = CACHE_TOMBSTONE_SECONDS,
+    ):
+        super().__init__(ttl_seconds)
+        self.store = _fake_store if store is None else store
+        self.tombstone_seconds = tombstone_seconds
+
+    def _live(self, key: str) -> Optional[str]:
+        item = self.store.get(CACHE_KEY_PREFIX + key)
+        if item is None or clock.monotonic() > item[1]:
+            return None
+        return item[0]
+
+    async def get(self, key: str) -> Optional[dict]:
+        raw = self._live(key)
+        if raw is None or raw == TOMBSTONE:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key: str, value: dict, generation: Optional[int] = None):
+        # SET NX: no sustituye a una marca de invalidación ni a un valor guardado por otro worker
+        if self._live(key) is not None:
+            self.stale_sets += 1
+            return
+        self.store[CACHE_KEY_PREFIX + key] = (json.dumps(value), clock.monotonic() + self.ttl_seconds)
+        self.sets += 1
+
+    async def delete(self, keys: List[str]):
+        self.invalidations += 1
+        expires = clock.monotonic() + self.tombstone_seconds
+        for key in keys:
+            self.store[CACHE_KEY_PREFIX + key] = (TOMBSTONE, expires)
+
+    async def clear(self):
+        self.invalidations += 1
+        for key in [key for key in self.store if key.startswith(CACHE_KEY_PREFIX)]:
+            self.store.pop(key, None)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "size": len(self.store)}
+
+
+class RedisCache(CacheBackend):
+    """Redis compartido (redis.asyncio); si Redis no responde las lecturas van a la DB"""
+
+    name = "redis"
+
+    def __init__(
+        self, url: str = CACHE_REDIS_URL, ttl_seconds: float = CACHE_TTL_SECONDS, tombstone_seconds: float = CACHE_TOMBSTONE_SECONDS
+    ):
+        super().__init__(ttl_seconds)
+        self.tombstone_seconds = tombstone_seconds
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+
+    async def get(self, key: str) -> Optional[dict]:
+        try:
+            raw = await self.client.get(CACHE_KEY_PREFIX + key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Error leyendo de la caché Redis", extra={"error": str(e)})
+            raw = None
+        if raw is None or raw == TOMBSTONE.encode():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key: str, value: dict, generation: Optional[int] = None):
+        try:
+            # NX: no sustituye a una marca de invalidación ni a un valor guardado por otro worker
+            if await self.client.set(CACHE_KEY_PREFIX + key, json.dumps(value), px=int(self.ttl_seconds * 1000), nx=True):
+                self.sets += 1
+            else:
+                self.stale_sets += 1
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Error escribiendo en la caché Redis", extra={"error": str(e)})
+
+    async def delete(self, keys: List[str]):
+        self.invalidations += 1
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.set(CACHE_KEY_PREFIX + key, TOMBSTONE, px=int(self.tombstone_seconds * 1000))
+                await pipe.execute()
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Error invalidando la caché Redis", extra={"error": str(e)})
+
+    async def clear(self):
+        self.invalidations += 1
+        try:
+            keys = [key async for key in self.client.scan_iter(match=CACHE_KEY_PREFIX + "*", count=1000)]
+            if keys:
+                await self.client.delete(*keys)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Error vaciando la caché Redis", extra={"error": str(e)})
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def create_cache(backend: str = CACHE_BACKEND) -> CacheBackend:
+    if backend == "redis":
+        return RedisCache()
+    if backend == "fake":
+        return FakeSharedCache()
+    if backend == "memory":
+        return MemoryCache()
+    return CacheBackend()
+
+
+# Caché del proceso (se crea en init_cache, al arrancar la aplicación)
+cache: CacheBackend = CacheBackend()
+
+
+def init_cache():
+    global cache
+    cache = create_cache()
+
+
+async def close_cache():
+    await cache.close()
+
+
+async def invalidate(entity: str, ids: Iterable):
+    """Borra las entradas de esas entidades (llamar después del commit)"""
+    keys = [entity_key(entity, entity_id) for entity_id in ids]
+    if keys:
+        await cache.delete(keys)
+
+
+# Invalidaciones lanzadas desde on_change (se guarda la referencia hasta que terminan)
+_pending: set = set()
+
+
+def _schedule(coroutine):
+    task = asyncio.get_running_loop().create_task(coroutine)
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+def on_change(changes):
+    """
+    Deltas del feed de cambios (events.ChangeBroadcaster, en el event loop): borra las entidades modificadas
+    en cualquier proceso, o toda la caché si se han podido perder deltas
+    """
+    if not isinstance(changes, list):
+        _schedule(cache.clear())
+        return
+    keys = list({
+        entity_key(change["entity"], change["data"]["id"])
+        for change in changes
+        if change.get("entity") in ENTITIES and "id" in change.get("data", {})
+    })
+    if keys:
+        _schedule(cache.delete(keys))
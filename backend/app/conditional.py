@@ -0,0 +1,55 @@
+'''
+Peticiones condicionales (ETag / If-None-Match)
+    Los listados calculan un validador barato en la DB (número de filas y md5 de los pares id:versión de la página),
+    sin cargar ni serializar las filas, y responden 304 Not Modified si coincide con el If-None-Match del cliente.
+    Es usado por pagination.py y main.py (GET /shipments, GET /customers y GET /shipments/{id}/interactions).
+'''
+
+from typing import Optional
+import hashlib
+
+from fastapi import Request, Response
+from sqlalchemy import Text, cast, func, literal_column
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+# Los clientes deben revalidar siempre (If-None-Match) antes de reutilizar una respuesta
+CACHE_CONTROL = "private, no-cache"
+
+
+def fingerprint_columns(id_column, version_column, *order_by) -> list:
+    """
+    Columnas agregadas (count, md5) que identifican un conjunto de filas: cambian si se añade, borra
+    o modifica (versión = updated_at o created_at) cualquiera de ellas.
+    """
+    return [
+        func.count().label("rows"),
+        func.md5(func.string_agg(
+            cast(id_column, Text) + ":" + cast(version_column, Text),
+            aggregate_order_by(literal_column("','"), *order_by),
+        )).label("fingerprint"),
+    ]
+
+
+def make_etag(*parts) -> str:
+    """ETag débil: el cuerpo puede ir comprimido o no, pero el contenido es el mismo"""
+    digest = hashlib.md5("|".join(str(p) for p in parts).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Comparación débil del If-None-Match de la petición con el ETag actual"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    current = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == current for candidate in header.split(","))
+
+
+def cache_headers(etag: str, headers: Optional[dict] = None) -> dict:
+    return {**(headers or {}), "ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def not_modified(etag: str, headers: Optional[dict] = None) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag, headers))
@@ -0,0 +1,156 @@
+'''
+Índice en memoria de clientes por teléfono
+    El webhook de Twilio y la importación buscan el cliente por teléfono constantemente, y los clientes cambian poco.
+    CustomerIndex guarda por proceso una entrada compacta por teléfono (id, nombre, horario de entrega y zona horaria),
+    con un máximo de CUSTOMER_INDEX_SIZE entradas (se descartan las menos usadas, LRU) y una caducidad de
+    CUSTOMER_INDEX_TTL_SECONDS como red de seguridad. No se guardan los teléfonos desconocidos.
+    Se invalida al crear, modificar o borrar clientes (endpoints e importación) en este proceso, y con los deltas
+    "customer" del feed de cambios (events.py) para los cambios hechos en otros procesos.
+    Es usado por main.py, webhook.py e importer.py.
+'''
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import time
+from typing import Dict, Iterable, Optional
+import os
+import threading
+import time as clock
+import uuid
+
+# Entradas como máximo en el índice del proceso
+CUSTOMER_INDEX_SIZE = int(os.getenv("CUSTOMER_INDEX_SIZE", "10000"))
+# Tiempo máximo que se usa una entrada sin volver a leerla de la DB (0 = sin caducidad)
+CUSTOMER_INDEX_TTL_SECONDS = float(os.getenv("CUSTOMER_INDEX_TTL_SECONDS", "300"))
+
+
+@dataclass(frozen=True, slots=True)
+class CustomerEntry:
+    id: uuid.UUID
+    name: str
+    phone: str
+    delivery_hours_open: time
+    delivery_hours_close: time
+    timezone: str
+
+
+def normalize_phone(phone: str) -> str:
+    """Clave del índice: el teléfono sin espacios"""
+    return "".join(str(phone).split())
+
+
+class CustomerIndex:
+    """
+    LRU teléfono -> CustomerEntry, seguro entre hilos (webhook en el event loop, importación en su hilo).
+    Para no guardar datos ya invalidados, una lectura de la DB se guarda con la generación que había antes de
+    consultarla (generation()) y put() la descarta si entretanto ha habido alguna invalidación.
+    """
+
+    def __init__(self, max_size: int = CUSTOMER_INDEX_SIZE, ttl_seconds: float = CUSTOMER_INDEX_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._keys_by_id: Dict[uuid.UUID, str] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, phone: str) -> Optional[CustomerEntry]:
+        key = normalize_phone(phone)
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and self.ttl_seconds and clock.monotonic() - item[1] > self.ttl_seconds:
+                self._remove(key)
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, entry: CustomerEntry, generation: int):
+        self.put_many([entry], generation)
+
+    def put_many(self, entries: Iterable[CustomerEntry], generation: int):
+        with self._lock:
+            if generation != self._generation or self.max_size <= 0:
+                return
+            now = clock.monotonic()
+            for entry in entries:
+                key = normalize_phone(entry.phone)
+                previous = self._entries.get(key)
+                if previous is not None and previous[0].id != entry.id:
+                    self._keys_by_id.pop(previous[0].id, None)
+                self._entries[key] = (entry, now)
+                self._entries.move_to_end(key)
+                self._keys_by_id[entry.id] = key
+            while len(self._entries) > self.max_size:
+                key, (entry, _) = self._entries.popitem(last=False)
+                self._keys_by_id.pop(entry.id, None)
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self._keys_by_id.pop(item[0].id, None)
+
+    def invalidate(self, phones: Iterable[str] = (), ids: Iterable[uuid.UUID] = ()):
+        """Descarta las entradas de esos teléfonos o ids de cliente (llamar después del commit)"""
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            for phone in phones:
+                if phone:
+                    self._remove(normalize_phone(phone))
+            for customer_id in ids:
+                key = self._keys_by_id.get(customer_id)
+                if key is not None:
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.clear()
+            self._keys_by_id.clear()
+
+    def on_change(self, changes):
+        """Deltas del feed de cambios (events.ChangeBroadcaster): invalida los clientes modificados en cualquier proceso"""
+        if not isinstance(changes, list):
+            # RESYNC: se han podido perder deltas
+            self.clear()
+            return
+        ids = []
+        for change in changes:
+            if change.get("entity") == "customer":
+                try:
+                    ids.append(uuid.UUID(str(change["data"]["id"])))
+                except (KeyError, ValueError):
+                    self.clear()
+                    return
+        if ids:
+            self.invalidate(ids=ids)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+# Índice de clientes del proceso
+index = CustomerIndex()
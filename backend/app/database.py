@@ -1,24 +1,199 @@
 '''
 Conexión a la DB
     Inicializa la conexión con PostgreSQL utilizando la URL de entorno y crea una sesión (SessionLocal) para las operaciones de lectura/escritura.
-    Es importado por models.py y main.py para establecer la conexión física con la base de datos.
+    También crea un engine asíncrono (asyncpg) y su sesión (AsyncSessionLocal) para los endpoints async, que no ocupan hilos del threadpool.
+    Las consultas de los dos engines se miden con eventos del engine (ver metrics.py) y, si se activa,
+    se perfilan por petición (ver profiler.py). Sus pools miden la espera por conexión (ver pool.py).
+    Las sesiones solo sacan una conexión del pool en su primera consulta, así que las peticiones que no llegan
+    a usar la DB (p. ej. respuestas de la caché o sin autorización) no ocupan ninguna.
+    Con DB_PGBOUNCER=true las conexiones pasan por un PgBouncer en modo transacción: sin sentencias preparadas con
+    nombre fijo ni parámetros de arranque. Las migraciones (advisory lock de sesión) usan DATABASE_DIRECT_URL.
+    Con DATABASE_REPLICA_URL se crea además un engine asíncrono de solo lectura contra una réplica
+    (AsyncReplicaSessionLocal), que usan los listados a través de replica.py.
+    Es importado por models.py, main.py y replica.py para establecer la conexión física con la base de datos.
 '''
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import NullPool
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+from uuid import uuid4
 import os
 
+from . import metrics, pool, profiler
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL, future=True)
+# URL del engine asíncrono; por defecto la misma DATABASE_URL con el driver asyncpg
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+
+# Pool de conexiones (por engine y por proceso)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Comprobar cada conexión al sacarla del pool (descarta las que ha cerrado la DB o la red, p. ej. tras un reinicio)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Segundos tras los que se renueva una conexión (antes de que la cierre un firewall o PgBouncer); -1 para no renovarlas
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Tiempo máximo de cada sentencia en ms (statement_timeout de PostgreSQL; 0 sin límite). No aplica a las migraciones
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# Sentencias preparadas que asyncpg cachea por conexión (0 para desactivarlo)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+# Conexiones a través de PgBouncer en modo transacción (pool_mode = transaction)
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+# Conexión directa a PostgreSQL (sin PgBouncer) para las migraciones; por defecto DATABASE_URL
+DATABASE_DIRECT_URL = os.getenv("DATABASE_DIRECT_URL")
+# Réplica de lectura para los listados (opcional; con cualquier driver, se usa con asyncpg)
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+
+
+def _pool_options(url: str, poolclass) -> dict:
+    # SQLite (scripts de utils sin DB) no usa QueuePool
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
+
+def _sync_connect_args(url: str) -> dict:
+    # PgBouncer no admite parámetros de arranque como options: el límite se fija por transacción (ver abajo)
+    if DB_STATEMENT_TIMEOUT_MS and not DB_PGBOUNCER and make_url(url).get_backend_name() == "postgresql":
+        return {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return {}
+
+
+def _async_connect_args(read_only: bool = False) -> dict:
+    if DB_PGBOUNCER:
+        # En modo transacción cada transacción puede ir a otra conexión del servidor: sin caché de sentencias
+        # preparadas y con nombres únicos para que no choquen con las de otro cliente
+        return {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+    settings = {}
+    if DB_STATEMENT_TIMEOUT_MS:
+        settings["statement_timeout"] = str(DB_STATEMENT_TIMEOUT_MS)
+    if read_only:
+        # Una réplica real ya es de solo lectura; así también falla cualquier escritura contra una réplica simulada
+        settings["default_transaction_read_only"] = "on"
+    args = {"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+    if settings:
+        args["server_settings"] = settings
+    return args
+
+
+_sync_pool_options = _pool_options(DATABASE_URL, pool.SyncPool)
+engine = create_engine(DATABASE_URL, future=True, connect_args=_sync_connect_args(DATABASE_URL), **_sync_pool_options)
+if isinstance(engine.pool, pool.SyncPool):
+    pool.instrument_pool(engine, _sync_pool_options["max_overflow"])
+if metrics.METRICS_ENABLED:
+    metrics.instrument_engine(engine, "sync")
+if profiler.SQL_PROFILE != "off":
+    profiler.instrument_engine(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# expire_on_commit=False: tras el commit los objetos se pueden serializar sin recargarlos (no hay lazy load en async)
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+AsyncReplicaSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
-def get_db():
+if DB_STATEMENT_TIMEOUT_MS and DB_PGBOUNCER:
+    @event.listens_for(Session, "after_begin")
+    def _set_statement_timeout(session, transaction, connection):
+        # SET LOCAL dura lo que la transacción, que es lo que PgBouncer mantiene en la misma conexión del servidor
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+
+_async_engine = None
+_async_replica_engine = None
+_direct_engine = None
+
+
+def _asyncpg_url(url: str) -> str:
+    return make_url(url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+
+def async_database_url() -> str:
+    if ASYNC_DATABASE_URL:
+        return ASYNC_DATABASE_URL
+    return _asyncpg_url(DATABASE_URL)
+
+
+def get_async_engine() -> AsyncEngine:
+    """Engine asíncrono del proceso, creado la primera vez que se usa"""
+    global _async_engine
+    if _async_engine is None:
+        options = _pool_options(async_database_url(), pool.AsyncPool)
+        _async_engine = create_async_engine(async_database_url(), connect_args=_async_connect_args(), **options)
+        if isinstance(_async_engine.pool, pool.AsyncPool):
+            pool.instrument_pool(_async_engine.sync_engine, options["max_overflow"])
+        if metrics.METRICS_ENABLED:
+            metrics.instrument_engine(_async_engine.sync_engine, "async")
+        if profiler.SQL_PROFILE != "off":
+            profiler.instrument_engine(_async_engine.sync_engine)
+        AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
+
+
+def get_async_replica_engine() -> Optional[AsyncEngine]:
+    """Engine asíncrono de la réplica de lectura (None sin DATABASE_REPLICA_URL), creado la primera vez que se usa"""
+    global _async_replica_engine
+    if _async_replica_engine is None and DATABASE_REPLICA_URL:
+        url = _asyncpg_url(DATABASE_REPLICA_URL)
+        options = _pool_options(url, pool.AsyncReplicaPool)
+        _async_replica_engine = create_async_engine(url, connect_args=_async_connect_args(read_only=True), **options)
+        if isinstance(_async_replica_engine.pool, pool.AsyncPool):
+            pool.instrument_pool(_async_replica_engine.sync_engine, options["max_overflow"])
+        if metrics.METRICS_ENABLED:
+            metrics.instrument_engine(_async_replica_engine.sync_engine, "async_replica")
+        if profiler.SQL_PROFILE != "off":
+            profiler.instrument_engine(_async_replica_engine.sync_engine)
+        AsyncReplicaSessionLocal.configure(bind=_async_replica_engine)
+    return _async_replica_engine
+
+
+async def dispose_async_engine():
+    global _async_engine, _async_replica_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+    if _async_replica_engine is not None:
+        await _async_replica_engine.dispose()
+        _async_replica_engine = None
+
+
+def get_direct_engine() -> Engine:
+    """Engine sin pool ni statement_timeout para las migraciones, conectado a DATABASE_DIRECT_URL si se indica"""
+    global _direct_engine
+    if _direct_engine is None:
+        _direct_engine = create_engine(DATABASE_DIRECT_URL or DATABASE_URL, future=True, poolclass=NullPool)
+    return _direct_engine
+
+
+async def get_db():
+    # Crear la sesión no abre conexión; solo si se llegó a usar hay que cerrarla (rollback) fuera del event loop
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        if db.in_transaction():
+            await run_in_threadpool(db.close)
+        else:
+            db.close()
+
+
+async def get_async_db():
+    get_async_engine()
+    async with AsyncSessionLocal() as db:
+        yield db
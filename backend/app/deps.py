@@ -1,15 +1,24 @@
 '''
 Dependencias/Seguridad
-    Contiene la función api_key_auth que valida que la API_KEY correcta esté presente en el encabezado de cada petición.
+    Contiene la función api_key_auth que valida que la API_KEY correcta esté presente en el encabezado de cada petición,
+    y events_token_auth para GET /events, que se consume con EventSource (no admite cabeceras): en la URL no va la
+    API_KEY sino un token firmado de corta duración que se pide antes con la API_KEY (POST /events/token).
     Es inyectado en los endpoints de main.py (vía Depends()) para proteger la API.
 '''
 
-from fastapi import HTTPException, status, Depends
+from typing import Tuple
+from fastapi import HTTPException, status, Depends, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import hashlib
+import hmac
 import os
+import time
 
 API_KEY = os.getenv("API_KEY")
 
+# Validez de los tokens de GET /events; solo se comprueba al conectar, así que la conexión abierta no caduca
+EVENTS_TOKEN_SECONDS = int(os.getenv("EVENTS_TOKEN_SECONDS", "60"))
+
 # Configurar HTTPBearer para que Swagger muestre el botón de autorización
 security = HTTPBearer()
 
@@ -26,4 +35,37 @@ def api_key_auth(credentials: HTTPAuthorizationCredentials = Depends(security)):
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    return token
\ No newline at end of file
+    return token
+
+
+def create_events_token() -> Tuple[str, int]:
+    """
+    Token de corta duración para GET /events: "{caduca}.{firma}", con la caducidad (epoch) firmada con HMAC-SHA256
+    y la API_KEY como clave. Devuelve (token, caduca).
+    """
+    expires = int(time.time()) + EVENTS_TOKEN_SECONDS
+    return f"{expires}.{_events_signature(expires)}", expires
+
+
+def _events_signature(expires: int) -> str:
+    return hmac.new(API_KEY.encode(), f"events:{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+def events_token_auth(token: str = Query(..., description="Token de POST /events/token (EventSource no permite enviar cabeceras)")):
+    """
+    Valida el token de GET /events recibido en el parámetro token de la URL (firma y caducidad).
+    """
+    expires, _, signature = token.partition(".")
+    valid = (
+        API_KEY is not None
+        and expires.isdigit()
+        and int(expires) >= time.time()
+        and hmac.compare_digest(signature, _events_signature(int(expires)))
+    )
+    if not valid:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+        )
+
+    return token
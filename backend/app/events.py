@@ -0,0 +1,218 @@
+'''
+Feed de cambios para el dashboard (Server-Sent Events)
+    Los endpoints, el webhook y la importación publican deltas pequeños (cliente o shipment creado/actualizado/borrado)
+    con pg_notify dentro de su propia transacción, así que solo se envían si se hace commit y llegan a todos los procesos.
+    Cada proceso mantiene una conexión asyncpg con LISTEN y reparte los deltas a sus suscriptores SSE (ChangeBroadcaster).
+    Los mismos deltas invalidan las cachés de cada proceso (customer_index.py y cache.py).
+    Es usado por main.py (GET /events), webhook.py e importer.py.
+'''
+
+from typing import AsyncIterable, Iterable, List, Optional, Type
+import asyncio
+import json
+import logging
+import os
+
+import asyncpg
+from pydantic import BaseModel
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .database import DATABASE_DIRECT_URL, async_database_url
+
+# Canal de LISTEN/NOTIFY
+CHANNEL = "dashboard_changes"
+
+# Mensajes pendientes por suscriptor; si se llena, el cliente recibe "resync" y recarga el snapshot
+CHANGE_FEED_QUEUE_SIZE = int(os.getenv("CHANGE_FEED_QUEUE_SIZE", "1000"))
+# Comentario SSE periódico para mantener viva la conexión a través de proxies
+CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv("CHANGE_FEED_HEARTBEAT_SECONDS", "15"))
+# Conexión del LISTEN; por defecto DATABASE_DIRECT_URL o la de la DB (no debe pasar por un PgBouncer en modo transacción)
+CHANGE_FEED_DATABASE_URL = os.getenv("CHANGE_FEED_DATABASE_URL")
+
+# Límite de NOTIFY en PostgreSQL: 8000 bytes por payload
+MAX_PAYLOAD_BYTES = 7500
+
+RESYNC = object()
+
+logger = logging.getLogger(__name__)
+
+_NOTIFY_SQL = text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload")
+
+
+def row_event(entity: str, schema: Type[BaseModel], obj, op: str = "upsert") -> dict:
+    """Delta con la fila completa, serializada como en la API"""
+    return {"entity": entity, "op": op, "data": schema.model_validate(obj).model_dump(mode="json")}
+
+
+def partial_event(entity: str, data: dict, op: str = "upsert") -> dict:
+    """Delta con solo algunos campos de la fila (siempre incluye el id)"""
+    return {"entity": entity, "op": op, "data": json.loads(json.dumps(data, default=_json_default))}
+
+
+def _json_default(value):
+    # datetime/time en ISO 8601 como en la API; UUID y demás como texto
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+def build_payloads(events: Iterable[dict]) -> List[str]:
+    """Agrupa los deltas en arrays JSON que caben en un NOTIFY"""
+    payloads, current, size = [], [], 2
+    for event in events:
+        encoded = json.dumps(event, separators=(",", ":"), ensure_ascii=False)
+        encoded_size = len(encoded.encode()) + 1
+        if current and size + encoded_size > MAX_PAYLOAD_BYTES:
+            payloads.append("[" + ",".join(current) + "]")
+            current, size = [], 2
+        current.append(encoded)
+        size += encoded_size
+    if current:
+        payloads.append("[" + ",".join(current) + "]")
+    return payloads
+
+
+def notify(db: Session, events: List[dict]):
+    """Publica los deltas en la transacción actual (se envían al hacer commit)"""
+    payloads = build_payloads(events)
+    if payloads:
+        db.execute(_NOTIFY_SQL, {"channel": CHANNEL, "payloads": payloads})
+
+
+async def async_notify(db: AsyncSession, events: List[dict]):
+    payloads = build_payloads(events)
+    if payloads:
+        await db.execute(_NOTIFY_SQL, {"channel": CHANNEL, "payloads": payloads})
+
+
+def listen_dsn() -> str:
+    url = make_url(CHANGE_FEED_DATABASE_URL or DATABASE_DIRECT_URL or async_database_url())
+    return url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+class ChangeBroadcaster:
+    """Reparte los NOTIFY recibidos por la conexión LISTEN del proceso a las colas de los suscriptores SSE"""
+
+    def __init__(self, dsn_factory=listen_dsn, queue_size: int = CHANGE_FEED_QUEUE_SIZE):
+        self.dsn_factory = dsn_factory
+        self.queue_size = queue_size
+        self._subscribers: set = set()
+        # Callbacks del proceso que reciben también los deltas (invalidación de customer_index y cache)
+        self._listeners: list = []
+        self._task: Optional[asyncio.Task] = None
+        self.received = 0
+        self.resyncs = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def add_listener(self, callback):
+        """callback(changes) con la lista de deltas de cada NOTIFY, o RESYNC si se han podido perder deltas"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def publish(self, message):
+        if self._listeners:
+            try:
+                changes = message if message is RESYNC else json.loads(message)
+            except ValueError:
+                changes = RESYNC
+            for callback in self._listeners:
+                try:
+                    callback(changes)
+                except Exception:
+                    logger.exception("Error en un listener del feed de cambios")
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Cliente demasiado lento: se descartan sus deltas y se le pide que recargue el snapshot
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
+                self.resyncs += 1
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.received += 1
+        self.publish(payload)
+
+    async def _listen(self):
+        backoff = 1
+        connected_before = False
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn_factory())
+                await conn.add_listener(CHANNEL, self._on_notify)
+                backoff = 1
+                if connected_before:
+                    # Mientras no había conexión se han podido perder deltas
+                    self.publish(RESYNC)
+                connected_before = True
+                # Comprobar periódicamente la conexión; si se pierde se reconecta
+                while True:
+                    await asyncio.sleep(CHANGE_FEED_HEARTBEAT_SECONDS)
+                    await conn.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Error en la conexión LISTEN del feed de cambios, se reintenta", extra={"error": str(e), "retry_seconds": backoff})
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if conn is not None:
+                    try:
+                        await conn.close(timeout=5)
+                    except Exception:
+                        pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def stream(self) -> AsyncIterable[str]:
+        """
+        Eventos SSE para un cliente: "ready" al suscribirse (el cliente carga entonces el snapshot),
+        "change" con un array de deltas por cada NOTIFY y "resync" si debe recargar el snapshot.
+        """
+        queue = self.subscribe()
+        try:
+            yield "retry: 3000\nevent: ready\ndata: {}\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=CHANGE_FEED_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is RESYNC:
+                    yield "event: resync\ndata: {}\n\n"
+                else:
+                    yield f"event: change\ndata: {message}\n\n"
+        finally:
+            self.unsubscribe(queue)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "listening": self._task is not None and not self._task.done(),
+            "received": self.received,
+            "resyncs": self.resyncs,
+        }
+
+
+broadcaster = ChangeBroadcaster()
@@ -0,0 +1,736 @@
+'''
+Importación masiva de pedidos
+    Convierte las filas del spreadsheet en clientes y shipments mediante operaciones por lotes:
+    primero parsea y valida todas las filas, después resuelve por lote los clientes (una consulta IN por teléfono)
+    e inserta clientes y shipments con INSERT multi-fila; los shipments ya existentes se descartan con
+    ON CONFLICT DO NOTHING sobre la restricción uq_shipment_dedup. Se hace un único commit por lote.
+    Con un origen (source), las filas cuya huella ya está en spreadsheet_row se saltan sin parsearlas, las importadas
+    guardan su huella en el commit de su lote y, si todos los lotes terminan bien, se registra la revisión importada.
+    Las filas llegan por bloques (iterable de listas) y pasan por un pipeline de generadores (numerar → saltar las no
+    modificadas → parsear y validar el bloque por columnas → resolver clientes, deduplicar e insertar), así que la memoria no crece con el
+    tamaño de la hoja; import_chunks() devuelve el progreso de cada lote y los errores se guardan hasta IMPORT_MAX_ERRORS.
+    Es usado por jobs.py (importaciones del spreadsheet y de ficheros subidos, ver uploads.py) y main.py.
+'''
+
+from dataclasses import dataclass
+from datetime import datetime, time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+import os
+import unicodedata
+import uuid
+
+from sqlalchemy import any_, delete, insert, literal, select, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from . import customer_index, events, models, spreadsheet
+from .models import MADRID_TZ, get_madrid_now
+
+logger = logging.getLogger(__name__)
+
+# Número de filas que se escriben en cada transacción
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "500"))
+
+# Mensajes de error que se devuelven como máximo (errors_total cuenta todos)
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100"))
+
+# Horario de entrega por defecto si el spreadsheet no lo indica
+DEFAULT_HOURS_OPEN = time(9, 0)
+DEFAULT_HOURS_CLOSE = time(22, 0)
+
+# Columnas que usa parse_row (las del Google Sheet) y otros nombres con los que pueden venir en los ficheros
+# subidos (CSV/XLSX/JSON, ver uploads.py); se comparan sin mayúsculas, tildes ni espacios sobrantes
+COLUMN_ALIASES = {
+    'Prefijo': ('prefijo', 'prefix', 'prefijo telefono'),
+    'Teléfono': ('telefono', 'phone', 'movil', 'tel'),
+    'Cliente': ('cliente', 'customer', 'nombre', 'name'),
+    'Apertura para entregas': ('apertura para entregas', 'apertura', 'delivery_hours_open', 'open'),
+    'Cierre para entregas': ('cierre para entregas', 'cierre', 'delivery_hours_close', 'close'),
+    'Fecha entrega': ('fecha entrega', 'fecha', 'delivery_date', 'date'),
+    'Hora entrega': ('hora entrega', 'hora', 'delivery_time', 'time'),
+    'Descripción': ('descripcion', 'description', 'pedido'),
+}
+
+
+def _normalize_header(name) -> str:
+    name = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode()
+    return " ".join(name.lower().split())
+
+
+_CANONICAL_COLUMNS = {alias: column for column, aliases in COLUMN_ALIASES.items() for alias in aliases}
+
+
+def canonical_column(name) -> str:
+    """Nombre de columna del spreadsheet que corresponde a una cabecera (la misma si no es ninguna conocida)"""
+    return _CANONICAL_COLUMNS.get(_normalize_header(name), str(name).strip())
+
+
+@dataclass
+class ParsedRow:
+    """Fila del spreadsheet ya parseada y validada"""
+    row_number: int
+    customer_name: str
+    phone: Optional[str]
+    delivery_hours_open: time
+    delivery_hours_close: time
+    has_hours: bool
+    description: str
+    planned_delivery_time: Optional[datetime]
+    error: Optional[str] = None
+    fingerprint: Optional[str] = None
+
+
+@dataclass
+class CreatedShipment:
+    """Shipment insertado en un lote, con los datos necesarios para notificar al cliente"""
+    row_number: int
+    shipment_id: uuid.UUID
+    customer_id: uuid.UUID
+    customer_name: str
+    phone: str
+    description: str
+    planned_delivery_time: datetime
+
+
+def new_results(processed: int) -> dict:
+    """Contadores que devuelve POST /spreadsheet/process"""
+    return {
+        "status": "success",
+        "processed": processed,
+        "customers_created": 0,
+        "customers_existing": 0,
+        "shipments_created": 0,
+        "shipments_skipped": 0,
+        "rows_unchanged": 0,
+        "chunks_failed": 0,
+        "whatsapp_queued": 0,
+        "whatsapp_errors": 0,
+        "errors_total": 0,
+        "errors": []
+    }
+
+
+def add_error(results: dict, message: str):
+    """Cuenta el error y guarda el mensaje solo si no se ha llegado a IMPORT_MAX_ERRORS"""
+    results["errors_total"] += 1
+    if len(results["errors"]) < IMPORT_MAX_ERRORS:
+        results["errors"].append(message)
+
+
+def progress_summary(results: dict) -> dict:
+    """Contadores de results sin la lista de errores (progreso de cada lote)"""
+    return {key: value for key, value in results.items() if key != "errors"}
+
+
+def parse_time(value: str) -> time:
+    """Parsea una hora HH:MM:SS o HH:MM"""
+    if len(value.split(':')) == 3:
+        return datetime.strptime(value, '%H:%M:%S').time()
+    return datetime.strptime(value, '%H:%M').time()
+
+
+def parse_row(row: dict, row_number: int) -> ParsedRow:
+    """
+    Parsea una fila del spreadsheet.
+    Si el teléfono está vacío la fila se descarta entera (phone=None).
+    Si la fecha/hora no es válida el cliente se procesa igualmente, pero no se crea el shipment (error).
+    """
+    # 1. Formatear teléfono usando el prefijo del spreadsheet
+    prefix = str(row.get('Prefijo', '34')).strip()
+    phone_number = str(row.get('Teléfono', '')).strip()
+
+    phone = None
+    if phone_number:
+        # Si el prefijo no tiene +, añadirlo
+        if not prefix.startswith('+'):
+            phone = f"+{prefix}{phone_number}"
+        else:
+            phone = f"{prefix}{phone_number}"
+
+    # 2. Parsear horarios de entrega (valores por defecto si no son válidos)
+    apertura_str = str(row.get('Apertura para entregas', '')).strip()
+    cierre_str = str(row.get('Cierre para entregas', '')).strip()
+
+    delivery_hours_open = DEFAULT_HOURS_OPEN
+    delivery_hours_close = DEFAULT_HOURS_CLOSE
+
+    if apertura_str:
+        try:
+            delivery_hours_open = parse_time(apertura_str)
+        except ValueError:
+            logger.warning(
+                "Horario no válido, usando valor por defecto",
+                extra={"row": row_number, "column": "Apertura para entregas", "value": apertura_str},
+            )
+
+    if cierre_str:
+        try:
+            delivery_hours_close = parse_time(cierre_str)
+        except ValueError:
+            logger.warning(
+                "Horario no válido, usando valor por defecto",
+                extra={"row": row_number, "column": "Cierre para entregas", "value": cierre_str},
+            )
+
+    # 3. Parsear fecha DD/MM/YYYY y hora (asumiendo zona horaria Europe/Madrid)
+    fecha_str = str(row.get('Fecha entrega', '')).strip()
+    hora_str = str(row.get('Hora entrega', '')).strip()
+
+    planned_time = None
+    error = None
+    try:
+        fecha = datetime.strptime(fecha_str, '%d/%m/%Y').date()
+        hora = parse_time(hora_str)
+        planned_time = datetime.combine(fecha, hora, tzinfo=MADRID_TZ)
+    except ValueError as e:
+        error = f"Fila {row_number}: Error parseando fecha/hora: {str(e)}"
+
+    return ParsedRow(
+        row_number=row_number,
+        customer_name=row.get('Cliente', 'Cliente sin nombre'),
+        phone=phone,
+        delivery_hours_open=delivery_hours_open,
+        delivery_hours_close=delivery_hours_close,
+        has_hours=bool(apertura_str or cierre_str),
+        description=str(row.get('Descripción', '')).strip(),
+        planned_delivery_time=planned_time,
+        error=error,
+    )
+
+
+@dataclass
+class ParsedChunk:
+    """
+    Bloque de filas parseado por columnas (una lista por campo, en el orden de las filas).
+    phones[i] es None si la fila no tiene teléfono (se descarta) y errors[i] es el error de fecha/hora
+    de la fila (se procesa el cliente, pero no se crea el shipment), como en parse_row.
+    """
+    row_numbers: List[int]
+    customer_names: List[str]
+    phones: List[Optional[str]]
+    delivery_hours_open: List[time]
+    delivery_hours_close: List[time]
+    has_hours: List[bool]
+    descriptions: List[str]
+    planned_delivery_times: List[Optional[datetime]]
+    errors: List[Optional[str]]
+    fingerprints: List[Optional[str]]
+
+    def rows(self) -> List[ParsedRow]:
+        """Filas con teléfono, como las devolvería parse_row"""
+        return [
+            ParsedRow(row_number, name, phone, hours_open, hours_close, has_hours, description, planned, error, fingerprint)
+            for row_number, name, phone, hours_open, hours_close, has_hours, description, planned, error, fingerprint in zip(
+                self.row_numbers, self.customer_names, self.phones, self.delivery_hours_open, self.delivery_hours_close,
+                self.has_hours, self.descriptions, self.planned_delivery_times, self.errors, self.fingerprints,
+            )
+            if phone is not None
+        ]
+
+
+# Horas y fechas ya parseadas (en una hoja se repiten mucho): texto -> (valor, mensaje de error)
+_PARSE_CACHE_SIZE = 10000
+_time_cache: Dict[str, tuple] = {}
+_planned_cache: Dict[Tuple[str, str], tuple] = {}
+
+
+def _cached_time(value: str) -> tuple:
+    cached = _time_cache.get(value)
+    if cached is None:
+        try:
+            cached = (parse_time(value), None)
+        except ValueError as e:
+            cached = (None, str(e))
+        if len(_time_cache) >= _PARSE_CACHE_SIZE:
+            _time_cache.clear()
+        _time_cache[value] = cached
+    return cached
+
+
+def _cached_planned(fecha_str: str, hora_str: str) -> tuple:
+    key = (fecha_str, hora_str)
+    cached = _planned_cache.get(key)
+    if cached is None:
+        try:
+            fecha = datetime.strptime(fecha_str, '%d/%m/%Y').date()
+            hora, error = _cached_time(hora_str)
+            if error is not None:
+                raise ValueError(error)
+            cached = (datetime.combine(fecha, hora, tzinfo=MADRID_TZ), None)
+        except ValueError as e:
+            cached = (None, str(e))
+        if len(_planned_cache) >= _PARSE_CACHE_SIZE:
+            _planned_cache.clear()
+        _planned_cache[key] = cached
+    return cached
+
+
+def _hours_column(values: List[str], row_numbers: List[int], column: str, default: time) -> List[time]:
+    parsed = []
+    for value, row_number in zip(values, row_numbers):
+        if not value:
+            parsed.append(default)
+            continue
+        hours, error = _cached_time(value)
+        if error is not None:
+            logger.warning("Horario no válido, usando valor por defecto", extra={"row": row_number, "column": column, "value": value})
+            hours = default
+        parsed.append(hours)
+    return parsed
+
+
+def _text_column(rows: List[dict], column: str, default: str) -> List[str]:
+    return [str(row.get(column, default)).strip() for row in rows]
+
+
+def parse_chunk(
+    rows: List[dict],
+    row_numbers: List[int],
+    fingerprints: Optional[List[Optional[str]]] = None,
+) -> ParsedChunk:
+    """
+    Parsea un bloque de filas columna a columna, con el mismo resultado que parse_row fila a fila.
+    Las horas y las fechas se parsean una vez por valor distinto (_cached_time/_cached_planned) y los errores
+    se devuelven en las columnas phones/errors en lugar de excepciones.
+    """
+    prefixes = _text_column(rows, 'Prefijo', '34')
+    numbers = _text_column(rows, 'Teléfono', '')
+    phones = [
+        (prefix if prefix.startswith('+') else '+' + prefix) + number if number else None
+        for prefix, number in zip(prefixes, numbers)
+    ]
+
+    apertura = _text_column(rows, 'Apertura para entregas', '')
+    cierre = _text_column(rows, 'Cierre para entregas', '')
+
+    planned_delivery_times = []
+    errors = []
+    for fecha_str, hora_str, row_number in zip(
+        _text_column(rows, 'Fecha entrega', ''), _text_column(rows, 'Hora entrega', ''), row_numbers
+    ):
+        planned, error = _cached_planned(fecha_str, hora_str)
+        planned_delivery_times.append(planned)
+        errors.append(None if error is None else f"Fila {row_number}: Error parseando fecha/hora: {error}")
+
+    return ParsedChunk(
+        row_numbers=list(row_numbers),
+        customer_names=[row.get('Cliente', 'Cliente sin nombre') for row in rows],
+        phones=phones,
+        delivery_hours_open=_hours_column(apertura, row_numbers, 'Apertura para entregas', DEFAULT_HOURS_OPEN),
+        delivery_hours_close=_hours_column(cierre, row_numbers, 'Cierre para entregas', DEFAULT_HOURS_CLOSE),
+        has_hours=[bool(a or c) for a, c in zip(apertura, cierre)],
+        descriptions=_text_column(rows, 'Descripción', ''),
+        planned_delivery_times=planned_delivery_times,
+        errors=errors,
+        fingerprints=list(fingerprints) if fingerprints is not None else [None] * len(rows),
+    )
+
+
+def last_revision(db: Session, source: str) -> Optional[str]:
+    """Revisión del origen importada por completo la última vez"""
+    return db.execute(
+        select(models.SpreadsheetSync.revision).where(models.SpreadsheetSync.source == source)
+    ).scalar()
+
+
+def mark_known(db: Session, source: str, fingerprints: List[str], seen_at: datetime) -> set:
+    """
+    Huellas de la lista que ya se importaron, marcadas como vistas en esta importación
+    (un solo UPDATE ... WHERE fingerprint = ANY(array) RETURNING).
+    """
+    if not fingerprints:
+        return set()
+    return set(db.execute(
+        update(models.SpreadsheetRow)
+        .where(
+            models.SpreadsheetRow.source == source,
+            models.SpreadsheetRow.fingerprint == any_(literal(fingerprints, ARRAY(models.SpreadsheetRow.fingerprint.type))),
+        )
+        .values(imported_at=seen_at)
+        .returning(models.SpreadsheetRow.fingerprint)
+    ).scalars())
+
+
+def _record_sync(db: Session, source: str, revision: Optional[str], started_at: datetime):
+    """Registra la revisión importada y olvida las huellas de filas que no se han visto en esta importación"""
+    db.execute(
+        delete(models.SpreadsheetRow).where(
+            models.SpreadsheetRow.source == source,
+            models.SpreadsheetRow.imported_at < started_at,
+        )
+    )
+    db.execute(
+        pg_insert(models.SpreadsheetSync)
+        .values(source=source, revision=revision, synced_at=get_madrid_now())
+        .on_conflict_do_update(
+            index_elements=[models.SpreadsheetSync.source],
+            set_={"revision": revision, "synced_at": get_madrid_now()},
+        )
+    )
+
+
+def _import_chunk(
+    db: Session,
+    chunk: List[ParsedRow],
+    known_customers: Dict[str, dict],
+    source: Optional[str] = None,
+) -> Tuple[Dict[str, dict], List[CreatedShipment], dict, List[str], set]:
+    """
+    Importa un lote de filas dentro de la transacción actual (sin hacer commit).
+    No modifica el estado del llamante: devuelve los clientes, shipments creados, contadores, errores
+    y teléfonos de los clientes creados o modificados del lote para que solo se incorporen si el commit tiene éxito.
+    Los shipments repetidos de lotes anteriores los descarta la DB (ON CONFLICT), sin guardar sus claves en memoria.
+    """
+    now = get_madrid_now()
+    counters = {"customers_created": 0, "customers_existing": 0, "shipments_created": 0, "shipments_skipped": 0}
+    errors: List[str] = []
+
+    # Clientes: los que están en el índice en memoria y, para el resto, una sola consulta IN
+    chunk_customers: Dict[str, dict] = {}
+    pending_phones = set()
+    for phone in {r.phone for r in chunk if r.phone not in known_customers}:
+        entry = customer_index.index.get(phone)
+        if entry is None:
+            pending_phones.add(phone)
+        else:
+            chunk_customers[phone] = {
+                "id": entry.id,
+                "name": entry.name,
+                "open": entry.delivery_hours_open,
+                "close": entry.delivery_hours_close,
+            }
+    if pending_phones:
+        generation = customer_index.index.generation()
+        existing = db.execute(
+            select(
+                models.Customer.id,
+                models.Customer.name,
+                models.Customer.phone,
+                models.Customer.delivery_hours_open,
+                models.Customer.delivery_hours_close,
+                models.Customer.timezone,
+            ).where(models.Customer.phone.in_(pending_phones))
+        ).all()
+        entries = []
+        for c in existing:
+            # Con teléfonos repetidos en la DB nos quedamos con el primero, como hacía .first()
+            if c.phone in chunk_customers:
+                continue
+            chunk_customers[c.phone] = {
+                "id": c.id,
+                "name": c.name,
+                "open": c.delivery_hours_open,
+                "close": c.delivery_hours_close,
+            }
+            entries.append(customer_index.CustomerEntry(
+                c.id, c.name, c.phone, c.delivery_hours_open, c.delivery_hours_close, c.timezone,
+            ))
+        customer_index.index.put_many(entries, generation)
+
+    new_phones = set()
+    updated_phones = set()
+    for r in chunk:
+        customer = chunk_customers.get(r.phone)
+        if customer is None and r.phone in known_customers:
+            customer = chunk_customers[r.phone] = dict(known_customers[r.phone])
+
+        if customer is None:
+            # Crear cliente nuevo con los datos de la primera fila en la que aparece
+            chunk_customers[r.phone] = {
+                "id": uuid.uuid4(),
+                "name": r.customer_name,
+                "open": r.delivery_hours_open,
+                "close": r.delivery_hours_close,
+            }
+            new_phones.add(r.phone)
+            counters["customers_created"] += 1
+            continue
+
+        # Actualizar horarios del cliente existente si están en el spreadsheet
+        if r.has_hours and (customer["open"], customer["close"]) != (r.delivery_hours_open, r.delivery_hours_close):
+            customer["open"] = r.delivery_hours_open
+            customer["close"] = r.delivery_hours_close
+            updated_phones.add(r.phone)
+        counters["customers_existing"] += 1
+
+    if new_phones:
+        db.execute(insert(models.Customer), [
+            {
+                "id": chunk_customers[phone]["id"],
+                "name": chunk_customers[phone]["name"],
+                "phone": phone,
+                "delivery_hours_open": chunk_customers[phone]["open"],
+                "delivery_hours_close": chunk_customers[phone]["close"],
+                "timezone": "Europe/Madrid",
+                "created_at": now,
+                "updated_at": now,
+            }
+            for phone in new_phones
+        ])
+
+    # Los clientes creados en este mismo lote ya se insertan con sus horarios finales
+    updates = [
+        {
+            "id": chunk_customers[phone]["id"],
+            "delivery_hours_open": chunk_customers[phone]["open"],
+            "delivery_hours_close": chunk_customers[phone]["close"],
+            "updated_at": now,
+        }
+        for phone in updated_phones - new_phones
+    ]
+    if updates:
+        db.execute(update(models.Customer), updates)
+
+    # Shipments: INSERT multi-fila con ON CONFLICT DO NOTHING sobre la clave de deduplicación;
+    # RETURNING indica cuáles se han insertado (el resto ya existían)
+    chunk_keys = set()
+    candidates: List[CreatedShipment] = []
+    for r in chunk:
+        if r.error:
+            errors.append(r.error)
+            continue
+        customer = chunk_customers[r.phone]
+        key = (customer["id"], r.description, r.planned_delivery_time)
+        if key in chunk_keys:
+            counters["shipments_skipped"] += 1
+            continue
+        chunk_keys.add(key)
+        candidates.append(CreatedShipment(
+            row_number=r.row_number,
+            shipment_id=uuid.uuid4(),
+            customer_id=customer["id"],
+            customer_name=customer["name"],
+            phone=r.phone,
+            description=r.description,
+            planned_delivery_time=r.planned_delivery_time,
+        ))
+
+    created: List[CreatedShipment] = []
+    if candidates:
+        stmt = pg_insert(models.Shipment).values([
+            {
+                "id": s.shipment_id,
+                "customer_id": s.customer_id,
+                "description": s.description,
+                "planned_delivery_time": s.planned_delivery_time,
+                "status": "pending",
+                "created_at": now,
+                "updated_at": now,
+            }
+            for s in candidates
+        ]).on_conflict_do_nothing(constraint="uq_shipment_dedup").returning(models.Shipment.id)
+        inserted_ids = set(db.execute(stmt).scalars())
+        created = [s for s in candidates if s.shipment_id in inserted_ids]
+    counters["shipments_created"] = len(created)
+    counters["shipments_skipped"] += len(candidates) - len(created)
+
+    # Deltas para el dashboard (GET /events); se envían al hacer commit del lote
+    changes = [
+        events.partial_event("customer", {
+            "id": chunk_customers[phone]["id"],
+            "name": chunk_customers[phone]["name"],
+            "phone": phone,
+            "delivery_hours_open": chunk_customers[phone]["open"],
+            "delivery_hours_close": chunk_customers[phone]["close"],
+            "timezone": "Europe/Madrid",
+            "created_at": now,
+            "updated_at": now,
+        })
+        for phone in new_phones
+    ]
+    changes += [events.partial_event("customer", u) for u in updates]
+    changes += [
+        events.partial_event("shipment", {
+            "id": s.shipment_id,
+            "customer_id": s.customer_id,
+            "description": s.description,
+            "planned_delivery_time": s.planned_delivery_time,
+            "status": "pending",
+            "created_at": now,
+            "updated_at": now,
+        })
+        for s in created
+    ]
+    events.notify(db, changes)
+
+    # Huellas de las filas importadas; las filas con error no se guardan y se vuelven a procesar (y notificar) la próxima vez
+    if source:
+        fingerprints = {r.fingerprint for r in chunk if r.fingerprint and not r.error}
+        if fingerprints:
+            db.execute(
+                pg_insert(models.SpreadsheetRow).values([
+                    {"source": source, "fingerprint": fingerprint, "imported_at": now}
+                    for fingerprint in fingerprints
+                ]).on_conflict_do_update(
+                    index_elements=[models.SpreadsheetRow.source, models.SpreadsheetRow.fingerprint],
+                    set_={"imported_at": now},
+                )
+            )
+
+    return chunk_customers, created, counters, errors, new_phones | updated_phones
+
+
+def _numbered(row_chunks: Iterable[List[dict]], skip_rows: int = 0) -> Iterator[List[Tuple[int, dict]]]:
+    """Numera las filas (1, 2, ...) a través de los bloques, descartando las skip_rows primeras"""
+    row_number = 0
+    for rows in row_chunks:
+        numbered = []
+        for row in rows:
+            row_number += 1
+            if row_number > skip_rows:
+                numbered.append((row_number, row))
+        if numbered:
+            yield numbered
+
+
+def _skip_unchanged(
+    db: Session,
+    chunks: Iterable[List[Tuple[int, dict]]],
+    results: dict,
+    source: Optional[str],
+    only_changed: bool,
+    started_at: datetime,
+) -> Iterator[List[Tuple[int, dict, Optional[str]]]]:
+    """Añade la huella de cada fila y, con only_changed, descarta las que ya se importaron"""
+    for chunk in chunks:
+        results["processed"] += len(chunk)
+        if not source:
+            yield [(row_number, row, None) for row_number, row in chunk]
+            continue
+        fingerprinted = [(row_number, row, spreadsheet.row_fingerprint(row)) for row_number, row in chunk]
+        if only_changed:
+            known = mark_known(db, source, list({f for _, _, f in fingerprinted}), started_at)
+            db.commit()
+            results["rows_unchanged"] += sum(1 for _, _, f in fingerprinted if f in known)
+            fingerprinted = [item for item in fingerprinted if item[2] not in known]
+        yield fingerprinted
+
+
+def _parse_chunks(
+    chunks: Iterable[List[Tuple[int, dict, Optional[str]]]],
+    results: dict,
+) -> Iterator[List[ParsedRow]]:
+    """Parsea y valida cada bloque de una pasada (parse_chunk); las filas sin teléfono se anotan como error"""
+    for chunk in chunks:
+        if not chunk:
+            yield []
+            continue
+        row_numbers, rows, fingerprints = zip(*chunk)
+        try:
+            parsed = parse_chunk(list(rows), list(row_numbers), list(fingerprints))
+        except Exception as e:
+            # Valor que no se puede convertir a texto: se parsean fila a fila para localizarlo
+            logger.warning(
+                "Error procesando el bloque de filas, se parsean fila a fila",
+                extra={"first_row": row_numbers[0], "last_row": row_numbers[-1], "error": str(e)},
+            )
+            yield list(_parse_rows(chunk, results))
+            continue
+        for row_number, phone in zip(parsed.row_numbers, parsed.phones):
+            if phone is None:
+                add_error(results, f"Fila {row_number}: Teléfono vacío")
+        yield parsed.rows()
+
+
+def _parse_rows(chunk: List[Tuple[int, dict, Optional[str]]], results: dict) -> Iterator[ParsedRow]:
+    for row_number, row, fingerprint in chunk:
+        try:
+            parsed_row = parse_row(row, row_number)
+        except Exception as e:
+            add_error(results, f"Fila {row_number}: Error procesando: {str(e)}")
+            logger.warning("Error procesando la fila", extra={"row": row_number, "error": str(e)})
+            continue
+        if parsed_row.phone is None:
+            add_error(results, f"Fila {row_number}: Teléfono vacío")
+            continue
+        parsed_row.fingerprint = fingerprint
+        yield parsed_row
+
+
+def import_chunks(
+    db: Session,
+    row_chunks: Iterable[List[dict]],
+    results: dict,
+    on_created: Optional[Callable[[List[CreatedShipment]], None]] = None,
+    source: Optional[str] = None,
+    revision: Optional[str] = None,
+    only_changed: bool = True,
+    skip_rows: int = 0,
+    started_at: Optional[datetime] = None,
+) -> Iterator[dict]:
+    """
+    Importa las filas del spreadsheet bloque a bloque (cada bloque de row_chunks es un lote con su commit),
+    actualizando los contadores de results, y devuelve el progreso (progress_summary) tras cada lote.
+    Tras el commit de cada lote se llama a on_created con los shipments creados en él
+    (por ejemplo, para encolar los WhatsApp).
+    Con source, solo se procesan las filas nuevas o modificadas desde la última importación (salvo only_changed=False)
+    y, si no falla ningún lote, se guarda revision como la última importada.
+    Un error leyendo row_chunks se propaga al llamante (y no se registra la revisión).
+    skip_rows descarta las primeras filas (ya importadas al retomar un trabajo interrumpido, ver jobs.py);
+    started_at es entonces el inicio del trabajo, para no olvidar las huellas marcadas antes de la interrupción.
+    """
+    started_at = started_at or get_madrid_now()
+    known_customers: Dict[str, dict] = {}
+    pipeline = _parse_chunks(_skip_unchanged(db, _numbered(row_chunks, skip_rows), results, source, only_changed, started_at), results)
+    for chunk in pipeline:
+        if chunk:
+            try:
+                chunk_customers, created, counters, errors, changed_phones = _import_chunk(db, chunk, known_customers, source)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                results["chunks_failed"] += 1
+                error_msg = f"Filas {chunk[0].row_number}-{chunk[-1].row_number}: Error procesando: {str(e)}"
+                add_error(results, error_msg)
+                logger.error(
+                    "Error procesando el lote de filas",
+                    extra={"first_row": chunk[0].row_number, "last_row": chunk[-1].row_number, "error": str(e)},
+                )
+            else:
+                if changed_phones:
+                    customer_index.index.invalidate(phones=changed_phones)
+                known_customers.update(chunk_customers)
+                for key, value in counters.items():
+                    results[key] += value
+                for error in errors:
+                    add_error(results, error)
+                if on_created and created:
+                    on_created(created)
+        yield progress_summary(results)
+
+    # Revisión importada (si un lote ha fallado se volverá a leer la hoja la próxima vez)
+    if source and not results["chunks_failed"]:
+        try:
+            _record_sync(db, source, revision, started_at)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error("Error registrando la revisión importada", extra={"source": source, "error": str(e)})
+
+
+def chunked(rows: Iterable[dict], chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[List[dict]]:
+    """Agrupa un iterable de filas en bloques de chunk_size"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_rows(
+    db: Session,
+    rows: Iterable[dict],
+    results: dict,
+    on_created: Optional[Callable[[List[CreatedShipment]], None]] = None,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    **options,
+) -> dict:
+    """Como import_chunks, para una lista (o iterable) de filas y sin progreso intermedio"""
+    for _ in import_chunks(db, chunked(rows, chunk_size), results, on_created, **options):
+        pass
+    return results
@@ -0,0 +1,407 @@
+'''
+Importaciones del spreadsheet en segundo plano
+    POST /spreadsheet/process solo registra un trabajo en la tabla import_job y responde con su id. Un worker (hilo)
+    por proceso reclama los trabajos pendientes con SELECT ... FOR UPDATE SKIP LOCKED, los ejecuta con
+    importer.import_chunks y guarda los contadores y un heartbeat tras cada lote (GET /spreadsheet/jobs/{id}).
+    Volver a enviar la hoja devuelve el trabajo pendiente o en curso, o el ya completado de la misma revisión.
+    Si un proceso se para a mitad de un trabajo, su heartbeat deja de avanzar y otro worker (o el mismo al reiniciar)
+    lo retoma después de la última fila importada. El heartbeat lo renueva un hilo aparte, para que un lote lento no
+    parezca un worker caído, y cada reclamación incrementa attempts: las escrituras del worker solo valen si attempts
+    sigue siendo el que reclamó, así que un worker al que le han retomado el trabajo se detiene en vez de pisarlo.
+    Las filas importadas y el ritmo (filas/segundo) del trabajo en curso se exponen también en GET /metrics.
+    Es usado por main.py.
+'''
+
+from datetime import timedelta
+from typing import Callable, List, Optional, Tuple
+import logging
+import os
+import threading
+import time
+import uuid
+
+from sqlalchemy import and_, case, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from . import importer, metrics, models, schemas, spreadsheet, uploads
+from .database import SessionLocal
+from .models import get_madrid_now
+
+# Cada cuánto busca el worker trabajos creados por otros procesos (los del propio proceso lo despiertan al momento)
+IMPORT_JOB_POLL_SECONDS = float(os.getenv("IMPORT_JOB_POLL_SECONDS", "5"))
+# Un trabajo en curso sin heartbeat durante este tiempo se considera abandonado y se retoma
+IMPORT_JOB_STALE_SECONDS = float(os.getenv("IMPORT_JOB_STALE_SECONDS", "60"))
+# Cada cuánto renueva el worker el heartbeat del trabajo en curso (debe ser bastante menor que IMPORT_JOB_STALE_SECONDS)
+IMPORT_JOB_HEARTBEAT_SECONDS = float(os.getenv("IMPORT_JOB_HEARTBEAT_SECONDS", "15"))
+# Intentos antes de marcar como fallido un trabajo que tumba al proceso que lo ejecuta
+IMPORT_JOB_MAX_ATTEMPTS = int(os.getenv("IMPORT_JOB_MAX_ATTEMPTS", "3"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+logger = logging.getLogger(__name__)
+
+
+class JobLost(Exception):
+    """Otro worker ha retomado el trabajo (su heartbeat se dio por perdido) y este debe dejarlo"""
+
+
+def new_job_results() -> dict:
+    results = importer.new_results(0)
+    results["sheet_unchanged"] = False
+    return results
+
+
+def find_job(db: Session, source: str, revision: Optional[str], full: bool) -> Optional[models.ImportJob]:
+    """
+    Trabajo pendiente o en curso del origen o, si no, el completado de la misma revisión (salvo full).
+    Un trabajo completado con lotes fallidos no cuenta: volver a enviar la hoja debe reintentar esas filas.
+    """
+    candidates = [models.ImportJob.status.in_(ACTIVE_STATUSES)]
+    if revision is not None and not full:
+        candidates.append(and_(
+            models.ImportJob.status == "completed",
+            models.ImportJob.revision == revision,
+            models.ImportJob.results["chunks_failed"].as_integer() == 0,
+        ))
+    return db.execute(
+        select(models.ImportJob)
+        .where(models.ImportJob.source == source, or_(*candidates))
+        .order_by(case((models.ImportJob.status.in_(ACTIVE_STATUSES), 0), else_=1), models.ImportJob.created_at.desc())
+        .limit(1)
+    ).scalar()
+
+
+def submit(
+    db: Session,
+    source: str,
+    revision: Optional[str],
+    full: bool,
+    on_created: Optional[Callable[[Session, uuid.UUID], None]] = None,
+) -> Tuple[models.ImportJob, bool]:
+    """
+    Crea un trabajo de importación, o devuelve el existente que ya cubre la petición.
+    Devuelve (trabajo, creado). El índice único parcial uq_import_job_active_source evita
+    que dos peticiones simultáneas creen dos trabajos activos para el mismo origen.
+    on_created(db, id) se llama antes del commit si se crea el trabajo (p. ej. para guardar su fichero subido),
+    así que ningún worker lo reclama sin él.
+    """
+    existing = find_job(db, source, revision, full)
+    if existing is not None:
+        db.commit()
+        return existing, False
+
+    job_id = db.execute(
+        pg_insert(models.ImportJob)
+        .values(
+            id=uuid.uuid4(),
+            source=source,
+            revision=revision,
+            full_import=full,
+            status="queued",
+            results=new_job_results(),
+            attempts=0,
+            created_at=get_madrid_now(),
+        )
+        .on_conflict_do_nothing(
+            index_elements=[models.ImportJob.source],
+            index_where=models.ImportJob.status.in_(ACTIVE_STATUSES),
+        )
+        .returning(models.ImportJob.id)
+    ).scalar()
+    if job_id is not None and on_created is not None:
+        on_created(db, job_id)
+    db.commit()
+    if job_id is None:
+        # Otra petición acaba de crear el trabajo activo
+        return find_job(db, source, revision, full), False
+    return db.get(models.ImportJob, job_id), True
+
+
+def job_source(db: Session, job: models.ImportJob):
+    """
+    Origen de las filas del trabajo: un fichero subido (upload:feed, copiado de la DB a un fichero local)
+    o el spreadsheet configurado, o None si ya no existe
+    """
+    if job.source.startswith("upload:"):
+        source = uploads.UploadSource(job.source.removeprefix("upload:"), job.revision, job.id)
+        return source if source.fetch(db) else None
+    source = spreadsheet.get_source()
+    return source if source.key == job.source else None
+
+
+def job_out(job: models.ImportJob) -> schemas.ImportJobOut:
+    """Estado del trabajo con el ritmo de importación (filas/segundo desde que empezó)"""
+    rows_per_second = None
+    if job.started_at is not None:
+        elapsed = ((job.finished_at or get_madrid_now()) - job.started_at).total_seconds()
+        if elapsed > 0:
+            rows_per_second = round(job.results.get("processed", 0) / elapsed, 1)
+    return schemas.ImportJobOut(
+        id=job.id,
+        status=job.status,
+        source=job.source,
+        revision=job.revision,
+        full_import=job.full_import,
+        results=job.results,
+        rows_per_second=rows_per_second,
+        error=job.error,
+        attempts=job.attempts,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        heartbeat_at=job.heartbeat_at,
+        finished_at=job.finished_at,
+    )
+
+
+class ImportJobRunner:
+    """
+    Worker (un hilo por proceso) que ejecuta los trabajos de import_job de uno en uno.
+    on_created(results, created) se llama tras el commit de cada lote con los shipments creados
+    (por ejemplo, para encolar los WhatsApp y actualizar los contadores de envío de results).
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal):
+        self.session_factory = session_factory
+        self.on_created: Optional[Callable[[dict, List[importer.CreatedShipment]], None]] = None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self, on_created: Optional[Callable[[dict, List[importer.CreatedShipment]], None]] = None):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self.on_created = on_created
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._loop, name="import-jobs", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """Detiene el worker; un trabajo en curso se interrumpe tras su lote actual y vuelve a la cola"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        self._stopping.set()
+        self._wake.set()
+        if thread is not None:
+            thread.join(timeout)
+
+    def wake(self):
+        """Avisa al worker de que hay un trabajo nuevo"""
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            # Se limpia antes de buscar, para no perder un aviso que llegue durante la búsqueda
+            self._wake.clear()
+            try:
+                claimed = self._claim()
+            except Exception as e:
+                logger.error("Error buscando trabajos de importación", extra={"error": str(e)})
+                claimed = None
+            if claimed is not None:
+                self._run(*claimed)
+                continue
+            self._wake.wait(IMPORT_JOB_POLL_SECONDS)
+
+    def _claim(self) -> Optional[Tuple[uuid.UUID, int]]:
+        """
+        Reclama el trabajo pendiente (o abandonado) más antiguo que no esté bloqueado por otro worker.
+        Devuelve (id, attempts): attempts identifica esta reclamación en las escrituras posteriores (ver _owned).
+        """
+        now = get_madrid_now()
+        candidate = (
+            select(models.ImportJob.id)
+            .where(or_(
+                models.ImportJob.status == "queued",
+                and_(
+                    models.ImportJob.status == "running",
+                    models.ImportJob.heartbeat_at < now - timedelta(seconds=IMPORT_JOB_STALE_SECONDS),
+                ),
+            ))
+            .order_by(models.ImportJob.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        db = self.session_factory()
+        try:
+            claimed = db.execute(
+                update(models.ImportJob)
+                .where(models.ImportJob.id == candidate)
+                .values(
+                    status="running",
+                    attempts=models.ImportJob.attempts + 1,
+                    started_at=func.coalesce(models.ImportJob.started_at, now),
+                    heartbeat_at=now,
+                )
+                .returning(models.ImportJob.id, models.ImportJob.attempts)
+            ).first()
+            db.commit()
+            return tuple(claimed) if claimed is not None else None
+        finally:
+            db.close()
+
+    @staticmethod
+    def _owned(job_id: uuid.UUID, attempts: int):
+        """Condición de las escrituras del worker: el trabajo sigue en curso con la reclamación attempts"""
+        return and_(
+            models.ImportJob.id == job_id,
+            models.ImportJob.status == "running",
+            models.ImportJob.attempts == attempts,
+        )
+
+    def _heartbeat(self, job_id: uuid.UUID, attempts: int, done: threading.Event, lost: threading.Event):
+        """Renueva el heartbeat del trabajo hasta done, aunque un lote tarde más que IMPORT_JOB_STALE_SECONDS"""
+        while not done.wait(IMPORT_JOB_HEARTBEAT_SECONDS):
+            db = self.session_factory()
+            try:
+                updated = db.execute(
+                    update(models.ImportJob)
+                    .where(self._owned(job_id, attempts))
+                    .values(heartbeat_at=get_madrid_now())
+                ).rowcount
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(
+                    "Error renovando el heartbeat del trabajo de importación", extra={"job_id": str(job_id), "error": str(e)}
+                )
+                continue
+            finally:
+                db.close()
+            if not updated:
+                lost.set()
+                return
+
+    def _run(self, job_id: uuid.UUID, attempts: int):
+        db = self.session_factory()
+        source = None
+        done, lost = threading.Event(), threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job_id, attempts, done, lost), name="import-jobs-heartbeat", daemon=True
+        )
+        heartbeat.start()
+        try:
+            job = db.get(models.ImportJob, job_id)
+            if attempts > IMPORT_JOB_MAX_ATTEMPTS:
+                self._finish(db, job_id, attempts, "failed", job.results, f"El trabajo se ha interrumpido {attempts - 1} veces")
+                return
+
+            source = job_source(db, job)
+            if source is None:
+                self._finish(db, job_id, attempts, "failed", job.results, f"El origen {job.source} ya no está configurado")
+                return
+
+            results = dict(job.results)
+            results["errors"] = list(results["errors"])
+            skip_rows = 0
+            if results["processed"]:
+                # Trabajo interrumpido: si la hoja no ha cambiado se sigue tras la última fila importada;
+                # si ha cambiado se empieza de nuevo (las filas ya importadas se saltan por su huella)
+                if job.revision is not None and job.revision == source.revision():
+                    skip_rows = results["processed"]
+                else:
+                    results = new_job_results()
+            db.commit()
+
+            if not job.full_import and job.revision is not None and job.revision == importer.last_revision(db, job.source):
+                results["sheet_unchanged"] = True
+                self._finish(db, job_id, attempts, "completed", results)
+                return
+
+            on_created = None
+            if self.on_created is not None:
+                on_created = lambda created: self.on_created(results, created)
+            progress = importer.import_chunks(
+                db,
+                source.iter_rows(importer.IMPORT_CHUNK_SIZE),
+                results,
+                on_created=on_created,
+                source=job.source,
+                revision=job.revision,
+                only_changed=not job.full_import,
+                skip_rows=skip_rows,
+                started_at=job.started_at,
+            )
+            run_started, run_processed = time.monotonic(), results["processed"]
+            processed = run_processed
+            for _ in progress:
+                metrics.IMPORT_ROWS.inc(results["processed"] - processed)
+                processed = results["processed"]
+                elapsed = time.monotonic() - run_started
+                if elapsed > 0:
+                    metrics.IMPORT_ROWS_PER_SECOND.set((processed - run_processed) / elapsed)
+                if lost.is_set():
+                    raise JobLost()
+                self._save(db, job_id, attempts, results)
+                if self._stopping.is_set():
+                    progress.close()
+                    self._requeue(db, job_id, attempts)
+                    return
+            self._finish(db, job_id, attempts, "completed", results)
+        except JobLost:
+            db.rollback()
+            logger.warning(
+                "Trabajo de importación retomado por otro worker; se abandona",
+                extra={"job_id": str(job_id), "attempts": attempts},
+            )
+        except Exception as e:
+            db.rollback()
+            logger.exception("Error en el trabajo de importación", extra={"job_id": str(job_id)})
+            self._finish(db, job_id, attempts, "failed", None, f"Error leyendo spreadsheet: {str(e)}")
+        finally:
+            done.set()
+            db.close()
+            if isinstance(source, uploads.UploadSource):
+                source.discard()
+
+    def _save(self, db: Session, job_id: uuid.UUID, attempts: int, results: dict):
+        updated = db.execute(
+            update(models.ImportJob)
+            .where(self._owned(job_id, attempts))
+            .values(results=results, heartbeat_at=get_madrid_now())
+        ).rowcount
+        db.commit()
+        if not updated:
+            raise JobLost()
+
+    def _requeue(self, db: Session, job_id: uuid.UUID, attempts: int):
+        # Parada ordenada: no cuenta como intento fallido
+        db.execute(
+            update(models.ImportJob)
+            .where(self._owned(job_id, attempts))
+            .values(status="queued", heartbeat_at=None, attempts=models.ImportJob.attempts - 1)
+        )
+        db.commit()
+
+    def _finish(
+        self, db: Session, job_id: uuid.UUID, attempts: int, status: str, results: Optional[dict], error: Optional[str] = None
+    ):
+        values = {"status": status, "error": error, "finished_at": get_madrid_now(), "heartbeat_at": get_madrid_now()}
+        if results is not None:
+            values["results"] = results
+        try:
+            updated = db.execute(update(models.ImportJob).where(self._owned(job_id, attempts)).values(**values)).rowcount
+            if updated:
+                # El fichero subido solo hace falta mientras el trabajo puede retomarse
+                uploads.delete_upload(db, job_id)
+            db.commit()
+            if not updated:
+                logger.warning(
+                    "Trabajo de importación retomado por otro worker; no se guarda su final",
+                    extra={"job_id": str(job_id), "status": status},
+                )
+                return
+            logger.info(
+                "Trabajo de importación terminado",
+                extra={"job_id": str(job_id), "status": status, "processed": (results or {}).get("processed"), "error": error},
+            )
+        except Exception as e:
+            db.rollback()
+            logger.error("Error guardando el estado del trabajo de importación", extra={"job_id": str(job_id), "error": str(e)})
+
+
+# Worker de importación del proceso
+runner = ImportJobRunner()
@@ -0,0 +1,74 @@
+'''
+Logs estructurados
+    Configura el logging de la app: por defecto una línea JSON por evento (time, level, logger, message y los campos
+    que se pasan en extra=), para poder filtrar y agregar los logs sin parsear texto; LOG_FORMAT=text los deja legibles
+    en desarrollo. Con JSON también se formatean así los logs de uvicorn (arranque, errores y accesos).
+    Los módulos usan logging.getLogger(__name__) y pasan los datos variables en extra=, no dentro del mensaje.
+    Es usado por main.py.
+'''
+
+from datetime import datetime, timezone
+import logging
+import os
+import sys
+
+import orjson
+
+# Nivel mínimo de los logs (DEBUG, INFO, WARNING, ERROR)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Formato de los logs: json (una línea JSON por evento) / text
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+
+# Atributos propios de LogRecord: el resto son los campos de extra=
+_RECORD_ATTRIBUTES = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime", "taskName"}
+
+_UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+# Librerías que registran cada petición HTTP en INFO: solo sus avisos y errores
+_QUIET_LOGGERS = ("twilio", "httpx", "httpcore")
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por evento con los campos de extra= al mismo nivel que el mensaje"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(data, default=str).decode()
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legible con los campos de extra= al final (key=value)"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = " ".join(f"{key}={value}" for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES)
+        return f"{line} {fields}" if fields else line
+
+
+def setup_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT):
+    """Configura el logger raíz (salida estándar) con el formato indicado; se puede llamar más de una vez"""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    for name in _QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    if log_format == "json":
+        # Uvicorn configura sus loggers antes de importar la app: se envían al raíz para que salgan en JSON
+        for name in _UVICORN_LOGGERS:
+            logger = logging.getLogger(name)
+            logger.handlers = []
+            logger.propagate = True
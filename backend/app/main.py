@@ -3,21 +3,28 @@
     Es el punto de entrada de todas las peticiones HTTP y maneja la lógica de negocio.
 '''
 
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Form
-from fastapi.responses import FileResponse, Response
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Form, Query
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select, true
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
 from typing import List
+from contextlib import asynccontextmanager
 from uuid import UUID
-from datetime import datetime, time, date
+from datetime import datetime, time, date, timedelta
+from time import perf_counter
 from zoneinfo import ZoneInfo
+import hashlib
 import os
-import re
+import tempfile
 
-from twilio.rest import Client
 from twilio.request_validator import RequestValidator
 
-from .database import Base, engine, get_db
+from .database import SessionLocal, get_db, get_async_db, get_async_engine, dispose_async_engine
 from . import models, schemas
 
 # Zona horaria por defecto
@@ -35,86 +42,175 @@ def normalize_to_madrid_tz(dt: datetime) -> datetime:
     else:
         # Si tiene timezone, convertir a Madrid
         return dt.astimezone(MADRID_TZ)
-from .deps import api_key_auth
-from . import spreadsheet
-
-# Crear tablas si no existen (en esta PoC; en serio usarías migraciones)
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="PoC Delivery Notification")
+from .deps import api_key_auth, create_events_token, events_token_auth
+from . import spreadsheet, importer, jobs, messaging, webhook, events, uploads, customer_index, cache, stats, serialization
+from . import logs, metrics, pool, profiler, replica
+from .migrate import run_migrations
+from .pagination import LIST_DEFAULT_LIMIT, LIST_MAX_LIMIT, async_paginated_response
+from .conditional import cache_headers, etag_matches, fingerprint_columns, make_etag, not_modified
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Aplicar las migraciones pendientes de la DB (ver migrate.py)
+    await run_in_threadpool(run_migrations)
+    get_async_engine()
+    # Crear los clientes Twilio del proceso, arrancar los workers de envío de WhatsApp y vaciar la cola al parar
+    messaging.init_twilio_clients()
+    messaging.dispatcher.start()
+    # Caché de clientes y shipments (memoria del proceso o compartida, ver cache.py)
+    cache.init_cache()
+    # Conexión LISTEN del feed de cambios del dashboard (GET /events); sus deltas invalidan también las cachés
+    events.broadcaster.add_listener(customer_index.index.on_change)
+    events.broadcaster.add_listener(cache.on_change)
+    events.broadcaster.start()
+    # Worker de las importaciones en segundo plano (retoma las pendientes o interrumpidas)
+    jobs.runner.start(notify_created)
+    # Compactación periódica de los resúmenes de GET /stats (ver stats.py)
+    stats.compactor.start()
+    yield
+    await stats.compactor.stop()
+    await run_in_threadpool(jobs.runner.stop)
+    await events.broadcaster.stop()
+    await cache.close_cache()
+    await run_in_threadpool(messaging.dispatcher.stop)
+    await messaging.close_twilio_clients()
+    await dispose_async_engine()
+
+
+# Logs estructurados (JSON por defecto, ver logs.py)
+logs.setup_logging()
+
+app = FastAPI(title="PoC Delivery Notification", lifespan=lifespan)
+
+# Compresión gzip de las respuestas grandes (listados JSON); no se aplica al feed SSE (text/event-stream)
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1000"))
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+
+# Latencia y consultas SQL por ruta (GET /metrics); se añade la última para medir también la compresión
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# Perfilador de SQL por petición (GET /debug/sql), solo si se activa con SQL_PROFILE
+if profiler.SQL_PROFILE != "off":
+    app.add_middleware(profiler.SqlProfilerMiddleware)
+
+# Read-your-writes con réplica de lectura: quien escribe lee de la DB principal durante unos segundos (ver replica.py)
+if replica.DATABASE_REPLICA_URL:
+    app.add_middleware(replica.ReadYourWritesMiddleware)
 
 # Servir archivos estáticos
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 if os.path.exists(static_dir):
     app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
-# Twilio config
-TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
-TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
-TWILIO_WHATSAPP_FROM = os.getenv("TWILIO_WHATSAPP_FROM")
-DISABLE_WHATSAPP = os.getenv("DISABLE_WHATSAPP", "false").lower() == "true"
-
-
-def get_twilio_client():
-    if not (TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN):
-        return None
-    return Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+# Twilio config (ver messaging.py)
+TWILIO_WHATSAPP_FROM = messaging.TWILIO_WHATSAPP_FROM
+DISABLE_WHATSAPP = messaging.DISABLE_WHATSAPP
+get_twilio_client = messaging.get_twilio_client
+
+
+def build_shipment_message(customer_name: str, description: str, planned_delivery_time: datetime) -> str:
+    """Construye el mensaje de WhatsApp que se envía al crear un shipment"""
+    # Formatear fecha y hora (convertir a Madrid si es necesario)
+    planned_time_madrid = normalize_to_madrid_tz(planned_delivery_time)
+    delivery_date = planned_time_madrid.strftime("%d/%m/%Y")
+    delivery_time_str = planned_time_madrid.strftime("%H:%M")
+
+    # Mensaje mejorado y más formal
+    return (
+        f"Estimado/a {customer_name},\n\n"
+        f"Le informamos que tenemos programada una entrega para su establecimiento:\n\n"
+        f"📦 *Pedido:* {description}\n"
+        f"📅 *Fecha:* {delivery_date}\n"
+        f"🕐 *Hora prevista:* {delivery_time_str}\n\n"
+        f"¿Podrá recibir la entrega en el horario indicado?\n\n"
+        f"Por favor, responda con *SI* o *NO* para confirmar."
+    )
 
 
 # ---------- CUSTOMER ENDPOINTS ----------
+# Los endpoints de CRUD, listados y webhook usan AsyncSession (get_async_db): no ocupan hilos del threadpool
+# Los listados y GET /stats usan get_async_read_db: leen de la réplica si está configurada (ver replica.py)
 
 @app.post("/customers", response_model=schemas.CustomerOut, dependencies=[Depends(api_key_auth)])
-def create_customer(customer_in: schemas.CustomerCreate, db: Session = Depends(get_db)):
+async def create_customer(customer_in: schemas.CustomerCreate, db: AsyncSession = Depends(get_async_db)):
     customer = models.Customer(**customer_in.model_dump())
     db.add(customer)
-    db.commit()
-    db.refresh(customer)
+    await db.flush()
+    await events.async_notify(db, [events.row_event("customer", schemas.CustomerOut, customer)])
+    await db.commit()
+    customer_index.index.invalidate(phones=[customer.phone])
     return customer
 
 
 @app.get("/customers", response_model=List[schemas.CustomerOut], dependencies=[Depends(api_key_auth)])
-def list_customers(db: Session = Depends(get_db)):
-    return db.query(models.Customer).all()
+async def list_customers(
+    request: Request,
+    cursor: str | None = None,
+    limit: int = Query(LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    db: AsyncSession = Depends(replica.get_async_read_db),
+):
+    """
+    Lista los clientes, más recientes primero, paginados por cursor.
+    Si hay más páginas, la cabecera X-Next-Cursor contiene el cursor de la siguiente.
+    Devuelve ETag; con If-None-Match responde 304 si la página no ha cambiado.
+    """
+    return await async_paginated_response(request, db, select(models.Customer), models.Customer, schemas.CustomerOut, cursor, limit)
 
 
 @app.get("/customers/{customer_id}", response_model=schemas.CustomerOut, dependencies=[Depends(api_key_auth)])
-def get_customer(customer_id: UUID, db: Session = Depends(get_db)):
-    customer = db.query(models.Customer).get(customer_id)
+async def get_customer(customer_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    """Cliente por id (se sirve de la caché, ver cache.py)"""
+    key = cache.entity_key("customer", customer_id)
+    cached = await cache.cache.get(key)
+    if cached is not None:
+        return cached
+    generation = cache.cache.generation()
+    customer = await db.get(models.Customer, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
-    return customer
+    data = schemas.CustomerOut.model_validate(customer).model_dump(mode="json")
+    await cache.cache.set(key, data, generation)
+    return data
 
 
 @app.put("/customers/{customer_id}", response_model=schemas.CustomerOut, dependencies=[Depends(api_key_auth)])
-def update_customer(customer_id: UUID, customer_upd: schemas.CustomerUpdate, db: Session = Depends(get_db)):
-    customer = db.query(models.Customer).get(customer_id)
+async def update_customer(customer_id: UUID, customer_upd: schemas.CustomerUpdate, db: AsyncSession = Depends(get_async_db)):
+    customer = await db.get(models.Customer, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
 
     for field, value in customer_upd.model_dump(exclude_unset=True).items():
         setattr(customer, field, value)
 
-    db.commit()
-    db.refresh(customer)
+    await db.flush()
+    await events.async_notify(db, [events.row_event("customer", schemas.CustomerOut, customer)])
+    await db.commit()
+    customer_index.index.invalidate(phones=[customer.phone], ids=[customer_id])
+    await cache.invalidate("customer", [customer_id])
     return customer
 
 
 @app.delete("/customers/{customer_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(api_key_auth)])
-def delete_customer(customer_id: UUID, db: Session = Depends(get_db)):
-    customer = db.query(models.Customer).get(customer_id)
+async def delete_customer(customer_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    customer = await db.get(models.Customer, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
-    db.delete(customer)
-    db.commit()
+    await db.delete(customer)
+    await events.async_notify(db, [events.partial_event("customer", {"id": customer_id}, op="delete")])
+    await db.commit()
+    customer_index.index.invalidate(ids=[customer_id])
+    await cache.invalidate("customer", [customer_id])
     return
 
 
 # ---------- SHIPMENT ENDPOINTS ----------
 
 @app.post("/shipments", response_model=schemas.ShipmentOut, dependencies=[Depends(api_key_auth)])
-def create_shipment(shipment_in: schemas.ShipmentCreate, db: Session = Depends(get_db)):
+async def create_shipment(shipment_in: schemas.ShipmentCreate, db: AsyncSession = Depends(get_async_db)):
     # comprobar customer
-    customer = db.query(models.Customer).get(shipment_in.customer_id)
+    customer = await db.get(models.Customer, shipment_in.customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
 
@@ -128,69 +224,125 @@ def create_shipment(shipment_in: schemas.ShipmentCreate, db: Session = Depends(g
         status="pending",
     )
     db.add(shipment)
-    db.commit()
-    db.refresh(shipment)
-
-    # enviar WhatsApp si está habilitado y hay teléfono
-    if not DISABLE_WHATSAPP and customer.phone and get_twilio_client():
-        # Formatear fecha y hora (convertir a Madrid si es necesario)
-        planned_time_madrid = normalize_to_madrid_tz(shipment.planned_delivery_time)
-        delivery_date = planned_time_madrid.strftime("%d/%m/%Y")
-        delivery_time_str = planned_time_madrid.strftime("%H:%M")
-        
-        # Mensaje mejorado y más formal
-        body = (
-            f"Estimado/a {customer.name},\n\n"
-            f"Le informamos que tenemos programada una entrega para su establecimiento:\n\n"
-            f"📦 *Pedido:* {shipment.description}\n"
-            f"📅 *Fecha:* {delivery_date}\n"
-            f"🕐 *Hora prevista:* {delivery_time_str}\n\n"
-            f"¿Podrá recibir la entrega en el horario indicado?\n\n"
-            f"Por favor, responda con *SI* o *NO* para confirmar."
-        )
-
-        client = get_twilio_client()
-        try:
-            # Nota: Los botones interactivos requieren plantillas aprobadas en Twilio
-            # Para el Sandbox, usamos mensaje de texto simple
-            # En producción, se puede usar Content API con plantillas que incluyan botones
-            message = client.messages.create(
-                from_=TWILIO_WHATSAPP_FROM,
-                to=f"whatsapp:{customer.phone}",
-                body=body,
-            )
-            interaction = models.DeliveryInteraction(
-                shipment_id=shipment.id,
-                channel="whatsapp",
-                direction="outbound",
-                content=body,
-                response_code=None,
-            )
-            db.add(interaction)
-            db.commit()
-            # Log éxito
-            print(f"WhatsApp enviado correctamente a {customer.phone} (Shipment ID: {shipment.id}, Message SID: {message.sid})")
-        except Exception as e:
-            # En PoC: log simple
-            print(f"Error enviando WhatsApp a {customer.phone}: {e}")
+    try:
+        await db.flush()
+    except IntegrityError:
+        # Restricción uq_shipment_dedup: ya existe un envío igual para ese cliente y hora
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Shipment already exists")
+    await events.async_notify(db, [events.row_event("shipment", schemas.ShipmentOut, shipment)])
+    await db.commit()
+
+    # encolar WhatsApp si está habilitado y hay teléfono (lo envía un worker de messaging.py)
+    if messaging.whatsapp_enabled() and customer.phone:
+        body = build_shipment_message(customer.name, shipment.description, shipment.planned_delivery_time)
+        # Nota: Los botones interactivos requieren plantillas aprobadas en Twilio
+        # Para el Sandbox, usamos mensaje de texto simple
+        # En producción, se puede usar Content API con plantillas que incluyan botones
+        messaging.dispatcher.enqueue(shipment.id, customer.phone, body)
 
     return shipment
 
 
 @app.get("/shipments/{shipment_id}", response_model=schemas.ShipmentOut, dependencies=[Depends(api_key_auth)])
-def get_shipment(shipment_id: UUID, db: Session = Depends(get_db)):
-    shipment = db.query(models.Shipment).get(shipment_id)
+async def get_shipment(shipment_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    """Shipment por id (se sirve de la caché, ver cache.py)"""
+    key = cache.entity_key("shipment", shipment_id)
+    cached = await cache.cache.get(key)
+    if cached is not None:
+        return cached
+    generation = cache.cache.generation()
+    shipment = await db.get(models.Shipment, shipment_id)
     if not shipment:
         raise HTTPException(status_code=404, detail="Shipment not found")
-    return shipment
+    data = schemas.ShipmentOut.model_validate(shipment).model_dump(mode="json")
+    await cache.cache.set(key, data, generation)
+    return data
 
 
-@app.get("/shipments", response_model=List[schemas.ShipmentOut], dependencies=[Depends(api_key_auth)])
-def list_shipments(customer_id: UUID | None = None, db: Session = Depends(get_db)):
-    query = db.query(models.Shipment)
+# Datos relacionados que GET /shipments puede incluir en cada envío (?include=customer,last_interaction)
+SHIPMENT_INCLUDES = ("customer", "last_interaction")
+
+
+def parse_include(include: str | None, allowed) -> set:
+    """Nombres de ?include= separados por comas; 400 si alguno no está permitido"""
+    names = {name.strip() for name in (include or "").split(",") if name.strip()}
+    unknown = names - set(allowed)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"include no válido: {', '.join(sorted(unknown))} (permitidos: {', '.join(allowed)})")
+    return names
+
+
+def with_shipment_includes(stmt, includes: set):
+    """
+    Añade a la consulta de envíos el cliente (JOIN) y la última interacción (LEFT JOIN LATERAL con LIMIT 1 por
+    el índice de delivery_interaction), así que la página se lee con una sola consulta sea cual sea su tamaño.
+    Devuelve la consulta y la versión de cada fila para el ETag (la más reciente de las fechas de las tres tablas).
+    """
+    versions = [models.Shipment.updated_at]
+    if "customer" in includes:
+        stmt = stmt.join(models.Customer, models.Customer.id == models.Shipment.customer_id).add_columns(models.Customer)
+        versions.append(models.Customer.updated_at)
+    if "last_interaction" in includes:
+        interaction = models.DeliveryInteraction
+        latest = (
+            select(interaction)
+            .where(interaction.shipment_id == models.Shipment.id)
+            .order_by(interaction.created_at.desc(), interaction.id.desc())
+            .limit(1)
+            .lateral()
+        )
+        last_interaction = aliased(interaction, latest, name="last_interaction")
+        stmt = stmt.outerjoin(last_interaction, true()).add_columns(last_interaction)
+        versions.append(last_interaction.created_at)
+    return stmt, func.greatest(*versions)
+
+
+def shipment_with_includes(row) -> dict:
+    """Fila (Shipment, Customer, last_interaction) de with_shipment_includes -> datos de ShipmentDetailOut"""
+    data = {name: getattr(row.Shipment, name) for name in schemas.ShipmentOut.model_fields}
+    data["customer"] = row._mapping.get("Customer")
+    data["last_interaction"] = row._mapping.get("last_interaction")
+    return data
+
+
+@app.get("/shipments", response_model=List[schemas.ShipmentDetailOut], dependencies=[Depends(api_key_auth)])
+async def list_shipments(
+    request: Request,
+    customer_id: UUID | None = None,
+    status: List[schemas.StatusType] = Query(default=[]),
+    planned_from: date | None = None,
+    planned_to: date | None = None,
+    cursor: str | None = None,
+    limit: int = Query(LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    include: str | None = Query(None, description="customer y/o last_interaction, separados por comas"),
+    db: AsyncSession = Depends(replica.get_async_read_db),
+):
+    """
+    Lista los envíos, más recientes primero, paginados por cursor.
+    Filtros opcionales: cliente, uno o varios estados y rango de fechas de entrega prevista (días en Europe/Madrid, ambos incluidos).
+    Con include=customer,last_interaction cada envío trae su cliente y su última interacción (null si no tiene),
+    leídos en la misma consulta que la página.
+    Si hay más páginas, la cabecera X-Next-Cursor contiene el cursor de la siguiente.
+    Devuelve ETag; con If-None-Match responde 304 si la página no ha cambiado.
+    """
+    includes = parse_include(include, SHIPMENT_INCLUDES)
+    stmt = select(models.Shipment)
     if customer_id:
-        query = query.filter(models.Shipment.customer_id == customer_id)
-    return query.all()
+        stmt = stmt.where(models.Shipment.customer_id == customer_id)
+    if status:
+        stmt = stmt.where(models.Shipment.status.in_(status))
+    if planned_from:
+        stmt = stmt.where(models.Shipment.planned_delivery_time >= datetime.combine(planned_from, time(0, 0), tzinfo=MADRID_TZ))
+    if planned_to:
+        stmt = stmt.where(models.Shipment.planned_delivery_time < datetime.combine(planned_to + timedelta(days=1), time(0, 0), tzinfo=MADRID_TZ))
+    if not includes:
+        return await async_paginated_response(request, db, stmt, models.Shipment, schemas.ShipmentOut, cursor, limit)
+    stmt, version = with_shipment_includes(stmt, includes)
+    return await async_paginated_response(
+        request, db, stmt, models.Shipment, schemas.ShipmentDetailOut, cursor, limit,
+        version=version, to_row=shipment_with_includes, exclude=set(SHIPMENT_INCLUDES) - includes,
+    )
 
 
 @app.get(
@@ -198,143 +350,66 @@ def list_shipments(customer_id: UUID | None = None, db: Session = Depends(get_db
     response_model=List[schemas.DeliveryInteractionOut],
     dependencies=[Depends(api_key_auth)],
 )
-def list_interactions(shipment_id: UUID, db: Session = Depends(get_db)):
-    shipment = db.query(models.Shipment).get(shipment_id)
-    if not shipment:
+async def list_interactions(shipment_id: UUID, request: Request, db: AsyncSession = Depends(replica.get_async_read_db)):
+    """
+    Interacciones de un envío. Devuelve ETag; con If-None-Match responde 304 si no hay interacciones nuevas.
+    """
+    # Existencia del envío y validador de sus interacciones en una sola consulta (las interacciones no se modifican)
+    interaction = models.DeliveryInteraction
+    state = (await db.execute(
+        select(
+            models.Shipment.id,
+            *fingerprint_columns(interaction.id, interaction.created_at, interaction.created_at, interaction.id),
+        )
+        .outerjoin(interaction, interaction.shipment_id == models.Shipment.id)
+        .where(models.Shipment.id == shipment_id)
+        .group_by(models.Shipment.id)
+    )).first()
+    if not state:
         raise HTTPException(status_code=404, detail="Shipment not found")
-    return shipment.interactions
+    etag = make_etag(state.rows, state.fingerprint)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    # Sin lazy load en async: las interacciones se leen con una consulta explícita, como tuplas de columnas
+    rows = (await db.execute(
+        select(*serialization.columns(interaction, schemas.DeliveryInteractionOut)).where(interaction.shipment_id == shipment_id)
+    )).all()
+    return Response(
+        content=serialization.dumps_list(rows, schemas.DeliveryInteractionOut),
+        media_type="application/json",
+        headers=cache_headers(etag),
+    )
 
 
 # ---------- TWILIO WEBHOOK ENDPOINT ----------
 
 @app.post("/twilio/incoming")
-async def twilio_incoming(request: Request, db: Session = Depends(get_db)):
+async def twilio_incoming(request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Webhook de Twilio para recibir mensajes entrantes de WhatsApp.
     NO requiere autenticación API_KEY porque Twilio valida con su propia firma.
     Maneja las respuestas del cliente y envía mensajes automáticos de confirmación.
+    El trabajo con la DB (una consulta y una transacción, ver webhook.py) usa AsyncSession.
+    La duración de extremo a extremo se mide por resultado (webhook_duration_seconds en GET /metrics).
     """
     from twilio.twiml.messaging_response import MessagingResponse
-    
-    form_data = await request.form()
-    from_number = form_data.get("From", "").replace("whatsapp:", "")
-    body = form_data.get("Body", "").strip().upper()
-    
-    # Crear respuesta TwiML
-    resp = MessagingResponse()
-    
-    if not from_number or not body:
-        resp.message("Error: No se pudo procesar su mensaje. Por favor, contacte con el servicio.")
-        return Response(content=str(resp), media_type="application/xml")
-    
-    # Buscar el cliente por número de teléfono
-    customer = db.query(models.Customer).filter(
-        models.Customer.phone == from_number
-    ).first()
-    
-    if not customer:
-        print(f"Cliente no encontrado para número: {from_number}")
-        resp.message("Lo sentimos, no encontramos su número en nuestro sistema.")
-        return Response(content=str(resp), media_type="application/xml")
-    
-    # Buscar el shipment pendiente más reciente del cliente
-    shipment = db.query(models.Shipment).filter(
-        models.Shipment.customer_id == customer.id,
-        models.Shipment.status == "pending"
-    ).order_by(models.Shipment.created_at.desc()).first()
-    
-    if not shipment:
-        print(f"No hay shipments pendientes para cliente: {customer.name}")
-        resp.message("No tenemos entregas pendientes de confirmación para su establecimiento.")
-        return Response(content=str(resp), media_type="application/xml")
-    
-    # Parsear respuesta: SI -> confirmed, NO -> rejected
-    response_normalized = re.sub(r'[^A-Z]', '', body)
-    new_status = None
-    
-    if "SI" in response_normalized or "SÍ" in response_normalized or "YES" in response_normalized:
-        new_status = "confirmed"
-    elif "NO" in response_normalized:
-        new_status = "rejected"
-    else:
-        # Respuesta no reconocida
-        interaction = models.DeliveryInteraction(
-            shipment_id=shipment.id,
-            channel="whatsapp",
-            direction="inbound",
-            content=body,
-            response_code="unknown",
-        )
-        db.add(interaction)
-        db.commit()
-        resp.message("Por favor, responda con *SI* o *NO* para confirmar la entrega.")
+
+    started = perf_counter()
+    outcome = "error"
+    try:
+        form_data = await request.form()
+        from_number = form_data.get("From", "").replace("whatsapp:", "")
+        body = form_data.get("Body", "").strip().upper()
+
+        reply, outcome = await webhook.handle_incoming_message(db, from_number, body)
+
+        # Crear respuesta TwiML
+        resp = MessagingResponse()
+        resp.message(reply)
         return Response(content=str(resp), media_type="application/xml")
-    
-    # Actualizar estado del shipment
-    shipment.status = new_status
-    db.commit()
-    db.refresh(shipment)
-    
-    # Registrar la interacción inbound
-    interaction = models.DeliveryInteraction(
-        shipment_id=shipment.id,
-        channel="whatsapp",
-        direction="inbound",
-        content=body,
-        response_code=new_status,
-    )
-    db.add(interaction)
-    db.commit()
-    
-    # Enviar respuesta automática según la respuesta del cliente
-    if new_status == "confirmed":
-        # Mensaje de confirmación/agradecimiento
-        confirmation_msg = (
-            f"Perfecto, {customer.name}.\n\n"
-            f"✅ Hemos confirmado su disponibilidad para recibir:\n"
-            f"📦 {shipment.description}\n"
-            f"🕐 {normalize_to_madrid_tz(shipment.planned_delivery_time).strftime('%d/%m/%Y a las %H:%M')}\n\n"
-            f"Gracias por su confirmación. Le esperamos en el horario indicado."
-        )
-        # Solo usar TwiML para responder (no enviar dos veces)
-        resp.message(confirmation_msg)
-        
-        # Registrar interacción de confirmación
-        confirm_interaction = models.DeliveryInteraction(
-            shipment_id=shipment.id,
-            channel="whatsapp",
-            direction="outbound",
-            content=confirmation_msg,
-            response_code="confirmation_sent",
-        )
-        db.add(confirm_interaction)
-        db.commit()
-        print(f"Mensaje de confirmación enviado a {customer.phone}")
-    
-    elif new_status == "rejected":
-        # Mensaje preguntando por horas alternativas (mockup)
-        alternative_msg = (
-            f"Entendido, {customer.name}.\n\n"
-            f"Lamentamos que el horario no le convenga.\n\n"
-            f"¿Podría indicarnos qué horarios le vendrían mejor para recibir la entrega?\n\n"
-            f"Por ejemplo: mañana por la mañana, esta tarde después de las 15:00, etc."
-        )
-        # Solo usar TwiML para responder (no enviar dos veces)
-        resp.message(alternative_msg)
-        
-        # Registrar interacción
-        alt_interaction = models.DeliveryInteraction(
-            shipment_id=shipment.id,
-            channel="whatsapp",
-            direction="outbound",
-            content=alternative_msg,
-            response_code="alternative_requested",
-        )
-        db.add(alt_interaction)
-        db.commit()
-        print(f"Mensaje de horas alternativas enviado a {customer.phone}")
-    
-    return Response(content=str(resp), media_type="application/xml")
+    finally:
+        metrics.WEBHOOK_SECONDS.labels(outcome).observe(perf_counter() - started)
 
 
 # ---------- DASHBOARD FRONTEND ----------
@@ -364,203 +439,239 @@ def read_spreadsheet_endpoint():
         )
 
 
-@app.post("/spreadsheet/process", dependencies=[Depends(api_key_auth)])
-def process_spreadsheet(db: Session = Depends(get_db)):
+def notify_created(results: dict, created):
+    """Encola los WhatsApp de los shipments creados por una importación (los envían los workers de messaging.py)"""
+    if not messaging.whatsapp_enabled():
+        return
+    for s in created:
+        body = build_shipment_message(s.customer_name, s.description, s.planned_delivery_time)
+        if messaging.dispatcher.enqueue(s.shipment_id, s.phone, body):
+            results["whatsapp_queued"] += 1
+        else:
+            importer.add_error(results, f"Fila {s.row_number}: Cola de WhatsApp llena, no se ha encolado el mensaje a {s.phone}")
+            results["whatsapp_errors"] += 1
+
+
+@app.post("/spreadsheet/process", response_model=schemas.ImportJobOut, status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(api_key_auth)])
+def process_spreadsheet(response: Response, full: bool = False, db: Session = Depends(get_db)):
     """
-    Lee el spreadsheet y crea shipments automáticamente.
-    Solo crea clientes y shipments si no existen ya.
+    Lanza la importación del spreadsheet en segundo plano y devuelve el trabajo (su id y estado) inmediatamente.
+    El progreso y el resultado se consultan en GET /spreadsheet/jobs/{id}.
+    Si ya hay una importación pendiente o en curso, o la revisión actual de la hoja ya se importó, devuelve ese trabajo (200).
+    Solo crea clientes y shipments si no existen ya, y solo procesa las filas nuevas o modificadas; full=true las procesa todas.
     """
+    source = spreadsheet.get_source()
     try:
-        rows = spreadsheet.read_spreadsheet()
+        revision = source.revision()
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error leyendo spreadsheet: {str(e)}"
         )
-    
-    results = {
-        "status": "success",
-        "processed": len(rows),
-        "customers_created": 0,
-        "customers_existing": 0,
-        "shipments_created": 0,
-        "shipments_skipped": 0,
-        "whatsapp_sent": 0,
-        "whatsapp_errors": 0,
-        "errors": []
-    }
-    
-    for idx, row in enumerate(rows):
-        try:
-            # 1. Formatear teléfono usando el prefijo del spreadsheet
-            prefix = str(row.get('Prefijo', '34')).strip()
-            phone_number = str(row.get('Teléfono', '')).strip()
-            
-            # Construir teléfono completo con prefijo
-            if phone_number:
-                # Si el prefijo no tiene +, añadirlo
-                if not prefix.startswith('+'):
-                    phone = f"+{prefix}{phone_number}"
-                else:
-                    phone = f"{prefix}{phone_number}"
-            else:
-                results["errors"].append(f"Fila {idx+1}: Teléfono vacío")
-                continue
-            
-            # 2. Parsear horarios de entrega del spreadsheet
-            apertura_str = row.get('Apertura para entregas', '').strip()
-            cierre_str = row.get('Cierre para entregas', '').strip()
-            
-            # Valores por defecto
-            delivery_hours_open = time(9, 0)
-            delivery_hours_close = time(22, 0)
-            
-            # Parsear apertura
-            if apertura_str:
-                try:
-                    if len(apertura_str.split(':')) == 3:
-                        delivery_hours_open = datetime.strptime(apertura_str, '%H:%M:%S').time()
-                    else:
-                        delivery_hours_open = datetime.strptime(apertura_str, '%H:%M').time()
-                except ValueError:
-                    print(f"Fila {idx+1}: Error parseando 'Apertura para entregas' ({apertura_str}), usando valor por defecto")
-            
-            # Parsear cierre
-            if cierre_str:
-                try:
-                    if len(cierre_str.split(':')) == 3:
-                        delivery_hours_close = datetime.strptime(cierre_str, '%H:%M:%S').time()
-                    else:
-                        delivery_hours_close = datetime.strptime(cierre_str, '%H:%M').time()
-                except ValueError:
-                    print(f"Fila {idx+1}: Error parseando 'Cierre para entregas' ({cierre_str}), usando valor por defecto")
-            
-            # 3. Buscar cliente por teléfono (SOLO SI NO EXISTE)
-            customer = db.query(models.Customer).filter(
-                models.Customer.phone == phone
-            ).first()
-            
-            if not customer:
-                # Crear cliente nuevo
-                customer = models.Customer(
-                    name=row.get('Cliente', 'Cliente sin nombre'),
-                    phone=phone,
-                    delivery_hours_open=delivery_hours_open,
-                    delivery_hours_close=delivery_hours_close,
-                    timezone="Europe/Madrid",
-                )
-                db.add(customer)
-                db.commit()
-                db.refresh(customer)
-                results["customers_created"] += 1
-            else:
-                # Actualizar horarios del cliente existente si están en el spreadsheet
-                if apertura_str or cierre_str:
-                    customer.delivery_hours_open = delivery_hours_open
-                    customer.delivery_hours_close = delivery_hours_close
-                    db.commit()
-                results["customers_existing"] += 1
-            
-            # 4. Parsear fecha y hora (asumiendo zona horaria Europe/Madrid)
-            fecha_str = row.get('Fecha entrega', '').strip()
-            hora_str = row.get('Hora entrega', '').strip()
-            
-            try:
-                # Parsear fecha DD/MM/YYYY
-                fecha = datetime.strptime(fecha_str, '%d/%m/%Y').date()
-                # Parsear hora HH:MM:SS o HH:MM
-                if len(hora_str.split(':')) == 3:
-                    hora = datetime.strptime(hora_str, '%H:%M:%S').time()
-                else:
-                    hora = datetime.strptime(hora_str, '%H:%M').time()
-                
-                # Combinar fecha y hora y asignar zona horaria Europe/Madrid
-                planned_time = datetime.combine(fecha, hora, tzinfo=ZoneInfo("Europe/Madrid"))
-            except ValueError as e:
-                results["errors"].append(f"Fila {idx+1}: Error parseando fecha/hora: {str(e)}")
-                continue
-            
-            # 5. Verificar si el shipment ya existe (SOLO SI NO EXISTE)
-            description = row.get('Descripción', '').strip()
-            existing_shipment = db.query(models.Shipment).filter(
-                models.Shipment.customer_id == customer.id,
-                models.Shipment.description == description,
-                models.Shipment.planned_delivery_time == planned_time
-            ).first()
-            
-            if existing_shipment:
-                results["shipments_skipped"] += 1
-                continue
-            
-            # 6. Crear shipment
-            shipment = models.Shipment(
-                customer_id=customer.id,
-                description=description,
-                planned_delivery_time=planned_time,
-                status="pending",
-            )
-            db.add(shipment)
-            db.commit()
-            db.refresh(shipment)
-            results["shipments_created"] += 1
-            
-            # 7. Enviar WhatsApp si está habilitado
-            if not DISABLE_WHATSAPP and customer.phone and get_twilio_client():
-                # Formatear fecha y hora (convertir a Madrid si es necesario)
-                planned_time_madrid = normalize_to_madrid_tz(shipment.planned_delivery_time)
-                delivery_date = planned_time_madrid.strftime("%d/%m/%Y")
-                delivery_time_str = planned_time_madrid.strftime("%H:%M")
-                
-                # Mensaje mejorado y más formal
-                body = (
-                    f"Estimado/a {customer.name},\n\n"
-                    f"Le informamos que tenemos programada una entrega para su establecimiento:\n\n"
-                    f"📦 *Pedido:* {shipment.description}\n"
-                    f"📅 *Fecha:* {delivery_date}\n"
-                    f"🕐 *Hora prevista:* {delivery_time_str}\n\n"
-                    f"¿Podrá recibir la entrega en el horario indicado?\n\n"
-                    f"Por favor, responda con *SI* o *NO* para confirmar."
-                )
-                
-                client = get_twilio_client()
-                try:
-                    message = client.messages.create(
-                        from_=TWILIO_WHATSAPP_FROM,
-                        to=f"whatsapp:{customer.phone}",
-                        body=body,
-                    )
-                    # Registrar interacción
-                    interaction = models.DeliveryInteraction(
-                        shipment_id=shipment.id,
-                        channel="whatsapp",
-                        direction="outbound",
-                        content=body,
-                        response_code=None,
-                    )
-                    db.add(interaction)
-                    db.commit()
-                    results["whatsapp_sent"] += 1
-                    # Log éxito
-                    success_msg = f"Fila {idx+1}: WhatsApp enviado correctamente a {customer.phone} (Shipment ID: {shipment.id}, Message SID: {message.sid})"
-                    print(success_msg)
-                except Exception as e:
-                    # Log error pero continuar
-                    error_msg = f"Fila {idx+1}: Error enviando WhatsApp a {customer.phone}: {str(e)}"
-                    results["errors"].append(error_msg)
-                    results["whatsapp_errors"] += 1
-                    print(f"Error enviando WhatsApp: {e}")
-        
-        except Exception as e:
-            error_msg = f"Fila {idx+1}: Error procesando: {str(e)}"
-            results["errors"].append(error_msg)
-            print(f"Error procesando fila {idx+1}: {e}")
-            continue
-    
-    return results
+
+    job, created = jobs.submit(db, source.key, revision, full)
+    if created:
+        jobs.runner.wake()
+    else:
+        response.status_code = status.HTTP_200_OK
+    response.headers["Location"] = f"/spreadsheet/jobs/{job.id}"
+    return jobs.job_out(job)
+
+
+@app.get("/spreadsheet/jobs/{job_id}", response_model=schemas.ImportJobOut, dependencies=[Depends(api_key_auth)])
+async def get_import_job(job_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    """
+    Estado de una importación: queued / running / completed / failed, con los contadores (filas procesadas,
+    clientes y shipments creados u omitidos, WhatsApp encolados, errores) y el ritmo en filas/segundo.
+    """
+    job = await db.get(models.ImportJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return jobs.job_out(job)
+
+
+def submit_upload(feed: str, revision: str, full: bool, path: str):
+    """
+    Registra el trabajo de un fichero recibido en path y, si se crea, lo guarda en la DB con él (uploads.store_upload).
+    Devuelve (trabajo serializado, creado), o None si otro fichero del mismo feed se está importando todavía.
+    """
+    source = uploads.UploadSource(feed, revision)
+    db = SessionLocal()
+    try:
+        job, created = jobs.submit(
+            db, source.key, revision, full, on_created=lambda db, job_id: uploads.store_upload(db, job_id, path)
+        )
+        if not created and job.status in jobs.ACTIVE_STATUSES and job.revision != revision:
+            return None
+        return jobs.job_out(job), created
+    finally:
+        db.close()
+
+
+@app.post("/imports/upload", response_model=schemas.ImportJobOut, status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(api_key_auth)])
+async def upload_import(
+    request: Request,
+    response: Response,
+    feed: str = "default",
+    format: str = Query(None, description="csv, xlsx o json (por defecto según el Content-Type)"),
+    full: bool = False,
+):
+    """
+    Importa un fichero CSV, XLSX o JSON (array de objetos) con las columnas del spreadsheet, enviado como cuerpo de la petición.
+    El fichero se guarda según llega, sin cargarlo en memoria, se copia a la DB con su trabajo (cualquier proceso puede
+    importarlo) y se importa en segundo plano como POST /spreadsheet/process:
+    devuelve el trabajo (GET /spreadsheet/jobs/{id}). Subir otra vez el mismo fichero devuelve el trabajo ya hecho (200).
+    """
+    fmt = uploads.detect_format(format, request.headers.get("content-type"))
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="Formato no soportado: indique format=csv, xlsx o json")
+    if not uploads.valid_feed(feed):
+        raise HTTPException(status_code=400, detail="Nombre de feed no válido")
+
+    await run_in_threadpool(os.makedirs, uploads.IMPORT_UPLOAD_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=uploads.IMPORT_UPLOAD_DIR, suffix=".part")
+    f = os.fdopen(fd, "wb")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > uploads.IMPORT_UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="Fichero demasiado grande")
+            digest.update(chunk)
+            await run_in_threadpool(f.write, chunk)
+        f.close()
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Fichero vacío")
+        revision = f"{digest.hexdigest()}.{fmt}"
+        submitted = await run_in_threadpool(submit_upload, feed, revision, full, tmp_path)
+    finally:
+        # El fichero del trabajo queda en la DB; la copia local solo hace falta hasta aquí
+        f.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if submitted is None:
+        raise HTTPException(status_code=409, detail=f"Ya hay otro fichero del feed {feed} importándose")
+    job, created = submitted
+    if created:
+        jobs.runner.wake()
+    else:
+        response.status_code = status.HTTP_200_OK
+    response.headers["Location"] = f"/spreadsheet/jobs/{job.id}"
+    return job
+
+
+@app.post("/events/token", dependencies=[Depends(api_key_auth)])
+async def change_feed_token():
+    """Token de corta duración para conectar a GET /events (ver deps.create_events_token)"""
+    token, expires = create_events_token()
+    return {"token": token, "expires_at": expires}
+
+
+@app.get("/events", dependencies=[Depends(events_token_auth)])
+async def change_feed():
+    """
+    Feed de cambios del dashboard (Server-Sent Events).
+    Envía "ready" al conectar (momento de cargar el snapshot con GET /shipments y GET /customers),
+    "change" con un array de deltas {entity, op, data} por cada cambio confirmado en la DB,
+    y "resync" si el cliente debe volver a cargar el snapshot.
+    EventSource no permite cabeceras, así que se autentica con el parámetro token (POST /events/token),
+    no con la API_KEY, que quedaría en los logs de los proxies y en el historial.
+    """
+    return StreamingResponse(
+        events.broadcaster.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/stats", response_model=schemas.StatsOut, dependencies=[Depends(api_key_auth)])
+async def get_stats(
+    date_from: date | None = None,
+    date_to: date | None = None,
+    customer_id: UUID | None = None,
+    db: AsyncSession = Depends(replica.get_async_read_db),
+):
+    """
+    Indicadores para el dashboard: envíos por estado (totales), por día de entrega prevista y estado entre date_from y
+    date_to (por defecto desde STATS_DEFAULT_DAYS días antes de hoy hasta otros tantos después), por cliente
+    (los STATS_TOP_CUSTOMERS con más envíos, o solo customer_id) y latencia de confirmación: tiempo desde el WhatsApp
+    de aviso hasta la respuesta SI/NO, de las respuestas recibidas en el periodo.
+    Se leen de tablas de resumen que la DB mantiene al escribir, así que no recorre los envíos.
+    """
+    default_from, default_to = stats.default_period()
+    date_from = date_from or default_from
+    date_to = date_to or default_to
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="date_to no puede ser anterior a date_from")
+    if (date_to - date_from).days + 1 > stats.STATS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"El periodo no puede superar {stats.STATS_MAX_DAYS} días")
+    return await stats.shipment_stats(db, date_from, date_to, customer_id)
+
+
+@app.get("/whatsapp/queue", dependencies=[Depends(api_key_auth)])
+def whatsapp_queue_stats():
+    """
+    Estado de la cola de WhatsApp: mensajes encolados, enviados, con error, rechazados (cola llena) y pendientes.
+    """
+    return messaging.dispatcher.stats()
+
+
+@app.get("/metrics", dependencies=[Depends(api_key_auth)])
+def prometheus_metrics():
+    """
+    Métricas en el formato de Prometheus: latencia y consultas SQL por ruta, consultas SQL, envíos a Twilio,
+    cola de WhatsApp, importaciones y webhook (ver metrics.py).
+    """
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Las métricas están desactivadas (METRICS_ENABLED=false)")
+    content, media_type = metrics.latest()
+    return Response(content=content, media_type=media_type)
+
+
+@app.get("/debug/sql", dependencies=[Depends(api_key_auth)])
+def sql_profile():
+    """
+    Perfil de SQL de las peticiones perfiladas (SQL_PROFILE=header/all): sentencias por ruta con sus ejecuciones,
+    tiempo y repeticiones N+1, las últimas peticiones y las consultas más lentas con su plan de EXPLAIN ANALYZE.
+    """
+    if profiler.SQL_PROFILE == "off":
+        raise HTTPException(status_code=404, detail="El perfilador de SQL está desactivado (SQL_PROFILE=off)")
+    return profiler.profiler.snapshot()
+
+
+@app.delete("/debug/sql", status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(api_key_auth)])
+def reset_sql_profile():
+    """
+    Vacía el perfil de SQL acumulado (por ejemplo, antes de repetir una prueba).
+    """
+    if profiler.SQL_PROFILE == "off":
+        raise HTTPException(status_code=404, detail="El perfilador de SQL está desactivado (SQL_PROFILE=off)")
+    profiler.profiler.reset()
+    return
+
+
+@app.get("/db/pool", dependencies=[Depends(api_key_auth)])
+def db_pool_stats():
+    """
+    Estado de los pools de conexiones de cada engine (sync: psycopg2, async: asyncpg): tamaño, conexiones libres,
+    en uso y de desbordamiento, salidas con su espera media y máxima, timeouts, conexiones abiertas e invalidadas.
+    """
+    return pool.pool_stats()
+
+
+@app.get("/cache/stats", dependencies=[Depends(api_key_auth)])
+def cache_stats():
+    """
+    Estado de las cachés del proceso: índice de clientes por teléfono y caché de clientes/shipments por id
+    (entradas, aciertos, fallos, descartes LRU, invalidaciones y, con Redis, errores).
+    """
+    return {"customer_index": customer_index.index.stats(), "entities": cache.cache.stats()}
 
 
 @app.post("/test/whatsapp", dependencies=[Depends(api_key_auth)])
-def test_whatsapp(phone: str, db: Session = Depends(get_db)):
+async def test_whatsapp(phone: str):
     """
     Endpoint de prueba para enviar un WhatsApp a un número específico.
     Útil para verificar que Twilio Sandbox está configurado correctamente.
@@ -585,11 +696,21 @@ def test_whatsapp(phone: str, db: Session = Depends(get_db)):
     body = "🧪 Mensaje de prueba desde Zarracina Delivery. Si recibes esto, Twilio Sandbox está funcionando correctamente."
     
     try:
-        message = client.messages.create(
-            from_=TWILIO_WHATSAPP_FROM,
-            to=f"whatsapp:{phone}",
-            body=body,
-        )
+        # Con TWILIO_ASYNC_HTTP=true se envía sin ocupar un hilo del threadpool
+        async_client = messaging.get_async_twilio_client()
+        if async_client:
+            message = await async_client.messages.create_async(
+                from_=TWILIO_WHATSAPP_FROM,
+                to=f"whatsapp:{phone}",
+                body=body,
+            )
+        else:
+            message = await run_in_threadpool(
+                client.messages.create,
+                from_=TWILIO_WHATSAPP_FROM,
+                to=f"whatsapp:{phone}",
+                body=body,
+            )
         return {
             "status": "success",
             "message": "WhatsApp enviado correctamente",
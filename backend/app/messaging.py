@@ -0,0 +1,592 @@
+'''
+Envío de WhatsApp (Twilio)
+    Contiene la configuración de Twilio y una cola de salida en memoria con un pool de workers que envían los mensajes
+    en segundo plano: los endpoints solo encolan y responden inmediatamente, y los workers registran la
+    DeliveryInteraction cuando el envío se completa.
+    El cliente de Twilio se crea una sola vez por proceso, con un pool de conexiones keep-alive (y opcionalmente
+    un cliente con transporte asíncrono para endpoints async).
+    El cliente que devuelve get_twilio_client() limita los envíos con un token bucket (ver ratelimit.py) y reintenta
+    con backoff exponencial y jitter las respuestas 429/5xx de Twilio; las métricas de espera en cola, espera por
+    el límite y tiempo de envío se exponen en GET /whatsapp/queue, y la latencia y el resultado de cada llamada a
+    Twilio y de cada mensaje también en GET /metrics (ver metrics.py).
+    Incluye un cliente Twilio falso (WHATSAPP_SENDER=fake) para probar la cola sin conexión.
+    Es usado por main.py (create_shipment, process_spreadsheet y /test/whatsapp).
+'''
+
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+from uuid import UUID
+import asyncio
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+
+from requests.adapters import HTTPAdapter
+from sqlalchemy import exc, insert
+from twilio.base.exceptions import TwilioRestException
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client
+
+from . import metrics, models
+from .database import SessionLocal
+from .ratelimit import TokenBucket, PostgresTokenBucket, backoff_delay
+
+# Twilio config
+TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
+TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+TWILIO_WHATSAPP_FROM = os.getenv("TWILIO_WHATSAPP_FROM")
+DISABLE_WHATSAPP = os.getenv("DISABLE_WHATSAPP", "false").lower() == "true"
+
+# Cola de salida
+WHATSAPP_SENDER = os.getenv("WHATSAPP_SENDER", "twilio").lower()  # twilio / fake
+WHATSAPP_WORKERS = int(os.getenv("WHATSAPP_WORKERS", "4"))
+WHATSAPP_QUEUE_SIZE = int(os.getenv("WHATSAPP_QUEUE_SIZE", "10000"))
+# Número máximo de interacciones que un worker acumula antes de escribirlas en la DB
+WHATSAPP_RECORD_BATCH = int(os.getenv("WHATSAPP_RECORD_BATCH", "50"))
+# Espera máxima entre reintentos al registrar las interacciones si la DB falla, e intentos al parar los workers
+WHATSAPP_RECORD_RETRY_MAX_SECONDS = float(os.getenv("WHATSAPP_RECORD_RETRY_MAX_SECONDS", "30"))
+WHATSAPP_RECORD_STOP_ATTEMPTS = int(os.getenv("WHATSAPP_RECORD_STOP_ATTEMPTS", "3"))
+# Intentos de registrar un lote por errores de conexión antes de pasar a registrar las interacciones una a una
+WHATSAPP_RECORD_BATCH_ATTEMPTS = int(os.getenv("WHATSAPP_RECORD_BATCH_ATTEMPTS", "3"))
+# Interacciones sin registrar que conserva un worker mientras la DB falla; las más antiguas quedan en el log
+WHATSAPP_RECORD_MAX_PENDING = int(os.getenv("WHATSAPP_RECORD_MAX_PENDING", "1000"))
+
+# Cliente HTTP de Twilio: pool de conexiones keep-alive dimensionado para los workers
+TWILIO_HTTP_POOL_SIZE = int(os.getenv("TWILIO_HTTP_POOL_SIZE", str(WHATSAPP_WORKERS)))
+TWILIO_HTTP_TIMEOUT = float(os.getenv("TWILIO_HTTP_TIMEOUT", "30"))
+TWILIO_ASYNC_HTTP = os.getenv("TWILIO_ASYNC_HTTP", "false").lower() == "true"
+
+# Límite de envíos (mensajes/segundo) y reintentos ante 429/5xx
+TWILIO_RATE_LIMIT = float(os.getenv("TWILIO_RATE_LIMIT", "10"))
+TWILIO_RATE_BURST = float(os.getenv("TWILIO_RATE_BURST", str(TWILIO_RATE_LIMIT)))
+# local (un bucket por proceso) / postgres (compartido entre procesos o contenedores, una consulta por envío)
+TWILIO_RATE_LIMIT_BACKEND = os.getenv("TWILIO_RATE_LIMIT_BACKEND", "local").lower()
+TWILIO_MAX_RETRIES = int(os.getenv("TWILIO_MAX_RETRIES", "5"))
+TWILIO_BACKOFF_BASE_MS = float(os.getenv("TWILIO_BACKOFF_BASE_MS", "500"))
+TWILIO_BACKOFF_MAX_MS = float(os.getenv("TWILIO_BACKOFF_MAX_MS", "30000"))
+
+# Cliente falso (solo para pruebas de carga sin Twilio)
+FAKE_SEND_LATENCY_MS = float(os.getenv("FAKE_SEND_LATENCY_MS", "300"))
+FAKE_SEND_ERROR_RATE = float(os.getenv("FAKE_SEND_ERROR_RATE", "0"))
+FAKE_SEND_THROTTLE_RATE = float(os.getenv("FAKE_SEND_THROTTLE_RATE", "0"))
+
+logger = logging.getLogger(__name__)
+
+
+class FakeMessageList:
+    """Imita client.messages de Twilio: simula la latencia de la petición HTTP y devuelve un SID"""
+
+    def __init__(self, latency_ms: float, error_rate: float, throttle_rate: float):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+
+    def create(self, from_: str = None, to: str = None, body: str = None, **kwargs):
+        time.sleep(self.latency_ms / 1000)
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            raise TwilioRestException(429, "/Messages.json", msg="Too Many Requests (simulado)", method="POST")
+        if self.error_rate and random.random() < self.error_rate:
+            raise Exception(f"Error simulado enviando a {to}")
+        return FakeMessage(sid=f"SM{uuid.uuid4().hex}", to=to, body=body)
+
+    async def create_async(self, **kwargs):
+        return await asyncio.to_thread(self.create, **kwargs)
+
+
+@dataclass
+class FakeMessage:
+    sid: str
+    to: str
+    body: str
+
+
+class FakeTwilioClient:
+    """Sustituto de twilio.rest.Client que no hace peticiones de red"""
+
+    def __init__(
+        self,
+        latency_ms: float = FAKE_SEND_LATENCY_MS,
+        error_rate: float = FAKE_SEND_ERROR_RATE,
+        throttle_rate: float = FAKE_SEND_THROTTLE_RATE,
+    ):
+        self.messages = FakeMessageList(latency_ms, error_rate, throttle_rate)
+
+
+class SendMetrics:
+    """Acumula tiempos (número, total y máximo en segundos) y contadores de los envíos"""
+
+    TIMINGS = ("queue_wait", "throttle_wait", "send_time")
+    COUNTERS = ("attempts", "retries", "throttled", "server_errors")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._timings = {name: [0, 0.0, 0.0] for name in self.TIMINGS}
+            self._counters = {name: 0 for name in self.COUNTERS}
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            timing = self._timings[name]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self._counters[name] += n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            timings = {
+                name: {
+                    "count": count,
+                    "avg_ms": round(total / count * 1000, 1) if count else 0.0,
+                    "max_ms": round(maximum * 1000, 1),
+                }
+                for name, (count, total, maximum) in self._timings.items()
+            }
+            return {"timings": timings, **self._counters}
+
+
+send_metrics = SendMetrics()
+
+
+def _send_outcome(error: Optional[Exception]) -> str:
+    """Resultado de una llamada a Twilio para metrics.TWILIO_REQUEST_SECONDS"""
+    if error is None:
+        return "ok"
+    if isinstance(error, TwilioRestException) and error.status == 429:
+        return "throttled"
+    if isinstance(error, TwilioRestException) and error.status >= 500:
+        return "server_error"
+    return "error"
+
+
+class RateLimitedMessages:
+    """
+    Envuelve client.messages: cada create() consume un token del bucket antes de llamar a Twilio
+    y reintenta con backoff exponencial y jitter cuando Twilio responde 429 o 5xx.
+    """
+
+    def __init__(self, messages, limiter, metrics: SendMetrics, max_retries: int, backoff_base: float, backoff_max: float):
+        self._messages = messages
+        self._limiter = limiter
+        self._metrics = metrics
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+
+    def _retry_delay(self, e: TwilioRestException, attempt: int) -> float:
+        """Segundos a esperar antes de reintentar un 429/5xx; relanza la excepción si no se debe reintentar"""
+        if e.status == 429:
+            self._metrics.count("throttled")
+        elif e.status >= 500:
+            self._metrics.count("server_errors")
+        else:
+            raise e
+        if attempt >= self._max_retries:
+            raise e
+        self._metrics.count("retries")
+        delay = backoff_delay(attempt, self._backoff_base, self._backoff_max)
+        logger.warning(
+            "Twilio respondió con error, se reintenta",
+            extra={"status": e.status, "attempt": attempt + 1, "max_retries": self._max_retries, "delay_seconds": round(delay, 2)},
+        )
+        return delay
+
+    def _observe_send(self, start: float, error: Optional[Exception] = None):
+        seconds = time.monotonic() - start
+        self._metrics.observe("send_time", seconds)
+        metrics.TWILIO_REQUEST_SECONDS.labels(_send_outcome(error)).observe(seconds)
+
+    def create(self, **kwargs):
+        attempt = 0
+        while True:
+            self._metrics.observe("throttle_wait", self._limiter.acquire())
+            self._metrics.count("attempts")
+            start = time.monotonic()
+            try:
+                message = self._messages.create(**kwargs)
+            except TwilioRestException as e:
+                self._observe_send(start, e)
+                time.sleep(self._retry_delay(e, attempt))
+                attempt += 1
+                continue
+            except Exception as e:
+                self._observe_send(start, e)
+                raise
+            self._observe_send(start)
+            return message
+
+    async def create_async(self, **kwargs):
+        """Igual que create() pero con el cliente HTTP asíncrono, sin bloquear el event loop"""
+        attempt = 0
+        while True:
+            self._metrics.observe("throttle_wait", await asyncio.to_thread(self._limiter.acquire))
+            self._metrics.count("attempts")
+            start = time.monotonic()
+            try:
+                message = await self._messages.create_async(**kwargs)
+            except TwilioRestException as e:
+                self._observe_send(start, e)
+                await asyncio.sleep(self._retry_delay(e, attempt))
+                attempt += 1
+                continue
+            except Exception as e:
+                self._observe_send(start, e)
+                raise
+            self._observe_send(start)
+            return message
+
+
+class RateLimitedTwilioClient:
+    """Cliente Twilio (real o falso) con límite de velocidad y reintentos en messages.create()"""
+
+    def __init__(
+        self,
+        client,
+        limiter,
+        metrics: SendMetrics = send_metrics,
+        max_retries: int = TWILIO_MAX_RETRIES,
+        backoff_base_ms: float = TWILIO_BACKOFF_BASE_MS,
+        backoff_max_ms: float = TWILIO_BACKOFF_MAX_MS,
+    ):
+        self.client = client
+        self.messages = RateLimitedMessages(
+            client.messages, limiter, metrics, max_retries, backoff_base_ms / 1000, backoff_max_ms / 1000
+        )
+
+
+def create_rate_limiter():
+    """Token bucket de envíos: solo para este proceso (local) o compartido entre procesos (postgres)"""
+    if TWILIO_RATE_LIMIT_BACKEND == "postgres":
+        return PostgresTokenBucket("twilio_messages", TWILIO_RATE_LIMIT, TWILIO_RATE_BURST, SessionLocal)
+    return TokenBucket(TWILIO_RATE_LIMIT, TWILIO_RATE_BURST)
+
+
+def create_twilio_http_client(pool_size: int = TWILIO_HTTP_POOL_SIZE) -> TwilioHttpClient:
+    """
+    Cliente HTTP de Twilio con conexiones keep-alive: un único pool de hasta pool_size conexiones a api.twilio.com,
+    dimensionado para los workers de la cola (si todas están ocupadas se espera en vez de abrir conexiones nuevas).
+    """
+    http_client = TwilioHttpClient(pool_connections=True, timeout=TWILIO_HTTP_TIMEOUT)
+    http_client.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True))
+    return http_client
+
+
+rate_limiter = create_rate_limiter()
+
+# Clientes Twilio del proceso: se crean una vez (ver init_twilio_clients) y se reutilizan en todos los envíos
+_twilio_client = None
+_async_twilio_client = None
+_twilio_lock = threading.Lock()
+
+
+def get_twilio_client():
+    """Cliente Twilio compartido por el proceso (con límite de velocidad), o None si no está configurado"""
+    global _twilio_client
+    if _twilio_client is None:
+        with _twilio_lock:
+            if _twilio_client is None:
+                if WHATSAPP_SENDER == "fake":
+                    _twilio_client = RateLimitedTwilioClient(FakeTwilioClient(), rate_limiter)
+                elif TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
+                    client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=create_twilio_http_client())
+                    _twilio_client = RateLimitedTwilioClient(client, rate_limiter)
+    return _twilio_client
+
+
+def get_async_twilio_client():
+    """
+    Cliente Twilio con transporte HTTP asíncrono (aiohttp) para usar desde endpoints async con
+    `await client.messages.create_async(...)`. Solo existe si TWILIO_ASYNC_HTTP=true; si no, devuelve None.
+    """
+    return _async_twilio_client
+
+
+def init_twilio_clients():
+    """Crea los clientes Twilio al arrancar la app (debe llamarse dentro del event loop)"""
+    global _async_twilio_client
+    get_twilio_client()
+    if TWILIO_ASYNC_HTTP and WHATSAPP_SENDER != "fake" and TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
+        http_client = AsyncTwilioHttpClient(pool_connections=True, timeout=TWILIO_HTTP_TIMEOUT)
+        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=http_client)
+        _async_twilio_client = RateLimitedTwilioClient(client, rate_limiter)
+
+
+async def close_twilio_clients():
+    """Cierra la sesión HTTP asíncrona al parar la app"""
+    global _async_twilio_client
+    if _async_twilio_client is not None:
+        await _async_twilio_client.client.http_client.close()
+        _async_twilio_client = None
+
+
+def whatsapp_enabled() -> bool:
+    """Indica si hay que enviar WhatsApp: no deshabilitado y con cliente (real o falso) disponible"""
+    if DISABLE_WHATSAPP:
+        return False
+    return WHATSAPP_SENDER == "fake" or bool(TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN)
+
+
+@dataclass
+class OutboundMessage:
+    """Mensaje pendiente de envío asociado a un shipment"""
+    shipment_id: UUID
+    to: str
+    body: str
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class WhatsAppDispatcher:
+    """
+    Cola de salida con un pool de workers (hilos) que envían los mensajes concurrentemente.
+    Cada worker agrupa las interacciones enviadas y las registra en la DB por lotes.
+    Si session_factory es None, los envíos no se registran (útil en pruebas de carga).
+    """
+
+    def __init__(
+        self,
+        workers: int = WHATSAPP_WORKERS,
+        maxsize: int = WHATSAPP_QUEUE_SIZE,
+        client_factory: Callable = get_twilio_client,
+        session_factory: Optional[Callable] = None,
+        record_batch: int = WHATSAPP_RECORD_BATCH,
+        metrics: SendMetrics = send_metrics,
+    ):
+        self.workers = workers
+        self.metrics = metrics
+        self.client_factory = client_factory
+        self.session_factory = session_factory
+        self.record_batch = record_batch
+        self._queue: "queue.Queue[Optional[OutboundMessage]]" = queue.Queue(maxsize=maxsize)
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._stats = {"queued": 0, "sent": 0, "errors": 0, "rejected": 0, "unrecorded": 0}
+
+    @property
+    def running(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def start(self):
+        """Arranca los workers (no hace nada si ya están arrancados)"""
+        with self._lock:
+            if self.running:
+                return
+            self._threads = [
+                threading.Thread(target=self._worker, name=f"whatsapp-sender-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for t in self._threads:
+                t.start()
+
+    def stop(self, timeout: float = 30.0):
+        """Procesa los mensajes ya encolados y detiene los workers"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for t in threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+    def enqueue(self, shipment_id: UUID, to: str, body: str) -> bool:
+        """Encola un mensaje. Devuelve False si la cola está llena"""
+        if not self.running:
+            self.start()
+        try:
+            self._queue.put_nowait(OutboundMessage(shipment_id=shipment_id, to=to, body=body))
+        except queue.Full:
+            self._count("rejected")
+            metrics.WHATSAPP_MESSAGES.labels("rejected").inc()
+            logger.warning("Cola de WhatsApp llena, mensaje descartado", extra={"to": to, "shipment_id": str(shipment_id)})
+            return False
+        self._count("queued")
+        metrics.WHATSAPP_QUEUE_PENDING.inc()
+        return True
+
+    def join(self):
+        """Bloquea hasta que todos los mensajes encolados se hayan procesado"""
+        self._queue.join()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize()
+        stats["workers"] = len(self._threads)
+        stats["rate_limit_per_second"] = TWILIO_RATE_LIMIT
+        stats.update(self.metrics.snapshot())
+        return stats
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _worker(self):
+        client = self.client_factory()
+        sent: List[dict] = []
+        # Si falla el registro, lo enviado se conserva y se reintenta con backoff a partir de retry_at
+        failures = 0
+        retry_at = 0.0
+
+        def flush():
+            nonlocal failures, retry_at
+            if time.monotonic() < retry_at:
+                return
+            if self._record(sent, failures):
+                failures, retry_at = 0, 0.0
+            else:
+                failures += 1
+                retry_at = time.monotonic() + backoff_delay(failures, 0.5, WHATSAPP_RECORD_RETRY_MAX_SECONDS)
+
+        while True:
+            try:
+                # Si la cola se queda vacía, registrar lo enviado antes de seguir esperando
+                msg = self._queue.get(timeout=0.5 if sent else None)
+            except queue.Empty:
+                flush()
+                continue
+
+            if msg is None:
+                self._record_on_stop(sent)
+                self._queue.task_done()
+                return
+
+            self.metrics.observe("queue_wait", time.monotonic() - msg.enqueued_at)
+            metrics.WHATSAPP_QUEUE_PENDING.dec()
+            started = time.monotonic()
+            try:
+                self._send(client, msg, sent)
+                metrics.WHATSAPP_SEND_SECONDS.observe(time.monotonic() - started)
+                if len(sent) > WHATSAPP_RECORD_MAX_PENDING:
+                    # La DB lleva tiempo fallando: no se acumulan más envíos en memoria
+                    overflow = len(sent) - WHATSAPP_RECORD_MAX_PENDING
+                    self._log_unrecorded(sent[:overflow], "Demasiadas interacciones pendientes de registrar")
+                    del sent[:overflow]
+                if len(sent) >= self.record_batch:
+                    flush()
+            finally:
+                self._queue.task_done()
+
+    def _send(self, client, msg: OutboundMessage, sent: List[dict]):
+        if client is None:
+            self._count("errors")
+            metrics.WHATSAPP_MESSAGES.labels("error").inc()
+            logger.error("Cliente de Twilio no disponible, no se envía WhatsApp", extra={"to": msg.to, "shipment_id": str(msg.shipment_id)})
+            return
+        try:
+            message = client.messages.create(
+                from_=TWILIO_WHATSAPP_FROM,
+                to=f"whatsapp:{msg.to}",
+                body=msg.body,
+            )
+        except Exception as e:
+            self._count("errors")
+            metrics.WHATSAPP_MESSAGES.labels("error").inc()
+            logger.error("Error enviando WhatsApp", extra={"to": msg.to, "shipment_id": str(msg.shipment_id), "error": str(e)})
+            return
+
+        self._count("sent")
+        metrics.WHATSAPP_MESSAGES.labels("sent").inc()
+        sent.append({
+            "shipment_id": msg.shipment_id,
+            "channel": "whatsapp",
+            "direction": "outbound",
+            "content": msg.body,
+            "response_code": None,
+            # Hora del envío, no la del registro por lotes (la latencia de respuesta de GET /stats parte de aquí)
+            "created_at": models.get_madrid_now(),
+        })
+        logger.info("WhatsApp enviado", extra={"to": msg.to, "shipment_id": str(msg.shipment_id), "message_sid": message.sid})
+
+    def _record(self, sent: List[dict], batch_failures: int = 0) -> bool:
+        """
+        Registra las interacciones outbound enviadas en una sola transacción y vacía la lista.
+        Si el lote falla por un error de conexión (_retryable) y lleva menos de WHATSAPP_RECORD_BATCH_ATTEMPTS
+        intentos, las conserva para reintentarlo y devuelve False. Si no, las registra una a una (_record_each).
+        """
+        if not sent or self.session_factory is None:
+            sent.clear()
+            return True
+        error = self._insert(sent)
+        if error is None:
+            sent.clear()
+            return True
+        if _retryable(error) and batch_failures + 1 < WHATSAPP_RECORD_BATCH_ATTEMPTS:
+            logger.error("Error registrando las interacciones de WhatsApp, se reintentará", extra={"interactions": len(sent), "error": str(error)})
+            return False
+        logger.error("Error registrando el lote de interacciones de WhatsApp, se registran una a una", extra={"interactions": len(sent), "error": str(error)})
+        return self._record_each(sent)
+
+    def _record_each(self, sent: List[dict]) -> bool:
+        """
+        Registra las interacciones de una en una: las que fallan por sí solas (p. ej. el shipment se ha borrado
+        desde el envío) quedan en el log y se descartan. Si la DB deja de responder, conserva las que quedan
+        y devuelve False.
+        """
+        for position, interaction in enumerate(sent):
+            error = self._insert([interaction])
+            if error is None:
+                continue
+            if _retryable(error):
+                del sent[:position]
+                return False
+            self._log_unrecorded([interaction], str(error))
+        sent.clear()
+        return True
+
+    def _insert(self, interactions: List[dict]) -> Optional[Exception]:
+        """Inserta las interacciones en una transacción; devuelve el error si falla"""
+        db = self.session_factory()
+        try:
+            db.execute(insert(models.DeliveryInteraction), interactions)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            return e
+        finally:
+            db.close()
+        return None
+
+    def _log_unrecorded(self, interactions: List[dict], error: str):
+        """Deja en el log cada envío que no se va a registrar en la DB, para poder reconstruirlo"""
+        self._count("unrecorded", len(interactions))
+        for interaction in interactions:
+            logger.error(
+                "WhatsApp enviado sin registrar en la DB",
+                extra={
+                    "shipment_id": str(interaction["shipment_id"]),
+                    "content": interaction["content"],
+                    "sent_at": interaction["created_at"].isoformat(),
+                    "error": error,
+                },
+            )
+
+    def _record_on_stop(self, sent: List[dict]):
+        """Último registro al parar: unos cuantos intentos y, si la DB sigue fallando, cada envío queda en el log"""
+        for attempt in range(WHATSAPP_RECORD_STOP_ATTEMPTS):
+            if self._record(sent, attempt):
+                return
+            time.sleep(backoff_delay(attempt, 0.5, 5))
+        self._log_unrecorded(sent, "La DB no responde al parar los workers")
+        sent.clear()
+
+
+def _retryable(error: Exception) -> bool:
+    """Errores de conexión o de disponibilidad de la DB, en los que vale la pena reintentar el lote entero"""
+    return (
+        isinstance(error, (exc.OperationalError, exc.InterfaceError, exc.TimeoutError))
+        or getattr(error, "connection_invalidated", False)
+    )
+
+
+# Cola de salida compartida por todos los endpoints del proceso
+dispatcher = WhatsAppDispatcher(session_factory=SessionLocal)
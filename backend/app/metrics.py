@@ -0,0 +1,163 @@
+'''
+Métricas de Prometheus (GET /metrics)
+    Define las métricas de la app y las recoge con poco coste para dejarlas activas en producción:
+      - MetricsMiddleware (ASGI puro): latencia de cada petición por método, ruta (la plantilla, p. ej.
+        /shipments/{shipment_id}, no la URL) y código de respuesta, y número y tiempo de las consultas SQL de la petición.
+      - Eventos before/after_cursor_execute de los engines de database.py: tiempo de cada consulta. Las consultas se
+        suman a la petición en curso con una variable de contexto (funciona en los endpoints async, en el threadpool
+        y dentro del greenlet de la sesión asíncrona); las de los workers (WhatsApp, importación) solo cuentan en
+        db_query_duration_seconds.
+      - pool.py: espera para sacar una conexión del pool, timeouts y conexiones en uso de cada engine.
+      - messaging.py: latencia y resultado de cada llamada a Twilio y de cada mensaje (con reintentos) y cola pendiente.
+      - jobs.py: filas importadas y filas/segundo de la importación en curso.
+      - main.py (twilio_incoming): latencia de extremo a extremo del webhook por resultado.
+    Con varios procesos (PROMETHEUS_MULTIPROC_DIR) GET /metrics suma las métricas de todos.
+    Es usado por main.py, database.py, pool.py, messaging.py y jobs.py.
+'''
+
+from contextvars import ContextVar
+from typing import Optional
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+
+# Recoger las métricas de peticiones y consultas (false para desactivar el middleware y los eventos del engine)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Directorio compartido de las métricas con varios procesos (uvicorn --workers / gunicorn), ver prometheus_client
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Rutas que no se miden: el feed SSE dura lo que dure la conexión
+EXCLUDED_ROUTES = {"/events"}
+
+DB_QUERY_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 20, 50, 100)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Duración de las peticiones HTTP", ["method", "route", "status"]
+)
+HTTP_REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "Consultas SQL por petición HTTP", ["method", "route"], buckets=DB_QUERY_BUCKETS
+)
+HTTP_REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Tiempo total de las consultas SQL de cada petición HTTP", ["method", "route"]
+)
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Duración de cada consulta SQL", ["engine"])
+DB_POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds",
+    "Espera hasta tener una conexión del pool (pool lleno, conexión nueva y pre-ping)",
+    ["engine"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+DB_POOL_TIMEOUTS = Counter("db_pool_timeouts", "Peticiones sin conexión tras DB_POOL_TIMEOUT (pool agotado)", ["engine"])
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Conexiones del pool en uso", ["engine"], multiprocess_mode="livesum"
+)
+
+TWILIO_REQUEST_SECONDS = Histogram(
+    "twilio_request_duration_seconds",
+    "Duración de cada llamada a la API de mensajes de Twilio (un intento)",
+    ["outcome"],  # ok / throttled (429) / server_error (5xx) / error
+)
+WHATSAPP_SEND_SECONDS = Histogram(
+    "whatsapp_send_duration_seconds", "Duración del envío de cada WhatsApp, con esperas por el límite y reintentos"
+)
+WHATSAPP_MESSAGES = Counter(
+    "whatsapp_messages", "Mensajes de WhatsApp por resultado", ["result"]  # sent / error / rejected (cola llena)
+)
+WHATSAPP_QUEUE_PENDING = Gauge(
+    "whatsapp_queue_pending", "Mensajes de WhatsApp encolados pendientes de envío", multiprocess_mode="livesum"
+)
+
+IMPORT_ROWS = Counter("import_rows", "Filas del spreadsheet procesadas por las importaciones")
+IMPORT_ROWS_PER_SECOND = Gauge(
+    "import_rows_per_second", "Filas/segundo de la importación en curso (o de la última)", multiprocess_mode="max"
+)
+
+WEBHOOK_SECONDS = Histogram(
+    "webhook_duration_seconds",
+    "Duración de extremo a extremo del webhook de Twilio, de la petición a la respuesta TwiML",
+    ["outcome"],  # confirmed / rejected / unknown_reply / unknown_customer / no_pending / invalid / error
+)
+
+
+class RequestDB:
+    """Consultas SQL de la petición en curso"""
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+_request_db: ContextVar[Optional[RequestDB]] = ContextVar("request_db", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def instrument_engine(engine, name: str):
+    """Mide las consultas del engine (síncrono, o el sync_engine del asíncrono)"""
+    observe = DB_QUERY_SECONDS.labels(name).observe
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_metrics_started", None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        observe(seconds)
+        request = _request_db.get()
+        if request is not None:
+            request.queries += 1
+            request.seconds += seconds
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """Latencia y consultas SQL de cada petición HTTP, por la plantilla de la ruta"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        request = RequestDB()
+        token = _request_db.set(request)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            seconds = time.perf_counter() - started
+            _request_db.reset(token)
+            # La ruta la anota el router en el scope; sin ruta (404) se agrupan todas en "unmatched"
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            if path not in EXCLUDED_ROUTES:
+                method = scope["method"]
+                HTTP_REQUEST_SECONDS.labels(method, path, str(status)).observe(seconds)
+                HTTP_REQUEST_DB_QUERIES.labels(method, path).observe(request.queries)
+                HTTP_REQUEST_DB_SECONDS.labels(method, path).observe(request.seconds)
+
+
+def latest() -> tuple:
+    """(contenido, content type) de GET /metrics: las métricas del proceso o, en multiproceso, las de todos"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,93 @@
+'''
+Migraciones de la DB
+    Aplica en orden los ficheros SQL de app/migrations/ que aún no estén registrados en la tabla schema_migrations,
+    cada uno en su propia transacción. Un advisory lock de PostgreSQL evita que varios procesos las apliquen a la vez.
+    Usan una conexión directa (DATABASE_DIRECT_URL, ver database.py) sin statement_timeout: el lock es de sesión y no
+    funciona a través de un PgBouncer en modo transacción, y una migración puede tardar más que una consulta.
+    Se ejecuta al arrancar la app (main.py) y también se puede lanzar a mano:
+
+        python -m app.migrate          # aplica las migraciones pendientes
+        python -m app.migrate status   # muestra las aplicadas y las pendientes
+'''
+
+from typing import List, Optional, Tuple
+import logging
+import os
+import sys
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from .database import get_direct_engine
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+
+# Identificador del advisory lock que serializa las migraciones entre procesos
+MIGRATIONS_LOCK_ID = 724_911_001
+
+
+def available_migrations() -> List[Tuple[str, str]]:
+    """(versión, ruta) de los ficheros NNNN_nombre.sql, ordenados por versión"""
+    files = sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith(".sql"))
+    return [(f[:-4], os.path.join(MIGRATIONS_DIR, f)) for f in files]
+
+
+def applied_migrations(conn) -> set:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(255) PRIMARY KEY,
+            applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+    """))
+    versions = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+    conn.commit()
+    return versions
+
+
+def run_migrations(bind: Optional[Engine] = None) -> List[str]:
+    """Aplica las migraciones pendientes y devuelve las versiones aplicadas"""
+    applied_now = []
+    with (bind or get_direct_engine()).connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+        conn.commit()
+        try:
+            applied = applied_migrations(conn)
+            for version, path in available_migrations():
+                if version in applied:
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    sql = f.read()
+                logger.info("Aplicando migración", extra={"version": version})
+                try:
+                    # El SQL se ejecuta tal cual con el cursor del driver (puede contener varias sentencias)
+                    conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:version)"), {"version": version})
+                    conn.connection.driver_connection.cursor().execute(sql)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                applied_now.append(version)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+            conn.commit()
+    return applied_now
+
+
+def migration_status(bind: Optional[Engine] = None) -> List[Tuple[str, bool]]:
+    with (bind or get_direct_engine()).connect() as conn:
+        applied = applied_migrations(conn)
+    return [(version, version in applied) for version, _ in available_migrations()]
+
+
+if __name__ == "__main__":
+    from .logs import setup_logging
+
+    setup_logging()
+    if len(sys.argv) > 1 and sys.argv[1] == "status":
+        for version, is_applied in migration_status():
+            print(f"{'[x]' if is_applied else '[ ]'} {version}")
+    else:
+        applied = run_migrations()
+        print(f"{len(applied)} migraciones aplicadas" if applied else "La DB ya está al día")
@@ -0,0 +1,39 @@
+-- Esquema inicial (equivalente al antiguo db/init.sql y a Base.metadata.create_all).
+-- Usa IF NOT EXISTS para poder aplicarse sobre bases de datos creadas antes de las migraciones.
+
+CREATE TABLE IF NOT EXISTS customer (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    name VARCHAR(255) NOT NULL,
+    phone VARCHAR(50) NOT NULL,
+    delivery_hours_open TIME NOT NULL,
+    delivery_hours_close TIME NOT NULL,
+    timezone VARCHAR(64) NOT NULL DEFAULT 'Europe/Madrid',
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS shipment (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    customer_id UUID NOT NULL REFERENCES customer(id),
+    description VARCHAR(255) NOT NULL,
+    planned_delivery_time TIMESTAMP WITH TIME ZONE NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS delivery_interaction (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    shipment_id UUID NOT NULL REFERENCES shipment(id),
+    channel VARCHAR(20) NOT NULL,
+    direction VARCHAR(10) NOT NULL,
+    content TEXT NOT NULL,
+    response_code VARCHAR(50),
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS rate_limit_bucket (
+    name VARCHAR(64) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
@@ -0,0 +1,54 @@
+-- Índices para las consultas más frecuentes.
+
+-- Webhook de Twilio e importación: búsqueda de cliente por teléfono
+CREATE INDEX IF NOT EXISTS ix_customer_phone ON customer (phone);
+
+-- Webhook de Twilio: último shipment pendiente de un cliente
+CREATE INDEX IF NOT EXISTS ix_shipment_customer_status_created ON shipment (customer_id, status, created_at DESC);
+
+-- Interacciones de un shipment
+CREATE INDEX IF NOT EXISTS ix_delivery_interaction_shipment ON delivery_interaction (shipment_id, created_at);
+
+-- Listados paginados por (created_at, id) y filtro por fecha de entrega
+CREATE INDEX IF NOT EXISTS ix_shipment_created_id ON shipment (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ix_shipment_planned_delivery_time ON shipment (planned_delivery_time);
+CREATE INDEX IF NOT EXISTS ix_customer_created_id ON customer (created_at DESC, id DESC);
+
+-- Importación: un shipment es único por (cliente, descripción, fecha prevista), lo que permite
+-- INSERT ... ON CONFLICT DO NOTHING. Si ya hay duplicados la migración falla con un informe, sin tocar los datos:
+-- se revisan y se fusionan de forma explícita con utils/fix_duplicate_shipments.py antes de volver a arrancar.
+DO $$
+DECLARE
+    duplicate_groups bigint;
+    report text;
+BEGIN
+    SELECT count(*) INTO duplicate_groups
+    FROM (
+        SELECT 1 FROM shipment
+        GROUP BY customer_id, description, planned_delivery_time
+        HAVING count(*) > 1
+    ) d;
+
+    IF duplicate_groups > 0 THEN
+        SELECT string_agg(
+                   format('customer_id=%s description=%L planned_delivery_time=%s: %s envíos', customer_id, description, planned_delivery_time, n),
+                   E'\n'
+               )
+        INTO report
+        FROM (
+            SELECT customer_id, description, planned_delivery_time, count(*) AS n
+            FROM shipment
+            GROUP BY customer_id, description, planned_delivery_time
+            HAVING count(*) > 1
+            ORDER BY count(*) DESC, customer_id
+            LIMIT 20
+        ) d;
+        RAISE EXCEPTION 'Hay % grupos de envíos duplicados por (customer_id, description, planned_delivery_time)', duplicate_groups
+            USING DETAIL = report,
+                  HINT = 'Revisarlos y fusionarlos con: python -m utils.fix_duplicate_shipments --apply (desde backend/)';
+    END IF;
+END
+$$;
+
+ALTER TABLE shipment
+    ADD CONSTRAINT uq_shipment_dedup UNIQUE (customer_id, description, planned_delivery_time);
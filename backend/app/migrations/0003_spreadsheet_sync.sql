@@ -0,0 +1,16 @@
+-- Importación incremental del spreadsheet (ver spreadsheet.py e importer.py).
+
+-- Última revisión importada completa de cada origen: si no ha cambiado no se vuelven a leer las filas
+CREATE TABLE IF NOT EXISTS spreadsheet_sync (
+    source VARCHAR(512) PRIMARY KEY,
+    revision VARCHAR(255),
+    synced_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- Huella (hash de los campos normalizados) de cada fila ya importada: solo se procesan las nuevas o modificadas
+CREATE TABLE IF NOT EXISTS spreadsheet_row (
+    source VARCHAR(512) NOT NULL,
+    fingerprint VARCHAR(64) NOT NULL,
+    imported_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (source, fingerprint)
+);
@@ -0,0 +1,22 @@
+-- Trabajos de importación en segundo plano (ver jobs.py).
+
+CREATE TABLE IF NOT EXISTS import_job (
+    id UUID PRIMARY KEY,
+    source VARCHAR(512) NOT NULL,
+    revision VARCHAR(255),
+    full_import BOOLEAN NOT NULL DEFAULT false,
+    status VARCHAR(20) NOT NULL,             -- queued / running / completed / failed
+    results JSONB NOT NULL,                  -- contadores de la importación (importer.new_results)
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    started_at TIMESTAMP WITH TIME ZONE,
+    heartbeat_at TIMESTAMP WITH TIME ZONE,   -- lo actualiza el worker tras cada lote; si se para, otro proceso retoma el trabajo
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+-- Un solo trabajo pendiente o en curso por origen: volver a enviar la misma hoja devuelve el que ya existe
+CREATE UNIQUE INDEX IF NOT EXISTS uq_import_job_active_source ON import_job (source) WHERE status IN ('queued', 'running');
+
+-- Trabajos pendientes de ejecutar o abandonados
+CREATE INDEX IF NOT EXISTS ix_import_job_status_created ON import_job (status, created_at);
@@ -0,0 +1,195 @@
+-- Resúmenes de envíos y respuestas para GET /stats (ver stats.py).
+-- Los triggers por sentencia (con las filas afectadas en tablas de transición) solo añaden filas de variación
+-- (shipment_stats_change y shipment_reply_change) en la misma transacción de cada escritura (endpoints, webhook e
+-- importación). Así no actualizan filas compartidas y no hacen esperar a otras escrituras.
+-- shipment_stats_compact() suma periódicamente las variaciones a los resúmenes y las borra (ver stats.StatsCompactor);
+-- GET /stats lee los resúmenes más las variaciones aún sin compactar. Las filas que se quedan a 0 no se borran.
+
+-- Envíos por estado
+CREATE TABLE IF NOT EXISTS shipment_status_count (
+    status VARCHAR(20) PRIMARY KEY,
+    shipments BIGINT NOT NULL
+);
+
+-- Envíos por día de entrega prevista (Europe/Madrid) y estado
+CREATE TABLE IF NOT EXISTS shipment_daily_status (
+    day DATE NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    shipments BIGINT NOT NULL,
+    PRIMARY KEY (day, status)
+);
+
+-- Envíos por cliente y estado
+CREATE TABLE IF NOT EXISTS shipment_customer_status (
+    customer_id UUID NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    shipments BIGINT NOT NULL,
+    PRIMARY KEY (customer_id, status)
+);
+
+-- Respuestas SI/NO por día (Europe/Madrid) y resultado, con el tiempo desde el WhatsApp de aviso
+-- (última interacción outbound sin response_code anterior a la respuesta); timed_replies son las que lo tienen
+CREATE TABLE IF NOT EXISTS shipment_reply_daily (
+    day DATE NOT NULL,
+    result VARCHAR(20) NOT NULL,             -- confirmed / rejected
+    replies BIGINT NOT NULL,
+    timed_replies BIGINT NOT NULL,
+    total_seconds DOUBLE PRECISION NOT NULL,
+    max_seconds DOUBLE PRECISION,
+    PRIMARY KEY (day, result)
+);
+
+-- Variaciones de envíos pendientes de compactar (una fila por cliente, estado y día en cada sentencia)
+CREATE TABLE IF NOT EXISTS shipment_stats_change (
+    id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    customer_id UUID NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    day DATE NOT NULL,
+    shipments BIGINT NOT NULL
+);
+
+-- Respuestas SI/NO pendientes de compactar (una fila por día y resultado en cada sentencia)
+CREATE TABLE IF NOT EXISTS shipment_reply_change (
+    id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    day DATE NOT NULL,
+    result VARCHAR(20) NOT NULL,
+    replies BIGINT NOT NULL,
+    timed_replies BIGINT NOT NULL,
+    total_seconds DOUBLE PRECISION NOT NULL,
+    max_seconds DOUBLE PRECISION
+);
+
+CREATE OR REPLACE FUNCTION shipment_stats_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO shipment_stats_change (customer_id, status, day, shipments)
+        SELECT customer_id, status, (planned_delivery_time AT TIME ZONE 'Europe/Madrid')::date, count(*)
+        FROM new_rows GROUP BY 1, 2, 3;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO shipment_stats_change (customer_id, status, day, shipments)
+        SELECT customer_id, status, day, sum(n)
+        FROM (
+            SELECT customer_id, status, (planned_delivery_time AT TIME ZONE 'Europe/Madrid')::date AS day, -1 AS n
+            FROM old_rows
+            UNION ALL
+            SELECT customer_id, status, (planned_delivery_time AT TIME ZONE 'Europe/Madrid')::date, 1
+            FROM new_rows
+        ) delta
+        GROUP BY 1, 2, 3
+        HAVING sum(n) <> 0;
+    ELSE
+        INSERT INTO shipment_stats_change (customer_id, status, day, shipments)
+        SELECT customer_id, status, (planned_delivery_time AT TIME ZONE 'Europe/Madrid')::date, -count(*)
+        FROM old_rows GROUP BY 1, 2, 3;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER shipment_stats_insert AFTER INSERT ON shipment
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION shipment_stats_trigger();
+CREATE TRIGGER shipment_stats_update AFTER UPDATE ON shipment
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION shipment_stats_trigger();
+CREATE TRIGGER shipment_stats_delete AFTER DELETE ON shipment
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION shipment_stats_trigger();
+
+CREATE OR REPLACE FUNCTION shipment_reply_stats_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO shipment_reply_change (day, result, replies, timed_replies, total_seconds, max_seconds)
+    SELECT (r.created_at AT TIME ZONE 'Europe/Madrid')::date, r.response_code, count(*), count(r.seconds),
+           coalesce(sum(r.seconds), 0), max(r.seconds)
+    FROM (
+        SELECT i.created_at, i.response_code, extract(epoch FROM i.created_at - sent.created_at) AS seconds
+        FROM new_rows i
+        LEFT JOIN LATERAL (
+            SELECT max(o.created_at) AS created_at
+            FROM delivery_interaction o
+            WHERE o.shipment_id = i.shipment_id
+              AND o.direction = 'outbound'
+              AND o.response_code IS NULL
+              AND o.created_at <= i.created_at
+        ) sent ON true
+        WHERE i.direction = 'inbound' AND i.response_code IN ('confirmed', 'rejected')
+    ) r
+    GROUP BY 1, 2;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER shipment_reply_stats_insert AFTER INSERT ON delivery_interaction
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION shipment_reply_stats_trigger();
+
+-- Suma las variaciones pendientes a los resúmenes y las borra; devuelve cuántas ha compactado.
+-- Solo compacta un proceso a la vez (advisory lock); las variaciones que se confirmen mientras tanto quedan
+-- para la siguiente vez. Las filas de los resúmenes se actualizan en orden (ORDER BY) y solo desde aquí.
+CREATE OR REPLACE FUNCTION shipment_stats_compact() RETURNS bigint LANGUAGE plpgsql AS $$
+DECLARE
+    compacted bigint := 0;
+    replies_compacted bigint;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(724911005) THEN
+        RETURN 0;
+    END IF;
+
+    WITH moved AS (
+        DELETE FROM shipment_stats_change RETURNING customer_id, status, day, shipments
+    ), by_status AS (
+        INSERT INTO shipment_status_count AS t (status, shipments)
+        SELECT status, sum(shipments) FROM moved GROUP BY status ORDER BY status
+        ON CONFLICT (status) DO UPDATE SET shipments = t.shipments + EXCLUDED.shipments
+    ), by_day AS (
+        INSERT INTO shipment_daily_status AS t (day, status, shipments)
+        SELECT day, status, sum(shipments) FROM moved GROUP BY day, status ORDER BY day, status
+        ON CONFLICT (day, status) DO UPDATE SET shipments = t.shipments + EXCLUDED.shipments
+    ), by_customer AS (
+        INSERT INTO shipment_customer_status AS t (customer_id, status, shipments)
+        SELECT customer_id, status, sum(shipments) FROM moved GROUP BY customer_id, status ORDER BY customer_id, status
+        ON CONFLICT (customer_id, status) DO UPDATE SET shipments = t.shipments + EXCLUDED.shipments
+    )
+    SELECT count(*) INTO compacted FROM moved;
+
+    WITH moved AS (
+        DELETE FROM shipment_reply_change RETURNING day, result, replies, timed_replies, total_seconds, max_seconds
+    ), by_day AS (
+        INSERT INTO shipment_reply_daily AS t (day, result, replies, timed_replies, total_seconds, max_seconds)
+        SELECT day, result, sum(replies), sum(timed_replies), sum(total_seconds), max(max_seconds)
+        FROM moved GROUP BY day, result ORDER BY day, result
+        ON CONFLICT (day, result) DO UPDATE SET
+            replies = t.replies + EXCLUDED.replies,
+            timed_replies = t.timed_replies + EXCLUDED.timed_replies,
+            total_seconds = t.total_seconds + EXCLUDED.total_seconds,
+            max_seconds = greatest(t.max_seconds, EXCLUDED.max_seconds)
+    )
+    SELECT count(*) INTO replies_compacted FROM moved;
+
+    RETURN compacted + replies_compacted;
+END;
+$$;
+
+-- Carga inicial de los resúmenes con los datos existentes (los triggers ya están creados en esta misma transacción)
+INSERT INTO shipment_status_count (status, shipments)
+SELECT status, count(*) FROM shipment GROUP BY status;
+
+INSERT INTO shipment_daily_status (day, status, shipments)
+SELECT (planned_delivery_time AT TIME ZONE 'Europe/Madrid')::date, status, count(*) FROM shipment GROUP BY 1, 2;
+
+INSERT INTO shipment_customer_status (customer_id, status, shipments)
+SELECT customer_id, status, count(*) FROM shipment GROUP BY 1, 2;
+
+INSERT INTO shipment_reply_daily (day, result, replies, timed_replies, total_seconds, max_seconds)
+SELECT (r.created_at AT TIME ZONE 'Europe/Madrid')::date, r.response_code, count(*), count(r.seconds),
+       coalesce(sum(r.seconds), 0), max(r.seconds)
+FROM (
+    SELECT i.created_at, i.response_code, extract(epoch FROM i.created_at - sent.created_at) AS seconds
+    FROM delivery_interaction i
+    LEFT JOIN LATERAL (
+        SELECT max(o.created_at) AS created_at
+        FROM delivery_interaction o
+        WHERE o.shipment_id = i.shipment_id
+          AND o.direction = 'outbound'
+          AND o.response_code IS NULL
+          AND o.created_at <= i.created_at
+    ) sent ON true
+    WHERE i.direction = 'inbound' AND i.response_code IN ('confirmed', 'rejected')
+) r
+GROUP BY 1, 2;
@@ -0,0 +1,10 @@
+-- Ficheros subidos a POST /imports/upload (ver uploads.py), guardados en la DB para que cualquier proceso o contenedor
+-- pueda ejecutar o retomar su trabajo. Van por bloques para no leer ni escribir el fichero entero de una vez,
+-- y se borran al terminar el trabajo (jobs.ImportJobRunner._finish) o con él.
+
+CREATE TABLE IF NOT EXISTS import_upload_chunk (
+    job_id UUID NOT NULL REFERENCES import_job (id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    data BYTEA NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
@@ -2,10 +2,14 @@
 Modelos ORM
     Define las clases de Python (Customer, Shipment, etc.) que representan las tablas de la DB. SQLAlchemy (ORM) permite manipular registros como objetos de Python.
     Usa database.Base para heredar la estructura de la DB. Es usado por main.py para interactuar con los datos.
+    El esquema real (tablas, índices y restricciones) se crea con las migraciones SQL de app/migrations/ (ver migrate.py);
+    los índices declarados aquí deben coincidir con ellas.
+    Las relaciones no se cargan de forma perezosa (lazy="raise"): cada consulta carga explícitamente lo que necesita
+    (JOIN o consulta aparte), así que recorrer una lista no lanza una consulta por fila (N+1).
 '''
 
-from sqlalchemy import Column, String, Boolean, Time, DateTime, ForeignKey
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import BigInteger, Column, Date, String, Boolean, Time, DateTime, Float, Integer, LargeBinary, Text, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from sqlalchemy import event
@@ -35,7 +39,12 @@ class Customer(Base):
     created_at = Column(DateTime(timezone=True), nullable=False, default=get_madrid_now)
     updated_at = Column(DateTime(timezone=True), nullable=False, default=get_madrid_now, onupdate=get_madrid_now)
 
-    shipments = relationship("Shipment", back_populates="customer")
+    shipments = relationship("Shipment", back_populates="customer", lazy="raise")
+
+    __table_args__ = (
+        Index("ix_customer_phone", "phone"),
+        Index("ix_customer_created_id", created_at.desc(), id.desc()),
+    )
 
 @event.listens_for(Customer, 'before_insert', propagate=True)
 def set_customer_timestamps(mapper, connection, target):
@@ -62,8 +71,16 @@ class Shipment(Base):
     created_at = Column(DateTime(timezone=True), nullable=False, default=get_madrid_now)
     updated_at = Column(DateTime(timezone=True), nullable=False, default=get_madrid_now, onupdate=get_madrid_now)
 
-    customer = relationship("Customer", back_populates="shipments")
-    interactions = relationship("DeliveryInteraction", back_populates="shipment")
+    customer = relationship("Customer", back_populates="shipments", lazy="raise")
+    interactions = relationship("DeliveryInteraction", back_populates="shipment", lazy="raise")
+
+    __table_args__ = (
+        # Clave de deduplicación de la importación (permite INSERT ... ON CONFLICT DO NOTHING)
+        UniqueConstraint("customer_id", "description", "planned_delivery_time", name="uq_shipment_dedup"),
+        Index("ix_shipment_customer_status_created", customer_id, status, created_at.desc()),
+        Index("ix_shipment_created_id", created_at.desc(), id.desc()),
+        Index("ix_shipment_planned_delivery_time", planned_delivery_time),
+    )
 
 @event.listens_for(Shipment, 'before_insert', propagate=True)
 def set_shipment_timestamps(mapper, connection, target):
@@ -90,10 +107,127 @@ class DeliveryInteraction(Base):
     response_code = Column(String(50))
     created_at = Column(DateTime(timezone=True), nullable=False, default=get_madrid_now)
 
-    shipment = relationship("Shipment", back_populates="interactions")
+    shipment = relationship("Shipment", back_populates="interactions", lazy="raise")
+
+    __table_args__ = (
+        Index("ix_delivery_interaction_shipment", shipment_id, created_at),
+    )
 
 @event.listens_for(DeliveryInteraction, 'before_insert', propagate=True)
 def set_interaction_timestamp(mapper, connection, target):
     """Establece timestamp con timezone Europe/Madrid antes de insertar"""
     if target.created_at is None:
-        target.created_at = get_madrid_now()
\ No newline at end of file
+        target.created_at = get_madrid_now()
+
+class RateLimitBucket(Base):
+    """Estado del token bucket compartido entre procesos para limitar los envíos a Twilio (ver ratelimit.py)"""
+    __tablename__ = "rate_limit_bucket"
+
+    name = Column(String(64), primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+class SpreadsheetSync(Base):
+    """Última revisión del spreadsheet importada por completo (ver importer.py)"""
+    __tablename__ = "spreadsheet_sync"
+
+    source = Column(String(512), primary_key=True)
+    revision = Column(String(255))
+    synced_at = Column(DateTime(timezone=True), nullable=False)
+
+class SpreadsheetRow(Base):
+    """Huella de una fila del spreadsheet ya importada (ver importer.py)"""
+    __tablename__ = "spreadsheet_row"
+
+    source = Column(String(512), primary_key=True)
+    fingerprint = Column(String(64), primary_key=True)
+    imported_at = Column(DateTime(timezone=True), nullable=False)
+
+class ImportJob(Base):
+    """Importación del spreadsheet en segundo plano, con su progreso (ver jobs.py)"""
+    __tablename__ = "import_job"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    source = Column(String(512), nullable=False)
+    revision = Column(String(255))
+    full_import = Column(Boolean, nullable=False, default=False)
+    status = Column(String(20), nullable=False)    # queued / running / completed / failed
+    results = Column(JSONB, nullable=False)
+    error = Column(Text)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=get_madrid_now)
+    started_at = Column(DateTime(timezone=True))
+    heartbeat_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index("uq_import_job_active_source", source, unique=True, postgresql_where=status.in_(["queued", "running"])),
+        Index("ix_import_job_status_created", status, created_at),
+    )
+
+class ImportUploadChunk(Base):
+    """Bloque de un fichero subido a POST /imports/upload, del trabajo que lo importa (ver uploads.py)"""
+    __tablename__ = "import_upload_chunk"
+
+    job_id = Column(UUID(as_uuid=True), ForeignKey("import_job.id", ondelete="CASCADE"), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+
+# Resúmenes de GET /stats: solo lectura desde la aplicación. Los triggers de 0005_shipment_stats.sql añaden las
+# variaciones (*Change) y shipment_stats_compact() las suma a los resúmenes (ver stats.StatsCompactor)
+
+class ShipmentStatusCount(Base):
+    """Envíos por estado"""
+    __tablename__ = "shipment_status_count"
+
+    status = Column(String(20), primary_key=True)
+    shipments = Column(BigInteger, nullable=False)
+
+class ShipmentDailyStatus(Base):
+    """Envíos por día de entrega prevista (Europe/Madrid) y estado"""
+    __tablename__ = "shipment_daily_status"
+
+    day = Column(Date, primary_key=True)
+    status = Column(String(20), primary_key=True)
+    shipments = Column(BigInteger, nullable=False)
+
+class ShipmentCustomerStatus(Base):
+    """Envíos por cliente y estado"""
+    __tablename__ = "shipment_customer_status"
+
+    customer_id = Column(UUID(as_uuid=True), primary_key=True)
+    status = Column(String(20), primary_key=True)
+    shipments = Column(BigInteger, nullable=False)
+
+class ShipmentReplyDaily(Base):
+    """Respuestas SI/NO por día y resultado, con el tiempo transcurrido desde el WhatsApp de aviso"""
+    __tablename__ = "shipment_reply_daily"
+
+    day = Column(Date, primary_key=True)
+    result = Column(String(20), primary_key=True)    # confirmed / rejected
+    replies = Column(BigInteger, nullable=False)
+    timed_replies = Column(BigInteger, nullable=False)
+    total_seconds = Column(Float, nullable=False)
+    max_seconds = Column(Float)
+
+class ShipmentStatsChange(Base):
+    """Variación de envíos por cliente, estado y día pendiente de compactar"""
+    __tablename__ = "shipment_stats_change"
+
+    id = Column(BigInteger, primary_key=True)
+    customer_id = Column(UUID(as_uuid=True), nullable=False)
+    status = Column(String(20), nullable=False)
+    day = Column(Date, nullable=False)
+    shipments = Column(BigInteger, nullable=False)
+
+class ShipmentReplyChange(Base):
+    """Respuestas SI/NO por día y resultado pendientes de compactar"""
+    __tablename__ = "shipment_reply_change"
+
+    id = Column(BigInteger, primary_key=True)
+    day = Column(Date, nullable=False)
+    result = Column(String(20), nullable=False)
+    replies = Column(BigInteger, nullable=False)
+    timed_replies = Column(BigInteger, nullable=False)
+    total_seconds = Column(Float, nullable=False)
+    max_seconds = Column(Float)
@@ -0,0 +1,178 @@
+'''
+Paginación por cursor (keyset) y respuestas JSON en streaming
+    Los listados se ordenan por (created_at, id) descendente y cada página continúa a partir de la clave
+    de la última fila de la anterior, sin OFFSET. El cursor de la página siguiente se devuelve en la cabecera
+    X-Next-Cursor y las filas se serializan y envían a medida que se leen de la DB.
+    Hay versión para Session (síncrona) y para AsyncSession (async_paginated_response); esta última calcula en la misma
+    consulta que el cursor siguiente un ETag de la página y responde 304 si el cliente ya la tiene (ver conditional.py),
+    y admite consultas con JOIN que devuelven varias entidades por fila (GET /shipments?include=...).
+    Las filas se leen como tuplas de columnas (no objetos ORM) y se serializan con serialization.py.
+    Es usado por main.py (GET /shipments y GET /customers).
+'''
+
+from datetime import datetime
+from typing import AsyncIterable, Callable, Iterable, Optional, Set, Tuple, Type
+from uuid import UUID
+import base64
+import os
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import Select, func, select, tuple_
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .conditional import cache_headers, etag_matches, fingerprint_columns, make_etag, not_modified
+from .serialization import columns, row_serializer
+
+# Tamaño de página por defecto y máximo de los listados
+LIST_DEFAULT_LIMIT = int(os.getenv("LIST_DEFAULT_LIMIT", "100"))
+LIST_MAX_LIMIT = int(os.getenv("LIST_MAX_LIMIT", "1000"))
+
+# Filas que se leen de la DB en cada viaje (cursor en el servidor)
+STREAM_BATCH_SIZE = 200
+
+
+def encode_cursor(created_at: datetime, id: UUID) -> str:
+    """Cursor opaco con la clave (created_at, id) de la última fila de una página"""
+    raw = f"{created_at.isoformat()}|{id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, id = raw.split("|")
+        return datetime.fromisoformat(created_at), UUID(id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_page(stmt: Select, model, cursor: Optional[str]) -> Select:
+    """Ordena por (created_at, id) descendente y, si hay cursor, empieza después de esa clave"""
+    if cursor:
+        created_at, id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(model.created_at, model.id) < tuple_(created_at, id))
+    return stmt.order_by(model.created_at.desc(), model.id.desc())
+
+
+def next_cursor_stmt(stmt: Select, model, limit: int) -> Select:
+    """Claves de las filas limit y limit+1 (por el índice), sin cargar la página"""
+    return stmt.with_only_columns(model.created_at, model.id).offset(limit - 1).limit(2)
+
+
+def cursor_from_keys(keys) -> Optional[str]:
+    if len(keys) < 2:
+        return None
+    return encode_cursor(keys[0].created_at, keys[0].id)
+
+
+def next_cursor(db: Session, stmt: Select, model, limit: int) -> Optional[str]:
+    """Calcula el cursor de la página siguiente antes de empezar a enviar la página"""
+    return cursor_from_keys(db.execute(next_cursor_stmt(stmt, model, limit)).all())
+
+
+def page_state_stmt(stmt: Select, model, limit: int, version=None) -> Select:
+    """
+    Una sola consulta sobre las claves de las limit+1 primeras filas (sin cargar la página):
+    validador (número de filas y md5 de id:versión) y clave de la última fila de la página, para el cursor siguiente.
+    La versión es updated_at, u otra expresión si la página incluye datos de otras tablas.
+    """
+    version = model.updated_at if version is None else version
+    page = stmt.with_only_columns(model.id, model.created_at, version.label("version")).limit(limit + 1).subquery("page")
+    order = (page.c.created_at.desc(), page.c.id.desc())
+    return select(
+        *fingerprint_columns(page.c.id, page.c.version, *order),
+        func.array_agg(aggregate_order_by(page.c.created_at, *order))[limit].label("last_created_at"),
+        func.array_agg(aggregate_order_by(page.c.id, *order))[limit].label("last_id"),
+    )
+
+
+def stream_json_array(rows: Iterable, schema: Type[BaseModel]) -> Iterable[bytes]:
+    """
+    Serializa las filas como array JSON a medida que se leen, enviando un fragmento cada STREAM_BATCH_SIZE filas
+    en lugar de construir la lista completa en memoria.
+    """
+    serialize = row_serializer(schema)
+    parts = [b"["]
+    first = True
+    for row in rows:
+        if not first:
+            parts.append(b",")
+        first = False
+        parts.append(serialize(row))
+        if len(parts) >= 2 * STREAM_BATCH_SIZE:
+            yield b"".join(parts)
+            parts = []
+    parts.append(b"]")
+    yield b"".join(parts)
+
+
+async def async_stream_json_array(rows: AsyncIterable, schema: Type[BaseModel], exclude: Optional[Set[str]] = None) -> AsyncIterable[bytes]:
+    """Como stream_json_array, para filas leídas con AsyncSession.stream; exclude omite esos campos del esquema"""
+    serialize = row_serializer(schema, exclude)
+    parts = [b"["]
+    first = True
+    async for row in rows:
+        if not first:
+            parts.append(b",")
+        first = False
+        parts.append(serialize(row))
+        if len(parts) >= 2 * STREAM_BATCH_SIZE:
+            yield b"".join(parts)
+            parts = []
+    parts.append(b"]")
+    yield b"".join(parts)
+
+
+def paginated_response(db: Session, stmt: Select, model, schema: Type[BaseModel], cursor: Optional[str], limit: int) -> StreamingResponse:
+    """Respuesta en streaming con una página del listado y el cursor de la siguiente en X-Next-Cursor"""
+    stmt = keyset_page(stmt, model, cursor)
+    headers = {}
+    cursor = next_cursor(db, stmt, model, limit)
+    if cursor:
+        headers["X-Next-Cursor"] = cursor
+
+    rows = db.execute(
+        stmt.with_only_columns(*columns(model, schema)).limit(limit).execution_options(yield_per=STREAM_BATCH_SIZE)
+    )
+    return StreamingResponse(stream_json_array(rows, schema), media_type="application/json", headers=headers)
+
+
+async def async_paginated_response(
+    request: Request,
+    db: AsyncSession,
+    stmt: Select,
+    model,
+    schema: Type[BaseModel],
+    cursor: Optional[str],
+    limit: int,
+    version=None,
+    to_row: Optional[Callable] = None,
+    exclude: Optional[Set[str]] = None,
+) -> Response:
+    """
+    Como paginated_response, con AsyncSession: las filas se leen con un cursor de servidor sin bloquear el event loop.
+    Si el If-None-Match coincide con el ETag de la página se responde 304 sin leer ni serializar las filas.
+    Para consultas con varias entidades por fila: to_row convierte cada fila en lo que valida el esquema
+    y version es la expresión que cambia cuando cambia cualquiera de ellas (para el ETag).
+    """
+    stmt = keyset_page(stmt, model, cursor)
+    state = (await db.execute(page_state_stmt(stmt, model, limit, version))).one()
+    headers = {}
+    if state.rows > limit:
+        headers["X-Next-Cursor"] = encode_cursor(state.last_created_at, state.last_id)
+    etag = make_etag(state.rows, state.fingerprint)
+    if etag_matches(request, etag):
+        return not_modified(etag, headers)
+
+    stmt = stmt.limit(limit).execution_options(yield_per=STREAM_BATCH_SIZE)
+    if to_row is None:
+        rows = await db.stream(stmt.with_only_columns(*columns(model, schema)))
+    else:
+        rows = (to_row(row) async for row in await db.stream(stmt))
+    return StreamingResponse(
+        async_stream_json_array(rows, schema, exclude), media_type="application/json", headers=cache_headers(etag, headers)
+    )
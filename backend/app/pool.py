@@ -0,0 +1,135 @@
+'''
+Pool de conexiones instrumentado (GET /db/pool)
+    Pools de SQLAlchemy (QueuePool para psycopg2 y AsyncAdaptedQueuePool para asyncpg) que miden cuánto espera cada
+    petición hasta tener una conexión: la espera por el pool lleno, la conexión nueva si hace falta y el pre-ping.
+    Con los eventos del pool se cuentan las conexiones abiertas y las invalidadas (p. ej. caídas que detecta el pre-ping),
+    para ver si hay ráfagas que agotan el pool (esperas y timeouts) o reconexiones frecuentes.
+    Las esperas y las conexiones en uso se publican también en GET /metrics si las métricas están activas.
+    Es usado por database.py y main.py.
+'''
+
+from typing import Dict
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from . import metrics
+
+
+class PoolStats:
+    """Contadores de un pool (thread-safe): salidas, esperas, timeouts, conexiones abiertas e invalidadas"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+
+    def observe_wait(self, seconds: float, timed_out: bool):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.wait_seconds += seconds
+                self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "avg_wait_ms": round(self.wait_seconds / self.checkouts * 1000, 3) if self.checkouts else None,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+            }
+
+
+# Contadores por engine ("sync" / "async" / "async_replica"); sobreviven a que el engine recree su pool
+_stats: Dict[str, PoolStats] = {}
+_pools: Dict[str, QueuePool] = {}
+# max_overflow configurado de cada pool (ver database._pool_options)
+_max_overflow: Dict[str, int] = {}
+
+
+class _TimedPool:
+    """Mide la espera de cada salida del pool (connect) y cuenta los timeouts"""
+    engine_name = ""
+
+    def connect(self):
+        stats = _stats.setdefault(self.engine_name, PoolStats())
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            stats.observe_wait(seconds, timed_out)
+            if metrics.METRICS_ENABLED:
+                if timed_out:
+                    metrics.DB_POOL_TIMEOUTS.labels(self.engine_name).inc()
+                else:
+                    metrics.DB_POOL_WAIT_SECONDS.labels(self.engine_name).observe(seconds)
+
+
+class SyncPool(_TimedPool, QueuePool):
+    engine_name = "sync"
+
+
+class AsyncPool(_TimedPool, AsyncAdaptedQueuePool):
+    engine_name = "async"
+
+
+class AsyncReplicaPool(AsyncPool):
+    engine_name = "async_replica"
+
+
+def instrument_pool(engine, max_overflow: int):
+    """Cuenta las conexiones abiertas, invalidadas y en uso del pool del engine (síncrono, o sync_engine del asíncrono)"""
+    name = engine.pool.engine_name
+    stats = _stats.setdefault(name, PoolStats())
+    _pools[name] = engine.pool
+    _max_overflow[name] = max_overflow
+    # Los eventos se registran en el engine para que sigan activos si recrea el pool (dispose)
+    event.listen(engine, "connect", stats.on_connect)
+    event.listen(engine, "invalidate", stats.on_invalidate)
+    if metrics.METRICS_ENABLED:
+        checked_out = metrics.DB_POOL_CHECKED_OUT.labels(name)
+        event.listen(engine, "checkout", lambda *args: checked_out.inc())
+        event.listen(engine, "checkin", lambda *args: checked_out.dec())
+
+    @event.listens_for(engine, "engine_disposed")
+    def _pool_recreated(engine):
+        _pools[name] = engine.pool
+
+
+def pool_stats() -> dict:
+    """Estado y contadores de los pools de cada engine creado en el proceso"""
+    result = {}
+    for name, pool in _pools.items():
+        result[name] = {
+            "size": pool.size(),
+            "max_overflow": _max_overflow[name],
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            **_stats[name].as_dict(),
+        }
+    return result
@@ -0,0 +1,281 @@
+'''
+Perfilador de SQL por petición (GET /debug/sql)
+    Modo opcional para encontrar qué consultas hacen lentas las peticiones, sin coste si está desactivado:
+      - SQL_PROFILE=all perfila todas las peticiones; SQL_PROFILE=header solo las que llevan la cabecera
+        X-SQL-Profile: 1 junto con la API_KEY; off (por defecto) no instala nada.
+      - Los eventos before/after_cursor_execute de los engines de database.py anotan cada sentencia en la petición
+        en curso (variable de contexto, como metrics.py) y se agregan por ruta (la plantilla) y forma de la sentencia
+        (el SQL con los parámetros y las listas IN normalizados).
+      - N+1: una misma forma repetida SQL_PROFILE_N_PLUS_ONE veces o más en una petición se marca y se registra
+        en el log, porque suele ser una consulta por fila de un listado.
+      - Las SQL_PROFILE_SLOW_QUERIES consultas más lentas (desde SQL_PROFILE_SLOW_MS) se guardan con su plan de
+        EXPLAIN (ANALYZE, BUFFERS). Solo se analizan los SELECT generados por SQLAlchemy sin FOR UPDATE (volver a
+        ejecutarlos no tiene efectos); el plan se obtiene en la misma conexión y transacción, dentro de un SAVEPOINT,
+        así que la petición afectada tarda lo que dure la consulta otra vez.
+    Las consultas de los workers (WhatsApp, importación) no pertenecen a ninguna petición y no se perfilan.
+    Es usado por database.py y main.py.
+'''
+
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+from .deps import API_KEY
+
+# off / header (peticiones con X-SQL-Profile: 1 y la API_KEY) / all
+SQL_PROFILE = os.getenv("SQL_PROFILE", "off").lower()
+# Veces que se tiene que repetir una forma de sentencia en una petición para marcarla como N+1
+SQL_PROFILE_N_PLUS_ONE = int(os.getenv("SQL_PROFILE_N_PLUS_ONE", "5"))
+# Duración mínima (ms) de una consulta para guardarla entre las lentas, y cuántas se guardan
+SQL_PROFILE_SLOW_MS = float(os.getenv("SQL_PROFILE_SLOW_MS", "100"))
+SQL_PROFILE_SLOW_QUERIES = int(os.getenv("SQL_PROFILE_SLOW_QUERIES", "20"))
+# Peticiones perfiladas recientes que se guardan, y formas distintas de sentencia por ruta como máximo
+SQL_PROFILE_RECENT = int(os.getenv("SQL_PROFILE_RECENT", "50"))
+SQL_PROFILE_MAX_SHAPES = int(os.getenv("SQL_PROFILE_MAX_SHAPES", "1000"))
+
+PROFILE_HEADER = b"x-sql-profile"
+
+# Texto máximo de una sentencia o de sus parámetros en las respuestas de /debug/sql
+_MAX_TEXT = 2000
+
+_PLACEHOLDER = re.compile(r"\$\d+(::[\w\s\[\]]+?(?=[,)\s]|$))?|%\(\w+\)s|%s")
+_IN_LIST = re.compile(r"\(\s*\?(::\w+)?(\s*,\s*\?(::\w+)?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+logger = logging.getLogger(__name__)
+
+
+def statement_shape(statement: str) -> str:
+    """La sentencia sin valores: parámetros como ? y listas IN (?, ?, ...) como (...)"""
+    shape = _PLACEHOLDER.sub("?", statement)
+    shape = _IN_LIST.sub("(...)", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+
+def _truncate(value) -> str:
+    text = value if isinstance(value, str) else repr(value)
+    return text if len(text) <= _MAX_TEXT else text[:_MAX_TEXT] + "..."
+
+
+class RequestProfile:
+    """Sentencias de una petición perfilada: (forma, segundos)"""
+    __slots__ = ("statements", "scope")
+
+    def __init__(self, scope):
+        self.statements: List[Tuple[str, float]] = []
+        self.scope = scope
+
+    @property
+    def route(self) -> str:
+        """Método y plantilla de la ruta (la anota el router en el scope antes de llamar al endpoint)"""
+        return f"{self.scope['method']} {getattr(self.scope.get('route'), 'path', None) or 'unmatched'}"
+
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("sql_profile", default=None)
+
+
+class SqlProfiler:
+    """Agregados por ruta y forma, peticiones recientes y consultas más lentas con su plan (thread-safe)"""
+
+    def __init__(self, slow_ms: float = SQL_PROFILE_SLOW_MS, slow_queries: int = SQL_PROFILE_SLOW_QUERIES):
+        self.slow_seconds = slow_ms / 1000
+        self.slow_queries = slow_queries
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._shapes: Dict[Tuple[str, str], dict] = {}
+            self._recent = deque(maxlen=SQL_PROFILE_RECENT)
+            # Montículo de (segundos, orden, consulta): la más rápida de las guardadas es la primera en salir
+            self._slow: List[Tuple[float, int, dict]] = []
+            self._sequence = 0
+            self.dropped_shapes = 0
+
+    def is_slow(self, seconds: float) -> bool:
+        """Si la consulta entra entre las más lentas (antes de calcular su plan)"""
+        if seconds < self.slow_seconds:
+            return False
+        with self._lock:
+            return len(self._slow) < self.slow_queries or seconds > self._slow[0][0]
+
+    def add_slow(self, seconds: float, statement: str, parameters, plan: Optional[str], route: str):
+        entry = {
+            "route": route,
+            "ms": round(seconds * 1000, 1),
+            "statement": _truncate(statement),
+            "parameters": _truncate(parameters),
+            "plan": plan,
+            "at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+        with self._lock:
+            self._sequence += 1
+            item = (seconds, self._sequence, entry)
+            if len(self._slow) < self.slow_queries:
+                heapq.heappush(self._slow, item)
+            elif seconds > self._slow[0][0]:
+                heapq.heapreplace(self._slow, item)
+
+    def finish(self, profile: RequestProfile, status: int, seconds: float):
+        """Agrega las sentencias de una petición terminada y marca las formas repetidas (N+1)"""
+        counts: Dict[str, List[float]] = {}
+        for shape, query_seconds in profile.statements:
+            counts.setdefault(shape, []).append(query_seconds)
+        n_plus_one = [
+            {"statement": _truncate(shape), "count": len(times), "ms": round(sum(times) * 1000, 1)}
+            for shape, times in counts.items()
+            if len(times) >= SQL_PROFILE_N_PLUS_ONE
+        ]
+        route = profile.route
+        with self._lock:
+            for shape, times in counts.items():
+                key = (route, shape)
+                stats = self._shapes.get(key)
+                if stats is None:
+                    if len(self._shapes) >= SQL_PROFILE_MAX_SHAPES:
+                        self.dropped_shapes += 1
+                        continue
+                    stats = self._shapes[key] = {"executions": 0, "requests": 0, "seconds": 0.0, "max_ms": 0.0, "n_plus_one": 0}
+                stats["executions"] += len(times)
+                stats["requests"] += 1
+                stats["seconds"] += sum(times)
+                stats["max_ms"] = max(stats["max_ms"], round(max(times) * 1000, 1))
+                if len(times) >= SQL_PROFILE_N_PLUS_ONE:
+                    stats["n_plus_one"] += 1
+            self._recent.append({
+                "route": route,
+                "status": status,
+                "ms": round(seconds * 1000, 1),
+                "queries": len(profile.statements),
+                "db_ms": round(sum(query_seconds for _, query_seconds in profile.statements) * 1000, 1),
+                "n_plus_one": n_plus_one,
+                "at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            })
+        for entry in n_plus_one:
+            logger.warning("Posible N+1: la misma sentencia se repite en la petición", extra={"route": route, **entry})
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            shapes = [
+                {"route": route, "statement": _truncate(shape), **stats, "seconds": round(stats["seconds"], 4)}
+                for (route, shape), stats in self._shapes.items()
+            ]
+            recent = list(self._recent)
+            slow = [entry for _, _, entry in sorted(self._slow, reverse=True)]
+            dropped = self.dropped_shapes
+        by_route: Dict[str, dict] = {}
+        for shape in shapes:
+            route = by_route.setdefault(shape["route"], {"route": shape["route"], "seconds": 0.0, "executions": 0, "statements": []})
+            route["seconds"] = round(route["seconds"] + shape.pop("seconds"), 4)
+            route["executions"] += shape["executions"]
+            route["statements"].append({key: value for key, value in shape.items() if key != "route"})
+        routes = sorted(by_route.values(), key=lambda r: -r["seconds"])
+        for route in routes:
+            route["statements"].sort(key=lambda s: (-s["n_plus_one"], -s["executions"]))
+        return {
+            "mode": SQL_PROFILE,
+            "n_plus_one_threshold": SQL_PROFILE_N_PLUS_ONE,
+            "slow_ms": self.slow_seconds * 1000,
+            "routes": routes,
+            "dropped_shapes": dropped,
+            "slow_queries": slow,
+            "recent": recent[::-1],
+        }
+
+
+profiler = SqlProfiler()
+
+
+def _explainable(context) -> bool:
+    """Solo los SELECT de SQLAlchemy sin FOR UPDATE: repetirlos con EXPLAIN ANALYZE no cambia nada"""
+    compiled = getattr(context, "compiled", None)
+    statement = getattr(compiled, "statement", None)
+    return isinstance(statement, Select) and statement._for_update_arg is None and not context.executemany
+
+
+def _explain(conn, statement: str, parameters) -> str:
+    """Plan de EXPLAIN (ANALYZE, BUFFERS) en la misma conexión, en un SAVEPOINT para no abortar la transacción"""
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT sql_profile_explain")
+        try:
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT sql_profile_explain")
+            plan = f"EXPLAIN no disponible: {e}"
+        cursor.execute("RELEASE SAVEPOINT sql_profile_explain")
+        return plan
+    except Exception as e:
+        return f"EXPLAIN no disponible: {e}"
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        context._profile_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    started = getattr(context, "_profile_started", None)
+    if profile is None or started is None:
+        return
+    seconds = time.perf_counter() - started
+    profile.statements.append((statement_shape(statement), seconds))
+    if profiler.is_slow(seconds):
+        plan = _explain(conn, statement, parameters) if _explainable(context) else None
+        profiler.add_slow(seconds, statement, parameters, plan, profile.route)
+
+
+def instrument_engine(engine):
+    """Anota las sentencias del engine (síncrono, o el sync_engine del asíncrono) en la petición perfilada"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _wants_profile(scope) -> bool:
+    if SQL_PROFILE == "all":
+        return True
+    headers = dict(scope["headers"])
+    return headers.get(PROFILE_HEADER) == b"1" and headers.get(b"authorization") == f"Bearer {API_KEY}".encode()
+
+
+class SqlProfilerMiddleware:
+    """Perfila las peticiones elegidas según SQL_PROFILE"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        profile = RequestProfile(scope)
+        token = _current.set(profile)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            profiler.finish(profile, status, time.perf_counter() - started)
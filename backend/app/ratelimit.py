@@ -0,0 +1,153 @@
+'''
+Limitación de velocidad de envíos (token bucket)
+    TokenBucket limita los envíos dentro del proceso (compartido por todos los workers de la cola); es el que se usa
+    por defecto. PostgresTokenBucket guarda el bucket en la tabla rate_limit_bucket para compartir el mismo presupuesto
+    de mensajes/segundo entre varios procesos o contenedores, a costa de una consulta por envío.
+    Es usado por messaging.py para no superar el límite de Twilio y evitar respuestas 429.
+'''
+
+from typing import Callable
+import logging
+import random
+import threading
+import time
+
+from sqlalchemy import text
+
+# Segundos que se usa el bucket local cuando el compartido falla
+FALLBACK_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+
+def _check_limits(rate: float, capacity: float):
+    # Con rate <= 0 no se recuperan tokens y con capacity < 1 nunca se llega a uno: los envíos se bloquearían
+    if rate <= 0:
+        raise ValueError(f"El límite de envíos debe ser mayor que 0 (rate={rate})")
+    if capacity < 1:
+        raise ValueError(f"La ráfaga máxima debe ser de al menos 1 envío (capacity={capacity})")
+
+
+class TokenBucket:
+    """Token bucket local y thread-safe: `rate` tokens por segundo con una ráfaga máxima de `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        _check_limits(rate, capacity)
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self) -> float:
+        """Consume un token si hay. Devuelve 0 si lo ha conseguido o los segundos a esperar hasta el siguiente"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> float:
+        """Bloquea hasta conseguir un token. Devuelve el tiempo esperado en segundos"""
+        start = time.monotonic()
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return time.monotonic() - start
+            time.sleep(wait)
+
+
+class PostgresTokenBucket:
+    """
+    Token bucket compartido entre procesos: el estado vive en una fila de rate_limit_bucket
+    y se actualiza con un único UPDATE atómico por token.
+    Si la DB no responde se degrada al bucket local para no bloquear los envíos.
+    """
+
+    # Consume un token si hay (wait NULL) o devuelve los segundos hasta el siguiente, en una sola consulta
+    _ACQUIRE_SQL = text("""
+        WITH n AS (SELECT clock_timestamp() AS ts),
+        acquired AS (
+            UPDATE rate_limit_bucket b
+            SET tokens = LEAST(:capacity, b.tokens + EXTRACT(EPOCH FROM (n.ts - b.updated_at)) * :rate) - 1,
+                updated_at = n.ts
+            FROM n
+            WHERE b.name = :name
+              AND LEAST(:capacity, b.tokens + EXTRACT(EPOCH FROM (n.ts - b.updated_at)) * :rate) >= 1
+            RETURNING b.tokens
+        )
+        SELECT NULL AS wait FROM acquired
+        UNION ALL
+        SELECT (1 - LEAST(:capacity, b.tokens + EXTRACT(EPOCH FROM (n.ts - b.updated_at)) * :rate)) / :rate
+        FROM rate_limit_bucket b, n
+        WHERE b.name = :name AND NOT EXISTS (SELECT 1 FROM acquired)
+    """)
+
+    _INIT_SQL = text("""
+        INSERT INTO rate_limit_bucket (name, tokens, updated_at)
+        VALUES (:name, :capacity, clock_timestamp())
+        ON CONFLICT (name) DO NOTHING
+    """)
+
+    def __init__(self, name: str, rate: float, capacity: float, session_factory: Callable):
+        _check_limits(rate, capacity)
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.session_factory = session_factory
+        self._fallback = TokenBucket(rate, capacity)
+        self._initialized = False
+        # Tras un error de DB se usa el bucket local durante un tiempo antes de reintentar
+        self._fallback_until = 0.0
+
+    def _params(self) -> dict:
+        return {"name": self.name, "rate": self.rate, "capacity": self.capacity}
+
+    def _try_acquire(self) -> float:
+        """
+        Intenta consumir un token en una transacción corta, sin retener la conexión mientras se espera.
+        Devuelve 0 si lo ha conseguido o los segundos a esperar hasta el siguiente.
+        """
+        db = self.session_factory()
+        try:
+            if not self._initialized:
+                db.execute(self._INIT_SQL, self._params())
+                self._initialized = True
+            row = db.execute(self._ACQUIRE_SQL, self._params()).first()
+            db.commit()
+            if row is None:
+                return 1 / self.rate
+            return 0.0 if row.wait is None else max(float(row.wait), 0.001)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def acquire(self) -> float:
+        """Bloquea hasta conseguir un token del bucket compartido. Devuelve el tiempo esperado en segundos"""
+        start = time.monotonic()
+        if start < self._fallback_until:
+            return self._fallback.acquire()
+        try:
+            while True:
+                wait = self._try_acquire()
+                if wait == 0:
+                    return time.monotonic() - start
+                # Jitter para que los workers que esperan el mismo token no consulten todos a la vez
+                time.sleep(wait * random.uniform(1, 1.5))
+        except Exception as e:
+            self._fallback_until = time.monotonic() + FALLBACK_SECONDS
+            logger.warning(
+                "Error en el rate limiter compartido, se usa el límite local",
+                extra={"error": str(e), "fallback_seconds": FALLBACK_SECONDS},
+            )
+            return (time.monotonic() - start) + self._fallback.acquire()
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Backoff exponencial con jitter completo: espera aleatoria entre 0 y min(cap, base * 2^attempt)"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
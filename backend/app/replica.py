@@ -0,0 +1,144 @@
+'''
+Lecturas desde la réplica
+    Con DATABASE_REPLICA_URL (ver database.py) los listados que consulta el dashboard cada pocos segundos
+    (GET /customers, GET /shipments, interacciones de un envío y GET /stats) leen de la réplica, y la DB principal
+    queda para las escrituras (importaciones, webhook, CRUD) y las lecturas que deben estar al día
+    (GET /customers/{id} y GET /shipments/{id} se guardan en la caché, ver cache.py).
+    Read-your-writes: la réplica va unos milisegundos por detrás, así que quien acaba de escribir (POST, PUT, PATCH o
+    DELETE con éxito) recibe una cookie que, durante REPLICA_STICKY_SECONDS, envía sus lecturas a la principal.
+    Los clientes que no guardan cookies pueden pedirlo en cada lectura con X-Read-Primary: 1 o Cache-Control: no-cache.
+    Las peticiones condicionales (If-None-Match) van también a la principal si la réplica lleva más retraso que
+    REPLICA_STICKY_SECONDS: el ETag que tiene el cliente puede venir de la principal y la réplica respondería con
+    datos más antiguos. El retraso se consulta en la réplica como mucho cada REPLICA_LAG_CHECK_SECONDS.
+    Los demás clientes ven el cambio en cuanto llega a la réplica, y antes por el feed de cambios (GET /events).
+    Es usado por main.py.
+'''
+
+import asyncio
+import logging
+import os
+import time
+
+from fastapi import Request
+from sqlalchemy import text
+
+from .database import DATABASE_REPLICA_URL, AsyncReplicaSessionLocal, AsyncSessionLocal
+from .database import get_async_engine, get_async_replica_engine
+
+# Segundos durante los que un cliente lee de la DB principal tras una escritura (debe superar el retraso de la réplica)
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+
+# Cada cuánto se vuelve a consultar el retraso de la réplica (para las peticiones condicionales)
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "1"))
+
+# Cookie con el instante (epoch) hasta el que el cliente lee de la principal
+STICKY_COOKIE = "db_primary_until"
+
+# Cabecera con la que un cliente pide leer de la principal sin depender de la cookie
+READ_PRIMARY_HEADER = "x-read-primary"
+
+_READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Rutas que no escriben en la DB, o cuyo cliente no lee después (el webhook responde a Twilio): no dan la cookie,
+# para que, p. ej., el token del feed que pide el dashboard al (re)conectar no mande su snapshot a la principal
+_NON_WRITING_PATHS = {"/events/token", "/twilio/incoming", "/test/whatsapp", "/debug/sql"}
+
+# Retraso de la réplica: 0 si no está en recuperación (p. ej. la réplica simulada) o si ha aplicado todo lo recibido
+# (con la principal sin escrituras, pg_last_xact_replay_timestamp() se queda atrás aunque la réplica esté al día)
+_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+logger = logging.getLogger(__name__)
+
+
+def reads_from_primary(request: Request) -> bool:
+    """
+    Si la petición debe leer de la principal: sin réplica, si el cliente ha escrito hace poco (cookie)
+    o si lo pide con X-Read-Primary: 1 o Cache-Control: no-cache
+    """
+    if not DATABASE_REPLICA_URL:
+        return True
+    if request.headers.get(READ_PRIMARY_HEADER, "").strip().lower() in ("1", "true"):
+        return True
+    cache_control = request.headers.get("cache-control", "").lower()
+    if "no-cache" in (directive.strip() for directive in cache_control.split(",")):
+        return True
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, "0")) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaLag:
+    """Retraso de la réplica en segundos, consultado como mucho cada REPLICA_LAG_CHECK_SECONDS"""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self._checked_at = None
+        self._lock = asyncio.Lock()
+
+    async def current(self) -> float:
+        if self._fresh():
+            return self.seconds
+        async with self._lock:
+            if not self._fresh():
+                try:
+                    get_async_replica_engine()
+                    async with AsyncReplicaSessionLocal() as db:
+                        self.seconds = float((await db.execute(_LAG_SQL)).scalar())
+                except Exception as e:
+                    # Sin saber el retraso, las peticiones condicionales van a la principal
+                    self.seconds = float("inf")
+                    logger.warning("Error consultando el retraso de la réplica", extra={"error": str(e)})
+                self._checked_at = time.monotonic()
+        return self.seconds
+
+    def _fresh(self) -> bool:
+        return self._checked_at is not None and time.monotonic() - self._checked_at < REPLICA_LAG_CHECK_SECONDS
+
+
+# Retraso de la réplica visto por el proceso
+replica_lag = ReplicaLag()
+
+
+async def get_async_read_db(request: Request):
+    """
+    Sesión de solo lectura: de la réplica si está configurada, o de la principal (ver reads_from_primary, y las
+    peticiones condicionales con la réplica retrasada)
+    """
+    use_primary = reads_from_primary(request)
+    if not use_primary and "if-none-match" in request.headers:
+        use_primary = await replica_lag.current() > REPLICA_STICKY_SECONDS
+    if use_primary:
+        get_async_engine()
+        session_factory = AsyncSessionLocal
+    else:
+        get_async_replica_engine()
+        session_factory = AsyncReplicaSessionLocal
+    async with session_factory() as db:
+        yield db
+
+
+class ReadYourWritesMiddleware:
+    """Añade la cookie de STICKY_COOKIE a las respuestas correctas de las peticiones que escriben"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in _READ_METHODS or scope["path"] in _NON_WRITING_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                until = int(time.time()) + REPLICA_STICKY_SECONDS
+                cookie = f"{STICKY_COOKIE}={until}; Max-Age={REPLICA_STICKY_SECONDS}; Path=/; HttpOnly; SameSite=Lax"
+                message["headers"] = [*message.get("headers", []), (b"set-cookie", cookie.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
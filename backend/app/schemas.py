@@ -5,13 +5,16 @@ Esquemas de Datos (Pydantic)
     Es usado por main.py para validar las peticiones HTTP y estructurar las respuestas.
 '''
 
-from datetime import time, datetime
-from typing import Optional, Literal
+from datetime import date, time, datetime
+from typing import Dict, List, Optional, Literal
 from uuid import UUID
 from zoneinfo import ZoneInfo
 
 from pydantic import BaseModel, Field, field_serializer
 
+# Zona horaria de los datetime que llegan sin ella (se crea una vez, no en cada serialización)
+MADRID_TZ = ZoneInfo("Europe/Madrid")
+
 
 # CUSTOMER
 
@@ -45,7 +48,7 @@ class CustomerOut(CustomerBase):
         """Serializa datetime en formato ISO 8601 con timezone"""
         if dt.tzinfo is None:
             # Si no tiene timezone, asumir Europe/Madrid
-            dt = dt.replace(tzinfo=ZoneInfo("Europe/Madrid"))
+            dt = dt.replace(tzinfo=MADRID_TZ)
         return dt.isoformat()
 
     class Config:
@@ -78,7 +81,7 @@ class ShipmentOut(ShipmentBase):
         """Serializa datetime en formato ISO 8601 con timezone"""
         if dt.tzinfo is None:
             # Si no tiene timezone, asumir Europe/Madrid
-            dt = dt.replace(tzinfo=ZoneInfo("Europe/Madrid"))
+            dt = dt.replace(tzinfo=MADRID_TZ)
         return dt.isoformat()
 
     class Config:
@@ -101,8 +104,69 @@ class DeliveryInteractionOut(BaseModel):
         """Serializa datetime en formato ISO 8601 con timezone"""
         if dt.tzinfo is None:
             # Si no tiene timezone, asumir Europe/Madrid
-            dt = dt.replace(tzinfo=ZoneInfo("Europe/Madrid"))
+            dt = dt.replace(tzinfo=MADRID_TZ)
         return dt.isoformat()
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class ShipmentDetailOut(ShipmentOut):
+    """Envío con los datos relacionados pedidos en GET /shipments?include=customer,last_interaction"""
+    customer: Optional[CustomerOut] = None
+    last_interaction: Optional[DeliveryInteractionOut] = None
+
+
+# IMPORT JOB (importación del spreadsheet en segundo plano)
+
+ImportJobStatus = Literal["queued", "running", "completed", "failed"]
+
+
+class ImportJobOut(BaseModel):
+    id: UUID
+    status: ImportJobStatus
+    source: str
+    revision: Optional[str]
+    full_import: bool
+    results: dict                      # contadores de la importación (filas, clientes, shipments, WhatsApp, errores)
+    rows_per_second: Optional[float]
+    error: Optional[str]
+    attempts: int
+    created_at: datetime
+    started_at: Optional[datetime]
+    heartbeat_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+
+# STATS (GET /stats)
+
+class DailyStatsOut(BaseModel):
+    day: date                          # día de entrega prevista (Europe/Madrid)
+    total: int
+    by_status: Dict[str, int]
+
+
+class CustomerStatsOut(BaseModel):
+    customer_id: UUID
+    name: str
+    total: int
+    by_status: Dict[str, int]
+
+
+class ConfirmationLatencyOut(BaseModel):
+    replies: int                       # respuestas SI/NO recibidas en el periodo
+    confirmed: int
+    rejected: int
+    timed_replies: int                 # las que tienen un WhatsApp de aviso anterior (base de la latencia)
+    avg_seconds: Optional[float]
+    max_seconds: Optional[float]
+
+
+class StatsOut(BaseModel):
+    total: int
+    by_status: Dict[str, int]
+    date_from: date
+    date_to: date
+    by_day: List[DailyStatsOut]
+    by_customer: List[CustomerStatsOut]
+    confirmation_latency: ConfirmationLatencyOut
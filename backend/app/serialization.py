@@ -0,0 +1,103 @@
+'''
+Serialización JSON rápida de los listados
+    Convierte las filas de la DB (Row de columnas, objetos ORM o diccionarios) directamente al JSON de un esquema de
+    respuesta de schemas.py con orjson, sin crear un modelo Pydantic por fila ni llamar a sus field_serializer.
+    El resultado es idéntico byte a byte a schema.model_validate(fila).model_dump_json(): mismos campos en el mismo
+    orden, y los datetime sin zona horaria se consideran de Europe/Madrid, como en los esquemas
+    (lo comprueba utils/bench_serialization.py).
+    Cada esquema se prepara una vez (campos, conversiones y modelos anidados) y se reutiliza.
+    Es usado por pagination.py y main.py.
+'''
+
+from datetime import date, datetime, time
+from functools import lru_cache
+from operator import attrgetter
+from typing import Callable, FrozenSet, Iterable, Literal, Optional, Type, Union, get_args, get_origin
+from uuid import UUID
+
+import orjson
+from pydantic import BaseModel
+
+from .models import MADRID_TZ
+
+# Tipos que orjson serializa igual que Pydantic
+_NATIVE_TYPES = (str, int, bool, UUID, date, time)
+
+
+def _default(value):
+    # asyncpg devuelve su propia subclase de UUID, que orjson no serializa directamente
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def _with_default_tz(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=MADRID_TZ)
+    return value
+
+
+def _converter(schema: Type[BaseModel], name: str, annotation, serialized: set) -> Optional[Callable]:
+    """Conversión de un campo antes de orjson (None si se pasa tal cual); TypeError si no se puede reproducir"""
+    options = get_args(annotation) if get_origin(annotation) is Union else (annotation,)
+    options = [option for option in options if option is not type(None)]
+    if len(options) == 1 and get_origin(options[0]) is Literal:
+        options = list({type(value) for value in get_args(options[0])})
+    if len(options) == 1 and isinstance(options[0], type):
+        kind = options[0]
+        if kind is datetime and name in serialized:
+            # Equivale al field_serializer de schemas.py (zona por defecto + isoformat, que orjson produce igual)
+            return _with_default_tz
+        if issubclass(kind, BaseModel) and name not in serialized:
+            nested = compile_schema(kind)
+            return lambda value: None if value is None else nested(value)
+        if issubclass(kind, _NATIVE_TYPES) and kind is not datetime and name not in serialized:
+            return None
+    raise TypeError(f"{schema.__name__}.{name}: tipo no soportado por la serialización rápida ({annotation})")
+
+
+@lru_cache(maxsize=None)
+def compile_schema(schema: Type[BaseModel], exclude: FrozenSet[str] = frozenset()) -> Callable[[object], dict]:
+    """Función fila -> diccionario con los campos del esquema (en su orden) listo para orjson"""
+    serialized = {
+        field
+        for decorator in schema.__pydantic_decorators__.field_serializers.values()
+        for field in decorator.info.fields
+    }
+    names = tuple(name for name in schema.model_fields if name not in exclude)
+    converted = tuple(
+        (name, convert)
+        for name in names
+        if (convert := _converter(schema, name, schema.model_fields[name].annotation, serialized)) is not None
+    )
+    # Todos los campos se leen de una vez (attrgetter) y solo se convierten los que lo necesitan
+    getter = attrgetter(*names) if len(names) > 1 else (lambda row: (getattr(row, names[0]),))
+
+    def to_dict(row) -> dict:
+        if type(row) is dict:
+            data = {name: row[name] for name in names}
+        else:
+            data = dict(zip(names, getter(row)))
+        for name, convert in converted:
+            data[name] = convert(data[name])
+        return data
+
+    return to_dict
+
+
+def row_serializer(schema: Type[BaseModel], exclude: Optional[Iterable[str]] = None) -> Callable[[object], bytes]:
+    """Función fila -> JSON (bytes) del esquema, sin los campos de exclude"""
+    to_dict = compile_schema(schema, frozenset(exclude or ()))
+    return lambda row: orjson.dumps(to_dict(row), default=_default)
+
+
+def dumps_list(rows: Iterable, schema: Type[BaseModel]) -> bytes:
+    """Array JSON con todas las filas (respuestas no paginadas)"""
+    to_dict = compile_schema(schema)
+    return orjson.dumps([to_dict(row) for row in rows], default=_default)
+
+
+def columns(model, schema: Type[BaseModel]) -> list:
+    """Columnas de la tabla del modelo que necesita el esquema, para leer filas (tuplas) en lugar de objetos ORM"""
+    table = model.__table__.c
+    return [table[name] for name in schema.model_fields if name in table]
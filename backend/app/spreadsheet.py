@@ -1,13 +1,36 @@
 '''
 Utilidades para leer Google Sheets
+    El origen de los pedidos (SheetSource) guarda el cliente autorizado y la hoja ya abierta entre llamadas, y
+    expone la revisión actual (modifiedTime de Drive) para no descargar las filas si la hoja no ha cambiado.
+    Con SPREADSHEET_LOCAL_PATH se usa en su lugar un fichero CSV/JSON local con las mismas columnas (pruebas sin Google).
+    iter_rows() lee la hoja por bloques de filas (un rango por petición) para no tenerla entera en memoria.
+    row_fingerprint() identifica cada fila por sus campos normalizados, para importar solo las nuevas o modificadas.
+    Es usado por main.py (GET /spreadsheet y POST /spreadsheet/process) e importer.py.
 '''
 
+from itertools import islice
+from typing import Iterator, List, Optional
+import csv
+import hashlib
+import json
+import logging
+import os
+import threading
+
 import gspread
+from gspread.utils import numericise_all
 from google.oauth2.service_account import Credentials
-import os
-import json
 
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
+logger = logging.getLogger(__name__)
+
+# La revisión de la hoja se lee de los metadatos de Drive (modifiedTime)
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets.readonly",
+    "https://www.googleapis.com/auth/drive.metadata.readonly",
+]
+
+# Fichero local (.csv o .json) que sustituye al Google Sheet, p. ej. para desarrollo sin credenciales
+SPREADSHEET_LOCAL_PATH = os.getenv("SPREADSHEET_LOCAL_PATH")
 
 
 def get_google_credentials():
@@ -33,14 +56,149 @@ def get_spreadsheet_client():
     return gspread.authorize(creds)
 
 
+def row_fingerprint(row: dict) -> str:
+    """Hash de los campos normalizados de una fila (sin el número de fila: moverla no la cambia)"""
+    fields = sorted((str(key).strip(), str(value).strip()) for key, value in row.items())
+    return hashlib.sha256(json.dumps(fields, ensure_ascii=False).encode()).hexdigest()
+
+
+class GoogleSheetSource:
+    """
+    Primera hoja del Google Sheet de GOOGLE_SHEETS_URL.
+    Las credenciales, el cliente autorizado y la hoja abierta se crean una vez y se reutilizan
+    (google-auth renueva el token cuando caduca); ante un error se descartan y se vuelven a crear en la siguiente llamada.
+    """
+
+    def __init__(self, sheet_url: str):
+        self.sheet_url = sheet_url
+        self.key = f"gsheet:{sheet_url}"
+        self._lock = threading.Lock()
+        self._spreadsheet = None
+        self._worksheet = None
+        # Sin permiso de Drive no hay revisión: se descargan las filas y se comparan las huellas
+        self._revision_supported = True
+
+    def _open(self):
+        with self._lock:
+            if self._worksheet is None:
+                spreadsheet = get_spreadsheet_client().open_by_url(self.sheet_url)
+                self._worksheet = spreadsheet.sheet1
+                self._spreadsheet = spreadsheet
+            return self._spreadsheet, self._worksheet
+
+    def reset(self):
+        with self._lock:
+            self._spreadsheet = None
+            self._worksheet = None
+
+    def revision(self) -> Optional[str]:
+        """modifiedTime del fichero en Drive, o None si no se puede consultar"""
+        if not self._revision_supported:
+            return None
+        spreadsheet, _ = self._open()
+        try:
+            return spreadsheet.get_lastUpdateTime()
+        except gspread.exceptions.APIError as e:
+            if e.response.status_code == 403:
+                logger.warning("Sin acceso a los metadatos de Drive del spreadsheet: se compararán las filas en cada importación")
+                self._revision_supported = False
+                return None
+            self.reset()
+            raise
+
+    def read_rows(self) -> List[dict]:
+        _, worksheet = self._open()
+        try:
+            return worksheet.get_all_records()
+        except Exception:
+            self.reset()
+            raise
+
+    def iter_rows(self, chunk_size: int) -> Iterator[List[dict]]:
+        """
+        Filas por bloques de chunk_size, leyendo un rango de filas por petición (la primera incluye la cabecera).
+        Los valores se convierten como en get_all_records (números a int/float).
+        """
+        spreadsheet, worksheet = self._open()
+        try:
+            # Número de filas actual de la hoja (la hoja abierta en caché puede haber crecido)
+            metadata = spreadsheet.fetch_sheet_metadata()
+            row_count = next(
+                sheet["properties"]["gridProperties"]["rowCount"]
+                for sheet in metadata["sheets"]
+                if sheet["properties"]["sheetId"] == worksheet.id
+            )
+            header = None
+            start = 1
+            while start <= row_count:
+                end = min(start + chunk_size - (1 if header else 0), row_count)
+                values = worksheet.get(f"{start}:{end}")
+                if header is None:
+                    if not values:
+                        return
+                    header, values = values[0], values[1:]
+                yield [
+                    dict(zip(header, numericise_all(row + [""] * (len(header) - len(row)))))
+                    for row in values
+                ]
+                start = end + 1
+        except Exception:
+            self.reset()
+            raise
+
+
+class LocalSheetSource:
+    """Fichero local con las mismas columnas que el Google Sheet: CSV con cabecera o JSON (lista de objetos)"""
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self.key = f"file:{self.path}"
+
+    def revision(self) -> Optional[str]:
+        stat = os.stat(self.path)
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def read_rows(self) -> List[dict]:
+        with open(self.path, encoding="utf-8-sig", newline="") as f:
+            if self.path.lower().endswith(".json"):
+                return json.load(f)
+            return list(csv.DictReader(f))
+
+    def iter_rows(self, chunk_size: int) -> Iterator[List[dict]]:
+        """Filas por bloques; el CSV se lee en streaming, el JSON se carga entero"""
+        if self.path.lower().endswith(".json"):
+            rows = iter(self.read_rows())
+            while chunk := list(islice(rows, chunk_size)):
+                yield chunk
+            return
+        with open(self.path, encoding="utf-8-sig", newline="") as f:
+            reader = csv.DictReader(f)
+            while chunk := list(islice(reader, chunk_size)):
+                yield chunk
+
+    def reset(self):
+        pass
+
+
+_source = None
+_source_lock = threading.Lock()
+
+
+def get_source():
+    """Origen de los pedidos del proceso (fichero local si hay SPREADSHEET_LOCAL_PATH, si no Google Sheets)"""
+    global _source
+    with _source_lock:
+        if _source is None:
+            if SPREADSHEET_LOCAL_PATH:
+                _source = LocalSheetSource(SPREADSHEET_LOCAL_PATH)
+            else:
+                _source = GoogleSheetSource(os.getenv("GOOGLE_SHEETS_URL"))
+        return _source
+
+
 def read_spreadsheet():
     """Lee el spreadsheet configurado y devuelve los datos"""
     try:
-        client = get_spreadsheet_client()
-        sheet_url = os.getenv("GOOGLE_SHEETS_URL")
-        sheet = client.open_by_url(sheet_url).sheet1
-        rows = sheet.get_all_records()
-        return rows
+        return get_source().read_rows()
     except Exception as e:
         raise Exception(f"Error leyendo spreadsheet: {str(e)}")
-
@@ -0,0 +1,208 @@
+'''
+Indicadores de envíos y confirmaciones (GET /stats)
+    Lee los resúmenes de la migración 0005_shipment_stats (envíos por estado, por día de entrega prevista y por cliente,
+    y respuestas SI/NO por día con el tiempo desde el WhatsApp de aviso) más las variaciones que sus triggers han
+    añadido desde la última compactación, así que el coste depende del número de días y de clientes pedidos, no del
+    histórico de envíos. StatsCompactor suma cada STATS_COMPACT_SECONDS esas variaciones a los resúmenes, para que
+    las escrituras concurrentes (webhook, importaciones, CRUD) no compitan por las mismas filas de contadores.
+    Es usado por main.py.
+'''
+
+from datetime import date, timedelta
+from typing import Dict, Optional, get_args
+from uuid import UUID
+import asyncio
+import logging
+import os
+
+from sqlalchemy import func, select, text, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas
+from .database import AsyncSessionLocal, get_async_engine
+from .models import get_madrid_now
+
+# Días antes y después de hoy que se devuelven si no se indica el periodo
+STATS_DEFAULT_DAYS = int(os.getenv("STATS_DEFAULT_DAYS", "7"))
+# Días como máximo de un periodo (400 si se pide uno mayor)
+STATS_MAX_DAYS = int(os.getenv("STATS_MAX_DAYS", "366"))
+# Clientes con más envíos que se devuelven en by_customer
+STATS_TOP_CUSTOMERS = int(os.getenv("STATS_TOP_CUSTOMERS", "20"))
+# Cada cuánto se suman a los resúmenes las variaciones que añaden los triggers (0 desactiva la compactación del proceso)
+STATS_COMPACT_SECONDS = float(os.getenv("STATS_COMPACT_SECONDS", "10"))
+
+STATUSES = get_args(schemas.StatusType)
+
+logger = logging.getLogger(__name__)
+
+
+def default_period() -> tuple:
+    today = get_madrid_now().date()
+    return today - timedelta(days=STATS_DEFAULT_DAYS), today + timedelta(days=STATS_DEFAULT_DAYS)
+
+
+def _by_status(rows) -> Dict[str, int]:
+    """Contadores de todos los estados (0 si no hay envíos), a partir de filas (status, shipments)"""
+    counts = dict.fromkeys(STATUSES, 0)
+    for status, shipments in rows:
+        counts[status] = counts.get(status, 0) + shipments
+    return counts
+
+
+async def shipment_stats(
+    db: AsyncSession,
+    date_from: date,
+    date_to: date,
+    customer_id: Optional[UUID] = None,
+    top_customers: int = STATS_TOP_CUSTOMERS,
+) -> dict:
+    """Indicadores globales, del periodo [date_from, date_to] y de los clientes con más envíos (o de customer_id)"""
+    change = models.ShipmentStatsChange
+    counts = models.ShipmentStatusCount
+    totals_rows = union_all(
+        select(counts.status, counts.shipments),
+        select(change.status, change.shipments),
+    ).subquery()
+    totals = (await db.execute(
+        select(totals_rows.c.status, func.sum(totals_rows.c.shipments)).group_by(totals_rows.c.status)
+    )).all()
+
+    daily = models.ShipmentDailyStatus
+    daily_rows = union_all(
+        select(daily.day, daily.status, daily.shipments).where(daily.day.between(date_from, date_to)),
+        select(change.day, change.status, change.shipments).where(change.day.between(date_from, date_to)),
+    ).subquery()
+    days: Dict[date, list] = {}
+    for row in (await db.execute(
+        select(daily_rows.c.day, daily_rows.c.status, func.sum(daily_rows.c.shipments).label("shipments"))
+        .group_by(daily_rows.c.day, daily_rows.c.status)
+        .having(func.sum(daily_rows.c.shipments) != 0)
+        .order_by(daily_rows.c.day)
+    )).all():
+        days.setdefault(row.day, []).append((row.status, row.shipments))
+
+    per_customer = models.ShipmentCustomerStatus
+    customer_rows = union_all(
+        select(per_customer.customer_id, per_customer.status, per_customer.shipments),
+        select(change.customer_id, change.status, change.shipments),
+    ).subquery()
+    if customer_id is not None:
+        selected = customer_rows.c.customer_id == customer_id
+    else:
+        selected = customer_rows.c.customer_id.in_(
+            select(customer_rows.c.customer_id)
+            .group_by(customer_rows.c.customer_id)
+            .having(func.sum(customer_rows.c.shipments) > 0)
+            .order_by(func.sum(customer_rows.c.shipments).desc(), customer_rows.c.customer_id)
+            .limit(top_customers)
+        )
+    customers: Dict[UUID, dict] = {}
+    for row in (await db.execute(
+        select(
+            customer_rows.c.customer_id, models.Customer.name, customer_rows.c.status,
+            func.sum(customer_rows.c.shipments).label("shipments"),
+        )
+        .join(models.Customer, models.Customer.id == customer_rows.c.customer_id)
+        .where(selected)
+        .group_by(customer_rows.c.customer_id, models.Customer.name, customer_rows.c.status)
+    )).all():
+        entry = customers.setdefault(row.customer_id, {"customer_id": row.customer_id, "name": row.name, "rows": []})
+        entry["rows"].append((row.status, row.shipments))
+
+    replies = models.ShipmentReplyDaily
+    reply_change = models.ShipmentReplyChange
+    reply_rows = union_all(*(
+        select(
+            table.result, table.replies, table.timed_replies, table.total_seconds, table.max_seconds
+        ).where(table.day.between(date_from, date_to))
+        for table in (replies, reply_change)
+    )).subquery()
+    latency = {
+        row.result: row
+        for row in (await db.execute(
+            select(
+                reply_rows.c.result,
+                func.sum(reply_rows.c.replies).label("replies"),
+                func.sum(reply_rows.c.timed_replies).label("timed_replies"),
+                func.sum(reply_rows.c.total_seconds).label("total_seconds"),
+                func.max(reply_rows.c.max_seconds).label("max_seconds"),
+            )
+            .group_by(reply_rows.c.result)
+        )).all()
+    }
+    timed = sum(int(row.timed_replies) for row in latency.values())
+    max_seconds = [row.max_seconds for row in latency.values() if row.max_seconds is not None]
+
+    by_status = _by_status(totals)
+    by_customer = []
+    for entry in customers.values():
+        counts = _by_status(entry.pop("rows"))
+        by_customer.append({**entry, "total": sum(counts.values()), "by_status": counts})
+    by_customer.sort(key=lambda c: (-c["total"], str(c["customer_id"])))
+    by_day = []
+    for day, rows in days.items():
+        counts = _by_status(rows)
+        by_day.append({"day": day, "total": sum(counts.values()), "by_status": counts})
+    return {
+        "total": sum(by_status.values()),
+        "by_status": by_status,
+        "date_from": date_from,
+        "date_to": date_to,
+        "by_day": by_day,
+        "by_customer": by_customer,
+        "confirmation_latency": {
+            "replies": sum(int(row.replies) for row in latency.values()),
+            "confirmed": int(latency["confirmed"].replies) if "confirmed" in latency else 0,
+            "rejected": int(latency["rejected"].replies) if "rejected" in latency else 0,
+            "timed_replies": timed,
+            "avg_seconds": round(sum(row.total_seconds for row in latency.values()) / timed, 1) if timed else None,
+            "max_seconds": round(max(max_seconds), 1) if max_seconds else None,
+        },
+    }
+
+
+class StatsCompactor:
+    """
+    Tarea del proceso que llama a shipment_stats_compact() cada STATS_COMPACT_SECONDS en la DB principal.
+    Si hay varios procesos, la función solo compacta en uno a la vez (advisory lock) y los demás no esperan.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.compacted = 0
+
+    async def compact(self) -> int:
+        """Compacta las variaciones pendientes y devuelve cuántas filas de variación ha sumado"""
+        get_async_engine()
+        async with AsyncSessionLocal() as db:
+            compacted = (await db.execute(text("SELECT shipment_stats_compact()"))).scalar()
+            await db.commit()
+        self.compacted += compacted
+        return compacted
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(STATS_COMPACT_SECONDS)
+            try:
+                await self.compact()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Error compactando los resúmenes de GET /stats", extra={"error": str(e)})
+
+    def start(self):
+        if self._task is None and STATS_COMPACT_SECONDS > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Compactador de los resúmenes del proceso
+compactor = StatsCompactor()
@@ -0,0 +1,256 @@
+'''
+Importación de ficheros subidos (CSV, XLSX y JSON)
+    POST /imports/upload guarda el cuerpo de la petición en IMPORT_UPLOAD_DIR a medida que llega (sin tenerlo entero
+    en memoria) y lo registra como un trabajo de importación más (jobs.py), con origen "upload:{feed}" y como revisión
+    el sha256 del fichero: subir dos veces el mismo fichero devuelve el trabajo ya completado.
+    El fichero se copia por bloques a la tabla import_upload_chunk con el id del trabajo, en la misma transacción
+    que lo crea, así que cualquier proceso o contenedor puede ejecutarlo o retomarlo; el worker lo vuelve a copiar a
+    un fichero local para leerlo, y los bloques se borran cuando el trabajo termina.
+    Cada formato tiene su adaptador, que lee el fichero por bloques de filas con las columnas del spreadsheet
+    (importer.canonical_column), así que el parseo, la deduplicación por huella y las inserciones son las mismas
+    que para el Google Sheet (importer.import_chunks).
+    Es usado por main.py y jobs.py.
+'''
+
+from datetime import date, datetime, time
+from itertools import islice
+from typing import Iterator, List, Optional
+import csv
+import io
+import json
+import os
+import re
+import tempfile
+import uuid
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .importer import canonical_column
+
+# Carpeta local de cada proceso donde se reciben los ficheros subidos y donde el worker copia el que importa
+# (solo mientras tanto: el fichero del trabajo se guarda en la DB)
+IMPORT_UPLOAD_DIR = os.getenv("IMPORT_UPLOAD_DIR", "/tmp/zarracin-uploads")
+# Tamaño máximo de un fichero subido (413 si se supera)
+IMPORT_UPLOAD_MAX_BYTES = int(os.getenv("IMPORT_UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+
+FORMATS = ("csv", "xlsx", "json")
+
+# Content-Type -> formato, si no se indica ?format=
+CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "text/plain": "csv",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+    "application/json": "json",
+}
+
+# Delimitadores que se prueban en la cabecera del CSV (Excel en español exporta con ;)
+CSV_DELIMITERS = ",;\t|"
+
+# Bytes leídos por bloque del JSON
+JSON_READ_SIZE = 64 * 1024
+
+# Bytes por fila de import_upload_chunk
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+_FEED_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+_REVISION_RE = re.compile(r"^[0-9a-f]{64}\.(csv|xlsx|json)$")
+
+
+def detect_format(format: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    """Formato indicado en la petición, o el que corresponde a su Content-Type"""
+    if format:
+        format = format.lower()
+        return format if format in FORMATS else None
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return CONTENT_TYPES.get(media_type)
+
+
+def valid_feed(feed: str) -> bool:
+    return bool(_FEED_RE.match(feed))
+
+
+def store_upload(db: Session, job_id: uuid.UUID, path: str):
+    """Copia el fichero recibido en path a import_upload_chunk, con el id de su trabajo (sin commit)"""
+    with open(path, "rb") as f:
+        seq = 0
+        while data := f.read(UPLOAD_CHUNK_BYTES):
+            db.execute(insert(models.ImportUploadChunk).values(job_id=job_id, seq=seq, data=data))
+            seq += 1
+
+
+def delete_upload(db: Session, job_id: uuid.UUID):
+    """Borra el fichero subido del trabajo, si lo tiene (sin commit)"""
+    db.execute(delete(models.ImportUploadChunk).where(models.ImportUploadChunk.job_id == job_id))
+
+
+def _chunks(rows: Iterator[dict], chunk_size: int) -> Iterator[List[dict]]:
+    while chunk := list(islice(rows, chunk_size)):
+        yield chunk
+
+
+def iter_csv(f, chunk_size: int) -> Iterator[List[dict]]:
+    """CSV con cabecera; el delimitador se deduce de la primera línea"""
+    text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+    first_line = text.readline()
+    if not first_line.strip():
+        return
+    counts = {delimiter: first_line.count(delimiter) for delimiter in CSV_DELIMITERS}
+    delimiter = max(counts, key=counts.get)
+    header = [canonical_column(name) for name in next(csv.reader([first_line], delimiter=delimiter))]
+    reader = csv.DictReader(text, fieldnames=header, delimiter=delimiter, restval="")
+    yield from _chunks(iter(reader), chunk_size)
+
+
+def _xlsx_value(value):
+    # Las celdas de Excel vienen tipadas: se pasan al texto que tendrían en el Google Sheet
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        if value.time() == time(0, 0):
+            return value.strftime("%d/%m/%Y")
+        return value.strftime("%d/%m/%Y %H:%M:%S")
+    if isinstance(value, date):
+        return value.strftime("%d/%m/%Y")
+    if isinstance(value, time):
+        return value.strftime("%H:%M:%S")
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def iter_xlsx(f, chunk_size: int) -> Iterator[List[dict]]:
+    """Primera hoja del libro, en modo read_only (openpyxl la recorre en streaming)"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(f, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        first = next(rows, None)
+        if first is None:
+            return
+        header = [canonical_column(name) if name is not None else "" for name in first]
+        records = (
+            dict(zip(header, (_xlsx_value(value) for value in row)))
+            for row in rows
+            if any(value is not None for value in row)
+        )
+        yield from _chunks(records, chunk_size)
+    finally:
+        workbook.close()
+
+
+def _json_objects(f) -> Iterator[dict]:
+    """Objetos de un array JSON, decodificados uno a uno según se leen bloques del fichero"""
+    decoder = json.JSONDecoder()
+    reader = io.TextIOWrapper(f, encoding="utf-8-sig")
+    buffer, position, started = "", 0, False
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n":
+            position += 1
+        if position == len(buffer):
+            more = reader.read(JSON_READ_SIZE)
+            if not more:
+                raise ValueError("El array JSON está incompleto")
+            buffer, position = more, 0
+            continue
+        char = buffer[position]
+        if not started:
+            if char != "[":
+                raise ValueError("El JSON debe ser un array de objetos")
+            started = True
+            position += 1
+            continue
+        if char == ",":
+            position += 1
+            continue
+        if char == "]":
+            return
+        try:
+            value, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # Objeto cortado al final del bloque: se añade el siguiente y se vuelve a intentar
+            more = reader.read(JSON_READ_SIZE)
+            if not more:
+                raise
+            buffer, position = buffer[position:] + more, 0
+            continue
+        if not isinstance(value, dict):
+            raise ValueError("El JSON debe ser un array de objetos")
+        yield value
+
+
+def iter_json(f, chunk_size: int) -> Iterator[List[dict]]:
+    """Array JSON de objetos, decodificado incrementalmente (no se carga el fichero entero)"""
+    records = (
+        {canonical_column(key): value for key, value in obj.items()}
+        for obj in _json_objects(f)
+    )
+    yield from _chunks(records, chunk_size)
+
+
+_READERS = {"csv": iter_csv, "xlsx": iter_xlsx, "json": iter_json}
+
+
+def iter_file(path: str, fmt: str, chunk_size: int) -> Iterator[List[dict]]:
+    """Filas de un fichero CSV/XLSX/JSON por bloques de chunk_size, con las columnas del spreadsheet"""
+    with open(path, "rb") as f:
+        yield from _READERS[fmt](f, chunk_size)
+
+
+class UploadSource:
+    """
+    Fichero subido por POST /imports/upload, identificado por su feed y su contenido (revisión), que se lee del
+    trabajo job_id: fetch lo copia de la DB a un fichero local y discard borra esa copia.
+    """
+
+    def __init__(self, feed: str, revision: str, job_id: Optional[uuid.UUID] = None):
+        if not _REVISION_RE.match(revision):
+            raise ValueError(f"Revisión de fichero subido no válida: {revision}")
+        self.feed = feed
+        self.key = f"upload:{feed}"
+        self._revision = revision
+        self.format = revision.rsplit(".", 1)[1]
+        self.job_id = job_id
+        self.path: Optional[str] = None
+
+    def fetch(self, db: Session) -> bool:
+        """Copia el fichero del trabajo desde la DB a IMPORT_UPLOAD_DIR; False si el trabajo no tiene fichero"""
+        os.makedirs(IMPORT_UPLOAD_DIR, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=IMPORT_UPLOAD_DIR, suffix=f".{self.format}")
+        self.path = path
+        chunks = 0
+        with os.fdopen(fd, "wb") as f:
+            for data in db.scalars(
+                select(models.ImportUploadChunk.data)
+                .where(models.ImportUploadChunk.job_id == self.job_id)
+                .order_by(models.ImportUploadChunk.seq)
+                .execution_options(yield_per=1)
+            ):
+                f.write(data)
+                chunks += 1
+        if not chunks:
+            self.discard()
+        return chunks > 0
+
+    def revision(self) -> Optional[str]:
+        return self._revision
+
+    def read_rows(self) -> List[dict]:
+        return [row for chunk in self.iter_rows(1000) for row in chunk]
+
+    def iter_rows(self, chunk_size: int) -> Iterator[List[dict]]:
+        return iter_file(self.path, self.format, chunk_size)
+
+    def discard(self):
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    def reset(self):
+        pass
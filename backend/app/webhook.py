@@ -0,0 +1,198 @@
+'''
+Procesamiento de los mensajes entrantes de WhatsApp (webhook de Twilio)
+    Resuelve el cliente (índice en memoria, customer_index.py) y su shipment pendiente más reciente en una sola
+    consulta y hace todas las escrituras (cambio de estado e interacciones inbound/outbound) en una única
+    transacción con un solo commit.
+    Usa AsyncSession (asyncpg), así que no bloquea el event loop ni ocupa hilos del threadpool. Es usado por main.py.
+'''
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+import logging
+import re
+import uuid
+
+from sqlalchemy import and_, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import cache, customer_index, events, models, schemas
+from .models import MADRID_TZ, get_madrid_now
+
+MSG_INVALID = "Error: No se pudo procesar su mensaje. Por favor, contacte con el servicio."
+MSG_UNKNOWN_CUSTOMER = "Lo sentimos, no encontramos su número en nuestro sistema."
+MSG_NO_PENDING = "No tenemos entregas pendientes de confirmación para su establecimiento."
+MSG_ASK_AGAIN = "Por favor, responda con *SI* o *NO* para confirmar la entrega."
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingShipment:
+    """Cliente que escribe y, si tiene, su shipment pendiente más reciente"""
+    customer_name: str
+    customer_phone: str
+    shipment_id: Optional[uuid.UUID]
+    description: Optional[str]
+    planned_delivery_time: Optional[datetime]
+
+
+def parse_reply(body: str) -> Optional[str]:
+    """SI -> confirmed, NO -> rejected, cualquier otra cosa -> None"""
+    response_normalized = re.sub(r'[^A-Z]', '', body)
+    if "SI" in response_normalized or "SÍ" in response_normalized or "YES" in response_normalized:
+        return "confirmed"
+    if "NO" in response_normalized:
+        return "rejected"
+    return None
+
+
+def _latest_pending(customer_id):
+    """Último shipment pendiente del cliente, bloqueado (FOR UPDATE) hasta el commit"""
+    return (
+        select(models.Shipment.id, models.Shipment.description, models.Shipment.planned_delivery_time)
+        .where(
+            models.Shipment.customer_id == customer_id,
+            models.Shipment.status == "pending",
+        )
+        .order_by(models.Shipment.created_at.desc())
+        .limit(1)
+        .with_for_update()
+    )
+
+
+async def find_pending_shipment(db: AsyncSession, phone: str) -> Optional[PendingShipment]:
+    """
+    Una sola consulta. Si el cliente está en el índice en memoria (customer_index), solo se busca su último
+    shipment pendiente (usa ix_shipment_customer_status_created); si no, el cliente por teléfono con un
+    LEFT JOIN LATERAL a ese shipment (usa ix_customer_phone), y el cliente se guarda en el índice.
+    El shipment se bloquea (FOR UPDATE) hasta el commit para que dos respuestas simultáneas no lo procesen dos veces.
+    """
+    customer = customer_index.index.get(phone)
+    if customer is not None:
+        row = (await db.execute(_latest_pending(customer.id))).first()
+        if row is None:
+            return PendingShipment(customer.name, customer.phone, None, None, None)
+        return PendingShipment(customer.name, customer.phone, *row)
+
+    generation = customer_index.index.generation()
+    latest = _latest_pending(models.Customer.id).lateral("latest")
+    row = (await db.execute(
+        select(
+            models.Customer.id.label("customer_id"),
+            models.Customer.name,
+            models.Customer.phone,
+            models.Customer.delivery_hours_open,
+            models.Customer.delivery_hours_close,
+            models.Customer.timezone,
+            latest.c.id,
+            latest.c.description,
+            latest.c.planned_delivery_time,
+        )
+        .select_from(models.Customer)
+        .outerjoin(latest, and_(True))
+        .where(models.Customer.phone == phone)
+        .limit(1)
+    )).first()
+    if row is None:
+        return None
+    customer_index.index.put(customer_index.CustomerEntry(
+        id=row.customer_id,
+        name=row.name,
+        phone=row.phone,
+        delivery_hours_open=row.delivery_hours_open,
+        delivery_hours_close=row.delivery_hours_close,
+        timezone=row.timezone,
+    ), generation)
+    return PendingShipment(row.name, row.phone, row.id, row.description, row.planned_delivery_time)
+
+
+def build_reply_message(pending: PendingShipment, new_status: str) -> tuple:
+    """(texto de la respuesta automática, response_code de la interacción outbound)"""
+    if new_status == "confirmed":
+        # Mensaje de confirmación/agradecimiento
+        return (
+            f"Perfecto, {pending.customer_name}.\n\n"
+            f"✅ Hemos confirmado su disponibilidad para recibir:\n"
+            f"📦 {pending.description}\n"
+            f"🕐 {pending.planned_delivery_time.astimezone(MADRID_TZ).strftime('%d/%m/%Y a las %H:%M')}\n\n"
+            f"Gracias por su confirmación. Le esperamos en el horario indicado."
+        ), "confirmation_sent"
+    # Mensaje preguntando por horas alternativas (mockup)
+    return (
+        f"Entendido, {pending.customer_name}.\n\n"
+        f"Lamentamos que el horario no le convenga.\n\n"
+        f"¿Podría indicarnos qué horarios le vendrían mejor para recibir la entrega?\n\n"
+        f"Por ejemplo: mañana por la mañana, esta tarde después de las 15:00, etc."
+    ), "alternative_requested"
+
+
+async def handle_incoming_message(db: AsyncSession, from_number: str, body: str) -> tuple:
+    """
+    Procesa una respuesta de WhatsApp y devuelve (texto a contestar por TwiML, resultado), con resultado
+    invalid / unknown_customer / no_pending / unknown_reply / confirmed / rejected (ver metrics.WEBHOOK_SECONDS).
+    Lectura y escrituras van en la misma transacción, con un único commit.
+    """
+    if not from_number or not body:
+        return MSG_INVALID, "invalid"
+
+    try:
+        pending = await find_pending_shipment(db, from_number)
+        if pending is None:
+            logger.info("Cliente no encontrado para el número", extra={"from_number": from_number})
+            return MSG_UNKNOWN_CUSTOMER, "unknown_customer"
+        if pending.shipment_id is None:
+            logger.info("No hay shipments pendientes para el cliente", extra={"customer_name": pending.customer_name})
+            return MSG_NO_PENDING, "no_pending"
+
+        now = get_madrid_now()
+        new_status = parse_reply(body)
+        interactions = [{
+            "id": uuid.uuid4(),
+            "shipment_id": pending.shipment_id,
+            "channel": "whatsapp",
+            "direction": "inbound",
+            "content": body,
+            "response_code": new_status or "unknown",
+            "created_at": now,
+        }]
+
+        if new_status is None:
+            # Respuesta no reconocida: solo se registra la interacción inbound
+            reply = MSG_ASK_AGAIN
+        else:
+            shipment = (await db.execute(
+                update(models.Shipment)
+                .where(models.Shipment.id == pending.shipment_id)
+                .values(status=new_status, updated_at=now)
+                .returning(*models.Shipment.__table__.c)
+            )).one()
+            # Delta para el dashboard (GET /events), se envía con el commit
+            await events.async_notify(db, [events.row_event("shipment", schemas.ShipmentOut, dict(shipment._mapping))])
+            reply, response_code = build_reply_message(pending, new_status)
+            # La respuesta se envía por TwiML (no se envía dos veces); se registra como outbound
+            interactions.append({
+                "id": uuid.uuid4(),
+                "shipment_id": pending.shipment_id,
+                "channel": "whatsapp",
+                "direction": "outbound",
+                "content": reply,
+                "response_code": response_code,
+                "created_at": now,
+            })
+
+        await db.execute(insert(models.DeliveryInteraction), interactions)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    if new_status is not None:
+        await cache.invalidate("shipment", [pending.shipment_id])
+
+    if new_status is None:
+        return reply, "unknown_reply"
+    logger.info(
+        "Mensaje de confirmación enviado" if new_status == "confirmed" else "Mensaje de horas alternativas enviado",
+        extra={"to": pending.customer_phone, "shipment_id": str(pending.shipment_id), "status": new_status},
+    )
+    return reply, new_status
@@ -0,0 +1,163 @@
+'''
+Benchmark de la capa de DB síncrona (psycopg2 + threadpool) vs. asíncrona (asyncpg + AsyncSession)
+    Simula N dashboards que consultan a la vez GET /customers y GET /shipments?limit=200 en bucle
+    y mide peticiones/segundo y latencias p50/p95/p99 contra dos servidores uvicorn en subprocesos:
+      - sync: los mismos listados con endpoints `def`, get_db y paginated_response (como antes)
+      - async: la app real (app.main:app), con get_async_db
+    Siembra datos de prueba y los borra al terminar. Necesita DATABASE_URL apuntando a una DB de desarrollo.
+
+    Uso (desde backend/):
+        python -m utils.bench_async_db --dashboards 10 50 200 --seconds 10
+'''
+
+from typing import List
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import aiohttp
+from fastapi import Depends, FastAPI, Query
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+os.environ.setdefault("DISABLE_WHATSAPP", "true")
+
+from app import models, schemas
+from app.database import engine, get_db
+from app.deps import API_KEY, api_key_auth
+from app.migrate import run_migrations
+from app.pagination import LIST_DEFAULT_LIMIT, LIST_MAX_LIMIT, paginated_response
+
+PHONE_PREFIX = "+3497"
+
+# App con los listados síncronos, para comparar (uvicorn utils.bench_async_db:sync_app)
+sync_app = FastAPI()
+
+
+@sync_app.get("/customers", response_model=List[schemas.CustomerOut], dependencies=[Depends(api_key_auth)])
+def sync_list_customers(
+    cursor: str | None = None,
+    limit: int = Query(LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    db: Session = Depends(get_db),
+):
+    return paginated_response(db, select(models.Customer), models.Customer, schemas.CustomerOut, cursor, limit)
+
+
+@sync_app.get("/shipments", response_model=List[schemas.ShipmentOut], dependencies=[Depends(api_key_auth)])
+def sync_list_shipments(
+    cursor: str | None = None,
+    limit: int = Query(LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    db: Session = Depends(get_db),
+):
+    return paginated_response(db, select(models.Shipment), models.Shipment, schemas.ShipmentOut, cursor, limit)
+
+
+def seed(customers: int, shipments: int):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO customer (name, phone, delivery_hours_open, delivery_hours_close, timezone, created_at, updated_at)
+            SELECT 'Bench ' || i, :prefix || lpad(i::text, 7, '0'), '09:00', '21:00', 'Europe/Madrid', now(), now()
+            FROM generate_series(1, :n) i
+        """), {"prefix": PHONE_PREFIX, "n": customers})
+        conn.execute(text("""
+            INSERT INTO shipment (customer_id, description, planned_delivery_time, status, created_at, updated_at)
+            SELECT c.id, 'Pedido bench ' || i, now() + make_interval(hours => i), 'pending',
+                   now() - make_interval(secs => i), now()
+            FROM generate_series(1, :n) i
+            JOIN LATERAL (
+                SELECT id FROM customer WHERE phone = :prefix || lpad((1 + i % :customers)::text, 7, '0')
+            ) c ON true
+        """), {"prefix": PHONE_PREFIX, "n": shipments, "customers": customers})
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(text("""
+            DELETE FROM shipment WHERE customer_id IN (SELECT id FROM customer WHERE phone LIKE :prefix || '%')
+        """), {"prefix": PHONE_PREFIX})
+        conn.execute(text("DELETE FROM customer WHERE phone LIKE :prefix || '%'"), {"prefix": PHONE_PREFIX})
+
+
+def start_server(app_path: str) -> tuple:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app_path, "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return process, base_url
+
+
+async def poll(base_url: str, dashboards: int, seconds: float) -> dict:
+    latencies, errors = [], 0
+    headers = {"Authorization": f"Bearer {API_KEY}"}
+    deadline = time.perf_counter() + seconds
+
+    async def dashboard(session):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            for path in ("/customers", "/shipments?limit=200"):
+                start = time.perf_counter()
+                try:
+                    async with session.get(base_url + path, headers=headers) as r:
+                        await r.read()
+                        if r.status != 200:
+                            errors += 1
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(dashboard(session) for _ in range(dashboards)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    pick = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 1)
+    return {
+        "dashboards": dashboards,
+        "req_per_s": round(len(latencies) / elapsed, 1),
+        "errors": errors,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dashboards", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--shipments", type=int, default=5000)
+    args = parser.parse_args()
+
+    run_migrations()
+    cleanup()
+    seed(args.customers, args.shipments)
+    try:
+        for name, app_path in (("sync", "utils.bench_async_db:sync_app"), ("async", "app.main:app")):
+            process, base_url = start_server(app_path)
+            try:
+                for dashboards in args.dashboards:
+                    print(name, asyncio.run(poll(base_url, dashboards, args.seconds)))
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        cleanup()
@@ -0,0 +1,154 @@
+'''
+Filas/segundo de la importación por formato de fichero (CSV, XLSX y JSON, ver app/uploads.py)
+    Genera N filas sintéticas con las columnas del spreadsheet, las escribe en cada formato y mide:
+      - lectura: el adaptador del formato recorriendo el fichero por bloques (sin DB)
+      - parseo: lectura + importer.parse_chunk de cada bloque
+      - importación (--import): importer.import_chunks completo contra la DB. Los clientes usan teléfonos +3496...
+        y el origen "bench:{formato}"; al terminar se borran (la DB queda como estaba)
+    También muestra la memoria máxima (tracemalloc) de la lectura, que no debe crecer con el tamaño del fichero.
+
+    Uso (desde backend/):
+        python -m utils.bench_import_formats --rows 100000
+        python -m utils.bench_import_formats --rows 20000 --import   # necesita DATABASE_URL
+'''
+
+from datetime import date, timedelta
+import argparse
+import csv
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from openpyxl import Workbook
+
+from app import importer, uploads
+
+COLUMNS = ["Prefijo", "Teléfono", "Cliente", "Apertura para entregas", "Cierre para entregas",
+           "Fecha entrega", "Hora entrega", "Descripción"]
+
+PHONE_PREFIX = "96"
+
+
+def generate_rows(n: int, customers: int):
+    start = date.today() + timedelta(days=1)
+    for i in range(n):
+        c = i % customers
+        yield [
+            "34",
+            f"{PHONE_PREFIX}{c:07d}",
+            f"Bench {c}",
+            "09:00" if c % 3 else "",
+            "21:00",
+            (start + timedelta(days=i % 30)).strftime("%d/%m/%Y"),
+            f"{8 + i % 12:02d}:{(i * 7) % 60:02d}",
+            f"Pedido bench {i}",
+        ]
+
+
+def write_files(directory: str, n: int, customers: int) -> dict:
+    paths = {fmt: os.path.join(directory, f"bench.{fmt}") for fmt in uploads.FORMATS}
+
+    with open(paths["csv"], "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(generate_rows(n, customers))
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(COLUMNS)
+    for row in generate_rows(n, customers):
+        sheet.append(row)
+    workbook.save(paths["xlsx"])
+
+    with open(paths["json"], "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, row in enumerate(generate_rows(n, customers)):
+            f.write(("," if i else "") + json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False))
+        f.write("]")
+    return paths
+
+
+def measure_read(path: str, fmt: str, chunk_size: int) -> dict:
+    started = time.perf_counter()
+    rows = sum(len(chunk) for chunk in uploads.iter_file(path, fmt, chunk_size))
+    elapsed = time.perf_counter() - started
+    # La memoria se mide en otra pasada: tracemalloc ralentiza mucho la lectura
+    tracemalloc.start()
+    for _ in uploads.iter_file(path, fmt, chunk_size):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"rows": rows, "seconds": elapsed, "peak_mb": peak / 1024 / 1024}
+
+
+def measure_parse(path: str, fmt: str, chunk_size: int) -> dict:
+    started = time.perf_counter()
+    rows = errors = 0
+    for chunk in uploads.iter_file(path, fmt, chunk_size):
+        parsed = importer.parse_chunk(chunk, list(range(rows + 2, rows + 2 + len(chunk))))
+        rows += len(chunk)
+        errors += sum(1 for error in parsed.errors if error)
+    return {"rows": rows, "seconds": time.perf_counter() - started, "errors": errors}
+
+
+def measure_import(path: str, fmt: str, chunk_size: int) -> dict:
+    from sqlalchemy import text
+    from app.database import SessionLocal
+    from app.migrate import run_migrations
+
+    run_migrations()
+    source = f"bench:{fmt}"
+    db = SessionLocal()
+    try:
+        results = importer.new_results(0)
+        started = time.perf_counter()
+        for _ in importer.import_chunks(db, uploads.iter_file(path, fmt, chunk_size), results, source=source, only_changed=False):
+            pass
+        elapsed = time.perf_counter() - started
+        return {"rows": results["processed"], "seconds": elapsed, "shipments": results["shipments_created"]}
+    finally:
+        db.rollback()
+        pattern = f"+34{PHONE_PREFIX}%"
+        db.execute(text(
+            "DELETE FROM delivery_interaction WHERE shipment_id IN "
+            "(SELECT s.id FROM shipment s JOIN customer c ON c.id = s.customer_id WHERE c.phone LIKE :p)"
+        ), {"p": pattern})
+        db.execute(text(
+            "DELETE FROM shipment WHERE customer_id IN (SELECT id FROM customer WHERE phone LIKE :p)"
+        ), {"p": pattern})
+        db.execute(text("DELETE FROM customer WHERE phone LIKE :p"), {"p": pattern})
+        db.execute(text("DELETE FROM spreadsheet_row WHERE source = :s"), {"s": source})
+        db.execute(text("DELETE FROM spreadsheet_sync WHERE source = :s"), {"s": source})
+        db.commit()
+        db.close()
+
+
+def rate(result: dict) -> str:
+    return f"{result['rows'] / result['seconds']:>10,.0f} filas/s ({result['seconds']:.2f}s)"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--customers", type=int, default=5000)
+    parser.add_argument("--chunk-size", type=int, default=importer.IMPORT_CHUNK_SIZE)
+    parser.add_argument("--import", dest="full_import", action="store_true", help="medir también la importación en la DB")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"Generando {args.rows} filas en CSV, XLSX y JSON...")
+        paths = write_files(directory, args.rows, args.customers)
+        for fmt, path in paths.items():
+            print(f"  {fmt:<5} {os.path.getsize(path) / 1024 / 1024:>8.1f} MB")
+
+        print(f"\n{'formato':<8} {'lectura':>32} {'memoria':>10} {'lectura + parse_chunk':>32}", end="")
+        print(f" {'importación':>32}" if args.full_import else "")
+        for fmt, path in paths.items():
+            read = measure_read(path, fmt, args.chunk_size)
+            parsed = measure_parse(path, fmt, args.chunk_size)
+            line = f"{fmt:<8} {rate(read):>32} {read['peak_mb']:>7.1f} MB {rate(parsed):>32}"
+            if args.full_import:
+                line += f" {rate(measure_import(path, fmt, args.chunk_size)):>32}"
+            print(line)
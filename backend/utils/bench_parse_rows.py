@@ -0,0 +1,103 @@
+'''
+Parseo de filas de la importación: fila a fila (importer.parse_row) frente a por bloques (importer.parse_chunk)
+    Genera N filas sintéticas con valores variados (incluye teléfonos vacíos, horas y fechas no válidas),
+    las parsea con los dos métodos por bloques de IMPORT_CHUNK_SIZE, comprueba que el resultado es idéntico
+    (mismos valores y mismos mensajes de error) y muestra las filas/segundo de cada uno. No usa la DB.
+
+    Uso (desde backend/):
+        python -m utils.bench_parse_rows --rows 100000
+'''
+
+from contextlib import contextmanager
+from datetime import date, timedelta
+import argparse
+import io
+import logging
+import random
+import time
+
+from app import importer
+
+
+def generate_rows(n: int, customers: int, seed: int = 1):
+    rng = random.Random(seed)
+    start = date.today()
+    rows = []
+    for i in range(n):
+        c = rng.randrange(customers)
+        rows.append({
+            "Prefijo": rng.choice([34, "34", "+34", " 351 "]),
+            "Teléfono": "" if rng.random() < 0.01 else 600000000 + c,
+            "Cliente": f"Cliente {c}",
+            "Apertura para entregas": rng.choice(["", "09:00", "8:30", "10:00:00", "nueve"]),
+            "Cierre para entregas": rng.choice(["", "21:00", "22:30:00", "25:00"]),
+            "Fecha entrega": "32/13/2025" if rng.random() < 0.01 else (start + timedelta(days=rng.randrange(60))).strftime("%d/%m/%Y"),
+            "Hora entrega": rng.choice(["", "xx"]) if rng.random() < 0.01 else f"{rng.randrange(7, 21)}:{rng.randrange(0, 60, 5):02d}",
+            "Descripción": f" Pedido {i} ",
+        })
+    return rows
+
+
+def parse_per_row(rows, chunk_size):
+    parsed = []
+    for start in range(0, len(rows), chunk_size):
+        for offset, row in enumerate(rows[start:start + chunk_size]):
+            parsed_row = importer.parse_row(row, start + offset + 1)
+            if parsed_row.phone is not None:
+                parsed.append(parsed_row)
+    return parsed
+
+
+def parse_per_chunk(rows, chunk_size):
+    parsed = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        parsed += importer.parse_chunk(chunk, list(range(start + 1, start + len(chunk) + 1))).rows()
+    return parsed
+
+
+@contextmanager
+def silenced_importer_logs():
+    """Los avisos del importador se escriben en memoria: no se muestran, pero su coste se mide"""
+    logger = logging.getLogger(importer.__name__)
+    handler = logging.StreamHandler(io.StringIO())
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        yield
+    finally:
+        logger.removeHandler(handler)
+        logger.propagate = True
+
+
+def measure(parse, rows, chunk_size):
+    # Los avisos de horario no válido (uno por fila) no se muestran, pero su coste se mide
+    with silenced_importer_logs():
+        started = time.perf_counter()
+        parsed = parse(rows, chunk_size)
+        elapsed = time.perf_counter() - started
+    return parsed, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--customers", type=int, default=5000)
+    parser.add_argument("--chunk-size", type=int, default=importer.IMPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    rows = generate_rows(args.rows, args.customers)
+    old, old_seconds = measure(parse_per_row, rows, args.chunk_size)
+    importer._time_cache.clear()
+    importer._planned_cache.clear()
+    new, new_seconds = measure(parse_per_chunk, rows, args.chunk_size)
+
+    if old != new:
+        mismatch = next(i for i, (a, b) in enumerate(zip(old, new)) if a != b) if len(old) == len(new) else None
+        raise SystemExit(f"Los resultados no coinciden ({len(old)} / {len(new)} filas, primera diferencia: {mismatch})")
+
+    errors = sum(1 for r in new if r.error)
+    print(f"{args.rows} filas ({len(new)} con teléfono, {errors} con fecha/hora no válida): resultados idénticos")
+    print(f"{'parse_row (fila a fila)':<28} {args.rows / old_seconds:>10,.0f} filas/s ({old_seconds:.2f}s)")
+    print(f"{'parse_chunk (por bloques)':<28} {args.rows / new_seconds:>10,.0f} filas/s ({new_seconds:.2f}s)")
+    print(f"{'mejora':<28} {old_seconds / new_seconds:>10.1f}x")
@@ -0,0 +1,133 @@
+'''
+Planes de consulta de los caminos calientes, con y sin los índices de 0002_hot_path_indexes
+    Rellena la DB con datos sintéticos (generate_series), ejecuta EXPLAIN (ANALYZE, BUFFERS) de las consultas
+    del webhook, la importación y los listados, y repite la medición tras borrar los índices y la restricción
+    única dentro de la misma transacción. Al terminar hace ROLLBACK: la DB queda como estaba.
+    Necesita DATABASE_URL apuntando a una DB de desarrollo con las migraciones aplicadas.
+
+    Uso (desde backend/):
+        python -m utils.bench_query_plans --customers 20000 --shipments 200000
+'''
+
+import argparse
+import re
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.migrate import run_migrations
+
+INDEXES = [
+    "ix_customer_phone",
+    "ix_shipment_customer_status_created",
+    "ix_delivery_interaction_shipment",
+    "ix_shipment_created_id",
+    "ix_shipment_planned_delivery_time",
+    "ix_customer_created_id",
+]
+
+SEED_SQL = [
+    """
+    INSERT INTO customer (name, phone, delivery_hours_open, delivery_hours_close, timezone, created_at, updated_at)
+    SELECT 'Bench ' || i, '+3499' || lpad(i::text, 7, '0'), '09:00', '21:00', 'Europe/Madrid',
+           now() - make_interval(mins => i), now()
+    FROM generate_series(1, :customers) i
+    """,
+    """
+    INSERT INTO shipment (customer_id, description, planned_delivery_time, status, created_at, updated_at)
+    SELECT c.id, 'Pedido bench ' || i, now() + make_interval(hours => i % 2000),
+           (ARRAY['pending', 'confirmed', 'delivered'])[1 + i % 3],
+           now() - make_interval(secs => i), now()
+    FROM generate_series(1, :shipments) i
+    JOIN LATERAL (
+        SELECT id FROM customer WHERE phone = '+3499' || lpad((1 + i % :customers)::text, 7, '0')
+    ) c ON true
+    """,
+    """
+    INSERT INTO delivery_interaction (shipment_id, channel, direction, content, created_at)
+    SELECT id, 'whatsapp', 'outbound', 'Mensaje bench', created_at FROM shipment
+    """,
+]
+
+# Consultas de los caminos calientes, con parámetros de una fila sembrada
+QUERIES = {
+    "cliente por teléfono (webhook, importación)":
+        "SELECT * FROM customer WHERE phone = :phone",
+    "último shipment pendiente (webhook)":
+        "SELECT * FROM shipment WHERE customer_id = :customer_id AND status = 'pending' "
+        "ORDER BY created_at DESC LIMIT 1",
+    "deduplicación de la importación":
+        "SELECT id FROM shipment WHERE customer_id = :customer_id AND description = :description "
+        "AND planned_delivery_time = :planned_delivery_time",
+    "interacciones de un shipment":
+        "SELECT * FROM delivery_interaction WHERE shipment_id = :shipment_id ORDER BY created_at",
+    "primera página de GET /shipments":
+        "SELECT * FROM shipment ORDER BY created_at DESC, id DESC LIMIT 100",
+    "GET /shipments filtrado por fecha de entrega":
+        "SELECT * FROM shipment WHERE planned_delivery_time >= now() + interval '10 hours' "
+        "AND planned_delivery_time < now() + interval '12 hours' ORDER BY created_at DESC, id DESC LIMIT 100",
+}
+
+
+def explain(conn, sql: str, params: dict) -> dict:
+    """Plan resumido: tipos de scan usados, tiempo de ejecución y buffers leídos"""
+    lines = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {sql}"), params).scalars().all()
+    plan = "\n".join(lines)
+    scans = sorted(set(re.findall(r"((?:Seq|Index Only|Index|Bitmap Heap|Bitmap Index) Scan)", plan)))
+    time_ms = float(re.search(r"Execution Time: ([\d.]+) ms", plan).group(1))
+    # La primera línea "Buffers:" es la del nodo raíz, que acumula las de sus hijos
+    root_buffers = next((line for line in lines if line.strip().startswith("Buffers:")), "")
+    buffers = sum(int(n) for n in re.findall(r"(?:hit|read)=(\d+)", root_buffers))
+    return {"scans": scans, "ms": time_ms, "buffers": buffers}
+
+
+def measure(conn, params: dict) -> dict:
+    return {name: explain(conn, sql, params) for name, sql in QUERIES.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=20000)
+    parser.add_argument("--shipments", type=int, default=200000)
+    args = parser.parse_args()
+
+    run_migrations()
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            print(f"Sembrando {args.customers} clientes y {args.shipments} shipments...")
+            for sql in SEED_SQL:
+                conn.execute(text(sql), {"customers": args.customers, "shipments": args.shipments})
+            conn.execute(text("ANALYZE customer; ANALYZE shipment; ANALYZE delivery_interaction"))
+
+            row = conn.execute(text(
+                "SELECT s.id, s.customer_id, s.description, s.planned_delivery_time, c.phone "
+                "FROM shipment s JOIN customer c ON c.id = s.customer_id "
+                "WHERE s.description = 'Pedido bench ' || (:n / 2)"
+            ), {"n": args.shipments}).one()
+            params = {
+                "phone": row.phone,
+                "customer_id": row.customer_id,
+                "description": row.description,
+                "planned_delivery_time": row.planned_delivery_time,
+                "shipment_id": row.id,
+            }
+
+            with_indexes = measure(conn, params)
+
+            conn.execute(text("ALTER TABLE shipment DROP CONSTRAINT uq_shipment_dedup"))
+            for index in INDEXES:
+                conn.execute(text(f"DROP INDEX {index}"))
+            conn.execute(text("ANALYZE customer; ANALYZE shipment; ANALYZE delivery_interaction"))
+            without_indexes = measure(conn, params)
+        finally:
+            trans.rollback()
+
+    print(f"\n{'consulta':<48} {'sin índices':>30} {'con índices':>30}")
+    for name in QUERIES:
+        before, after = without_indexes[name], with_indexes[name]
+        print(
+            f"{name:<48} "
+            f"{before['ms']:>9.3f} ms {before['buffers']:>6} buf {'/'.join(before['scans']):>12} "
+            f"{after['ms']:>9.3f} ms {after['buffers']:>6} buf {'/'.join(after['scans']):>12}"
+        )
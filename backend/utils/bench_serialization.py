@@ -0,0 +1,162 @@
+'''
+Serialización de los listados: Pydantic por fila (como antes) frente a serialization.py (orjson, filas como tuplas)
+    Genera N filas sintéticas de envíos, clientes e interacciones con valores variados (datetime con y sin zona
+    horaria, con y sin microsegundos, texto con comillas, caracteres de control y no ASCII), comprueba que el JSON
+    de los dos métodos es idéntico byte a byte y muestra las filas/segundo de cada uno. Sin DB:
+      - pydantic: schema.model_validate(objeto ORM).model_dump_json() por fila (lo que hacía pagination.py)
+      - rápido: serialization.row_serializer sobre tuplas con nombre (como las Row de una consulta de columnas)
+    Con --db mide también lectura + serialización de N envíos de la DB (select(Shipment) con objetos ORM frente a
+    select de columnas), dentro de una transacción que se deshace al terminar.
+
+    Uso (desde backend/):
+        python -m utils.bench_serialization --rows 10000 100000
+        python -m utils.bench_serialization --rows 100000 --db   # necesita DATABASE_URL
+'''
+
+from collections import namedtuple
+from datetime import datetime, time as dtime, timedelta, timezone
+from zoneinfo import ZoneInfo
+import argparse
+import random
+import time
+import uuid
+
+from app import models, schemas, serialization
+
+TEXTS = ["Pedido", "Cafetería Ñandú", 'Dice "hola"', "barra \\ invertida", "línea\nnueva\ty tab", "control \x01\x1f", "emoji 🚚", "</script>"]
+ZONES = [timezone.utc, ZoneInfo("Europe/Madrid"), timezone(timedelta(hours=5, minutes=30)), None]
+
+
+def random_datetime(rng: random.Random) -> datetime:
+    value = datetime(2025, 1, 1) + timedelta(seconds=rng.randrange(0, 400 * 86400), microseconds=rng.choice([0, rng.randrange(1000000)]))
+    zone = rng.choice(ZONES)
+    return value if zone is None else value.replace(tzinfo=zone)
+
+
+def random_text(rng: random.Random, i: int) -> str:
+    return f"{rng.choice(TEXTS)} {i}"
+
+
+def generate(n: int, seed: int = 1) -> dict:
+    """Objetos ORM (sin sesión) de cada esquema"""
+    rng = random.Random(seed)
+    statuses = ["pending", "confirmed", "rejected", "rescheduled", "delivered", "failed"]
+    customers, shipments, interactions = [], [], []
+    for i in range(n):
+        customer = models.Customer(
+            id=uuid.UUID(int=rng.getrandbits(128)),
+            name=random_text(rng, i),
+            phone=f"+34{600000000 + i}",
+            delivery_hours_open=dtime(rng.randrange(6, 12), rng.choice([0, 30]), microsecond=rng.choice([0, 0, 500])),
+            delivery_hours_close=dtime(rng.randrange(14, 23), 0),
+            timezone="Europe/Madrid",
+            created_at=random_datetime(rng),
+            updated_at=random_datetime(rng),
+        )
+        customers.append(customer)
+        shipments.append(models.Shipment(
+            id=uuid.UUID(int=rng.getrandbits(128)),
+            customer_id=customer.id,
+            description=random_text(rng, i),
+            planned_delivery_time=random_datetime(rng),
+            status=rng.choice(statuses),
+            created_at=random_datetime(rng),
+            updated_at=random_datetime(rng),
+        ))
+        interactions.append(models.DeliveryInteraction(
+            id=uuid.UUID(int=rng.getrandbits(128)),
+            shipment_id=shipments[-1].id,
+            channel="whatsapp",
+            direction=rng.choice(["inbound", "outbound"]),
+            content=random_text(rng, i),
+            response_code=rng.choice([None, "confirmed", "confirmation_sent"]),
+            created_at=random_datetime(rng),
+        ))
+    return {
+        schemas.CustomerOut: (models.Customer, customers),
+        schemas.ShipmentOut: (models.Shipment, shipments),
+        schemas.DeliveryInteractionOut: (models.DeliveryInteraction, interactions),
+    }
+
+
+def as_rows(model, schema, objects) -> list:
+    """Las mismas filas como tuplas con nombre (acceso por atributo, como sqlalchemy Row)"""
+    names = [column.name for column in serialization.columns(model, schema)]
+    Row = namedtuple(f"{model.__name__}Row", names)
+    return [Row(*(getattr(obj, name) for name in names)) for obj in objects]
+
+
+def pydantic_json(schema, objects) -> bytes:
+    return ("[" + ",".join(schema.model_validate(obj).model_dump_json() for obj in objects) + "]").encode()
+
+
+def fast_json(schema, rows) -> bytes:
+    serialize = serialization.row_serializer(schema)
+    return b"[" + b",".join(serialize(row) for row in rows) + b"]"
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def bench_offline(n: int):
+    for schema, (model, objects) in generate(n).items():
+        rows = as_rows(model, schema, objects)
+        old, old_seconds = timed(pydantic_json, schema, objects)
+        new, new_seconds = timed(fast_json, schema, rows)
+        if old != new:
+            position = next((i for i, (a, b) in enumerate(zip(old, new)) if a != b), min(len(old), len(new)))
+            raise SystemExit(f"{schema.__name__}: el JSON no coincide en el byte {position}: {old[position - 60:position + 60]!r} / {new[position - 60:position + 60]!r}")
+        print(f"{n:>8} {schema.__name__:<24} {n / old_seconds:>12,.0f} {n / new_seconds:>12,.0f} {old_seconds / new_seconds:>7.1f}x  idéntico ({len(new) / 1024 / 1024:.1f} MB)")
+
+
+def bench_db(n: int):
+    from sqlalchemy import select, text
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        db.execute(text(
+            "INSERT INTO customer (id, name, phone, delivery_hours_open, delivery_hours_close, timezone, created_at, updated_at) "
+            "VALUES ('00000000-0000-0000-0000-00000000be9c', 'Bench serialización', '+3490000000', '09:00', '21:00', 'Europe/Madrid', now(), now())"
+        ))
+        db.execute(text(
+            "INSERT INTO shipment (customer_id, description, planned_delivery_time, status, created_at, updated_at) "
+            "SELECT '00000000-0000-0000-0000-00000000be9c', 'Pedido bench ' || i, now() + make_interval(mins => i), 'pending', now(), now() "
+            "FROM generate_series(1, :n) i"
+        ), {"n": n})
+        stmt = select(models.Shipment).where(models.Shipment.customer_id == uuid.UUID("00000000-0000-0000-0000-00000000be9c"))
+
+        def old():
+            objects = db.execute(stmt.execution_options(yield_per=200)).scalars()
+            result = pydantic_json(schemas.ShipmentOut, objects)
+            db.expunge_all()
+            return result
+
+        def new():
+            rows = db.execute(stmt.with_only_columns(*serialization.columns(models.Shipment, schemas.ShipmentOut)).execution_options(yield_per=200))
+            return fast_json(schemas.ShipmentOut, rows)
+
+        old_json, old_seconds = timed(old)
+        new_json, new_seconds = timed(new)
+        if old_json != new_json:
+            raise SystemExit("DB: el JSON no coincide")
+        print(f"{n:>8} {'ShipmentOut (DB)':<24} {n / old_seconds:>12,.0f} {n / new_seconds:>12,.0f} {old_seconds / new_seconds:>7.1f}x  idéntico")
+    finally:
+        db.rollback()
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--db", action="store_true", help="medir también lectura + serialización desde la DB")
+    args = parser.parse_args()
+
+    print(f"{'filas':>8} {'esquema':<24} {'pydantic/s':>12} {'rápido/s':>12} {'mejora':>8}")
+    for n in args.rows:
+        bench_offline(n)
+        if args.db:
+            bench_db(n)
@@ -0,0 +1,439 @@
+'''
+Benchmark reproducible de la API con cargas realistas y comparación con una línea base
+    Siembra la DB con N clientes, envíos e interacciones (teléfonos +3493...), levanta la app real con uvicorn en un
+    subproceso sin servicios externos (Twilio con el cliente falso WHATSAPP_SENDER=fake y el spreadsheet con un CSV
+    local, SPREADSHEET_LOCAL_PATH) y ejecuta los escenarios:
+      - dashboard: D dashboards recargando a la vez durante S segundos lo mismo que dashboard.html
+        (GET /shipments?limit=200&include=customer, GET /customers por páginas de 1000 y GET /stats)
+      - import: importación de un CSV de 1k/10k/100k filas (POST /spreadsheet/process hasta que el trabajo termina,
+        clientes +3492...), incluido el envío de sus WhatsApp por la cola
+      - webhook: ráfaga de M respuestas SI/NO a POST /twilio/incoming con C peticiones concurrentes
+    Para cada operación muestra el número, el rendimiento (operaciones/segundo), las latencias p50/p95/p99 en ms
+    y las consultas SQL por operación (por importación, por cada 1000 filas), leídas de GET /metrics del servidor.
+    Con --save guarda los resultados como línea base (JSON) y con --baseline los compara con una anterior: sale con
+    código 1 si el p95 o el rendimiento empeoran más de --tolerance, o si aumentan las consultas por operación.
+    Las líneas base solo son comparables en la misma máquina y con los mismos parámetros (se guardan con ellos).
+    Necesita DATABASE_URL apuntando a una DB de desarrollo (PostgreSQL: la app usa triggers, LISTEN/NOTIFY y
+    SKIP LOCKED); al terminar borra todo lo sembrado e importado.
+
+    Uso (desde backend/):
+        python -m utils.bench_suite --save utils/baseline.json
+        python -m utils.bench_suite --baseline utils/baseline.json
+        python -m utils.bench_suite --scenarios webhook --webhooks 2000 --concurrency 64
+        python -m utils.bench_suite --scenarios import --import-rows 1000 10000 100000
+'''
+
+from datetime import date, timedelta
+import argparse
+import asyncio
+import csv
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+from sqlalchemy import text
+
+from app.database import engine
+from app.migrate import run_migrations
+
+SEED_PREFIX = "+3493"
+IMPORT_PREFIX = "+3492"
+API_KEY = os.getenv("API_KEY") or "bench"
+SCENARIOS = ("dashboard", "import", "webhook")
+
+SEED_SQL = [
+    """
+    INSERT INTO customer (name, phone, delivery_hours_open, delivery_hours_close, timezone, created_at, updated_at)
+    SELECT 'Bench ' || i, :prefix || lpad(i::text, 7, '0'), '09:00', '21:00', 'Europe/Madrid',
+           now() - make_interval(mins => i), now()
+    FROM generate_series(1, :customers) i
+    """,
+    # El primer envío de cada cliente queda pendiente (para el webhook); el resto, repartidos entre los estados
+    """
+    INSERT INTO shipment (customer_id, description, planned_delivery_time, status, created_at, updated_at)
+    SELECT c.id, 'Pedido bench ' || i, date_trunc('hour', now()) + make_interval(hours => i % 720),
+           CASE WHEN i <= :customers THEN 'pending'
+                ELSE (ARRAY['pending', 'confirmed', 'rejected', 'delivered'])[1 + i % 4] END,
+           now() - make_interval(secs => i), now()
+    FROM generate_series(1, :shipments) i
+    JOIN LATERAL (
+        SELECT id FROM customer WHERE phone = :prefix || lpad((1 + (i - 1) % :customers)::text, 7, '0')
+    ) c ON true
+    """,
+    """
+    WITH s AS (
+        SELECT s.id, s.created_at, row_number() OVER (ORDER BY s.created_at, s.id) AS n
+        FROM shipment s JOIN customer c ON c.id = s.customer_id
+        WHERE c.phone LIKE :prefix || '%'
+    )
+    INSERT INTO delivery_interaction (shipment_id, channel, direction, content, response_code, created_at)
+    SELECT s.id, 'whatsapp', 'outbound', 'Mensaje bench ' || i, NULL, s.created_at + make_interval(secs => i)
+    FROM generate_series(1, :interactions) i
+    JOIN s ON s.n = 1 + (i - 1) % :shipments
+    """,
+]
+
+COLUMNS = ["Prefijo", "Teléfono", "Cliente", "Apertura para entregas", "Cierre para entregas",
+           "Fecha entrega", "Hora entrega", "Descripción"]
+
+
+def seed(customers: int, shipments: int, interactions: int):
+    shipments = max(shipments, customers)
+    params = {"prefix": SEED_PREFIX, "customers": customers, "shipments": shipments, "interactions": interactions}
+    with engine.begin() as conn:
+        for sql in SEED_SQL:
+            conn.execute(text(sql), params)
+
+
+def cleanup(prefix: str, source: str = None):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            DELETE FROM delivery_interaction WHERE shipment_id IN (
+                SELECT s.id FROM shipment s JOIN customer c ON c.id = s.customer_id WHERE c.phone LIKE :prefix || '%'
+            )
+        """), {"prefix": prefix})
+        conn.execute(text("""
+            DELETE FROM shipment WHERE customer_id IN (SELECT id FROM customer WHERE phone LIKE :prefix || '%')
+        """), {"prefix": prefix})
+        conn.execute(text("DELETE FROM customer WHERE phone LIKE :prefix || '%'"), {"prefix": prefix})
+        if source is not None:
+            for table in ("spreadsheet_row", "spreadsheet_sync", "import_job"):
+                conn.execute(text(f"DELETE FROM {table} WHERE source = :source"), {"source": source})
+
+
+def write_sheet(path: str, rows: int):
+    """CSV con las columnas del spreadsheet: rows pedidos de rows/5 clientes (+3492...)"""
+    customers = max(1, rows // 5)
+    start = date.today() + timedelta(days=1)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for i in range(rows):
+            c = i % customers
+            writer.writerow([
+                "34", f"{IMPORT_PREFIX[3:]}{c:07d}", f"Bench import {c}", "09:00" if c % 3 else "", "21:00",
+                (start + timedelta(days=i % 30)).strftime("%d/%m/%Y"), f"{8 + i % 12:02d}:{(i * 7) % 60:02d}",
+                f"Pedido bench {i}",
+            ])
+
+
+def start_server(sheet_path: str, twilio_latency_ms: float) -> tuple:
+    """App real en un subproceso uvicorn, con Twilio y el spreadsheet sustituidos"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    env = dict(os.environ)
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    env.update({
+        "API_KEY": API_KEY,
+        "METRICS_ENABLED": "true",
+        "LOG_LEVEL": "WARNING",
+        "DISABLE_WHATSAPP": "false",
+        "WHATSAPP_SENDER": "fake",
+        "FAKE_SEND_LATENCY_MS": str(twilio_latency_ms),
+        "FAKE_SEND_ERROR_RATE": "0",
+        "FAKE_SEND_THROTTLE_RATE": "0",
+        "TWILIO_RATE_LIMIT_BACKEND": "local",
+        "TWILIO_RATE_LIMIT": "100000",
+        "TWILIO_RATE_BURST": "100000",
+        "WHATSAPP_QUEUE_SIZE": "1000000",
+        "SPREADSHEET_LOCAL_PATH": sheet_path,
+        "IMPORT_JOB_POLL_SECONDS": "0.2",
+    })
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(600):
+        try:
+            if httpx.get(f"{base_url}/dashboard", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.TransportError:
+            pass
+        if process.poll() is not None:
+            break
+        time.sleep(0.05)
+    process.terminate()
+    raise SystemExit("El servidor no ha arrancado (¿DATABASE_URL?)")
+
+
+def metric_samples(client: httpx.Client) -> dict:
+    """Muestras de GET /metrics: {(nombre, etiquetas ordenadas): valor}"""
+    response = client.get("/metrics")
+    response.raise_for_status()
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(response.text)
+        for sample in family.samples
+    }
+
+
+def route_queries(before: dict, after: dict, method: str, route: str) -> float:
+    """Consultas SQL por petición de una ruta entre dos lecturas de /metrics"""
+    labels = (("method", method), ("route", route))
+    total = after.get(("http_request_db_queries_sum", labels), 0) - before.get(("http_request_db_queries_sum", labels), 0)
+    count = after.get(("http_request_db_queries_count", labels), 0) - before.get(("http_request_db_queries_count", labels), 0)
+    return round(total / count, 2) if count else 0.0
+
+
+def engine_queries(before: dict, after: dict, engine_name: str) -> float:
+    key = ("db_query_duration_seconds_count", (("engine", engine_name),))
+    return after.get(key, 0) - before.get(key, 0)
+
+
+def summary(scenario: str, operation: str, latencies: list, seconds: float, db_queries: float) -> dict:
+    latencies = sorted(latencies)
+    pick = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 1) if latencies else None
+    return {
+        "scenario": scenario,
+        "operation": operation,
+        "count": len(latencies),
+        "per_second": round(len(latencies) / seconds, 1) if seconds else None,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "db_queries": db_queries,
+    }
+
+
+async def run_dashboard(base_url: str, dashboards: int, seconds: float) -> dict:
+    """Latencias (ms) de cada recarga del dashboard y de cada petición, durante seconds"""
+    latencies = {"refresh": [], "shipments": [], "customers": [], "stats": []}
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def get(client, name, url, **params):
+        nonlocal errors
+        start = time.perf_counter()
+        response = await client.get(url, params=params)
+        latencies[name].append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            errors += 1
+        return response
+
+    async def customers(client):
+        cursor = None
+        while True:
+            params = {"limit": 1000, **({"cursor": cursor} if cursor else {})}
+            cursor = (await get(client, "customers", "/customers", **params)).headers.get("X-Next-Cursor")
+            if not cursor:
+                return
+
+    async def dashboard(client):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await asyncio.gather(
+                get(client, "shipments", "/shipments", limit=200, include="customer"),
+                customers(client),
+                get(client, "stats", "/stats"),
+            )
+            latencies["refresh"].append((time.perf_counter() - start) * 1000)
+
+    limits = httpx.Limits(max_connections=dashboards * 3, max_keepalive_connections=dashboards * 3)
+    headers = {"Authorization": f"Bearer {API_KEY}"}
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(dashboard(client) for _ in range(dashboards)))
+        elapsed = time.perf_counter() - started
+    if errors:
+        raise SystemExit(f"dashboard: {errors} peticiones con error")
+    return {"latencies": latencies, "seconds": elapsed}
+
+
+def scenario_dashboard(client: httpx.Client, args) -> list:
+    before = metric_samples(client)
+    result = asyncio.run(run_dashboard(client.base_url, args.dashboards, args.seconds))
+    after = metric_samples(client)
+    routes = {"shipments": "/shipments", "customers": "/customers", "stats": "/stats"}
+    rows = [summary("dashboard", "refresh", result["latencies"]["refresh"], result["seconds"],
+                    sum(route_queries(before, after, "GET", route) for route in routes.values()))]
+    for name, route in routes.items():
+        rows.append(summary("dashboard", name, result["latencies"][name], result["seconds"], route_queries(before, after, "GET", route)))
+    return rows
+
+
+def wait_for_queue(client: httpx.Client, timeout: float = 600):
+    """Espera a que la cola de WhatsApp haya enviado y registrado todo"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = client.get("/whatsapp/queue").json()
+        if stats["pending"] == 0 and stats["queued"] == stats["sent"] + stats["errors"]:
+            # Los workers registran lo enviado por lotes al quedarse sin mensajes (ver messaging.py)
+            time.sleep(1)
+            return
+        time.sleep(0.2)
+    raise SystemExit("La cola de WhatsApp no se ha vaciado")
+
+
+def scenario_import(client: httpx.Client, args, sheet_path: str, source: str) -> list:
+    rows = []
+    for n in args.import_rows:
+        cleanup(IMPORT_PREFIX, source)
+        write_sheet(sheet_path, n)
+        before = metric_samples(client)
+        started = time.perf_counter()
+        response = client.post("/spreadsheet/process", params={"full": "true"})
+        response.raise_for_status()
+        job = response.json()
+        while job["status"] in ("queued", "running"):
+            time.sleep(0.1)
+            job = client.get(f"/spreadsheet/jobs/{job['id']}").json()
+        elapsed = time.perf_counter() - started
+        if job["status"] != "completed" or job["results"]["processed"] != n:
+            raise SystemExit(f"import {n}: el trabajo ha terminado como {job['status']} ({job.get('error')})")
+        wait_for_queue(client)
+        after = metric_samples(client)
+        queries = engine_queries(before, after, "sync") + engine_queries(before, after, "async")
+        row = summary("import", f"{n} filas", [elapsed * 1000], elapsed, round(queries / n * 1000, 1))
+        # El rendimiento de la importación son filas/segundo (las consultas, por cada 1000 filas)
+        row["per_second"] = round(n / elapsed, 1)
+        rows.append(row)
+    cleanup(IMPORT_PREFIX, source)
+    return rows
+
+
+async def run_webhooks(base_url: str, phones: list, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(client, phone):
+        nonlocal errors
+        data = {"From": f"whatsapp:{phone}", "Body": random.choice(["SI", "NO", "Si, gracias"])}
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/twilio/incoming", data=data)
+            latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(post(client, phone) for phone in phones))
+        elapsed = time.perf_counter() - started
+    if errors:
+        raise SystemExit(f"webhook: {errors} peticiones con error")
+    return {"latencies": latencies, "seconds": elapsed}
+
+
+def scenario_webhook(client: httpx.Client, args) -> list:
+    # Cada mensaje es de un cliente distinto con un envío pendiente, como en la hora punta de respuestas
+    with engine.connect() as conn:
+        phones = conn.execute(text("""
+            SELECT DISTINCT c.phone FROM customer c JOIN shipment s ON s.customer_id = c.id
+            WHERE c.phone LIKE :prefix || '%' AND s.status = 'pending'
+            ORDER BY c.phone LIMIT :n
+        """), {"prefix": SEED_PREFIX, "n": args.webhooks}).scalars().all()
+    random.Random(1).shuffle(phones)
+    before = metric_samples(client)
+    result = asyncio.run(run_webhooks(client.base_url, phones, args.concurrency))
+    after = metric_samples(client)
+    return [summary("webhook", "respuesta SI/NO", result["latencies"], result["seconds"],
+                    route_queries(before, after, "POST", "/twilio/incoming"))]
+
+
+def compare(rows: list, baseline: dict, tolerance: float) -> list:
+    """Regresiones respecto a la línea base (mismo escenario y operación)"""
+    previous = {(row["scenario"], row["operation"]): row for row in baseline["results"]}
+    regressions = []
+    for row in rows:
+        old = previous.get((row["scenario"], row["operation"]))
+        if old is None:
+            continue
+        name = f"{row['scenario']} / {row['operation']}"
+        if old["p95_ms"] and row["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old['p95_ms']} -> {row['p95_ms']} ms")
+        if old["per_second"] and row["per_second"] < old["per_second"] * (1 - tolerance):
+            regressions.append(f"{name}: rendimiento {old['per_second']} -> {row['per_second']} /s")
+        # Las consultas por operación apenas varían entre ejecuciones: cualquier aumento es un cambio de código
+        if row["db_queries"] > old["db_queries"] * 1.05 + 0.05:
+            regressions.append(f"{name}: consultas SQL {old['db_queries']} -> {row['db_queries']}")
+    return regressions
+
+
+def print_table(rows: list):
+    print(f"{'escenario':<10} {'operación':<16} {'n':>7} {'por s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'consultas':>10}")
+    for row in rows:
+        print(
+            f"{row['scenario']:<10} {row['operation']:<16} {row['count']:>7} {row['per_second']:>10} "
+            f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9} {row['db_queries']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--customers", type=int, default=2000)
+    parser.add_argument("--shipments", type=int, default=20000)
+    parser.add_argument("--interactions", type=int, default=40000)
+    parser.add_argument("--dashboards", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=10, help="duración del escenario dashboard")
+    parser.add_argument("--import-rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--webhooks", type=int, default=1000, help="mensajes de la ráfaga (como mucho uno por cliente)")
+    parser.add_argument("--concurrency", type=int, default=32, help="peticiones concurrentes de la ráfaga del webhook")
+    parser.add_argument("--twilio-latency-ms", type=float, default=0, help="latencia simulada de cada envío a Twilio")
+    parser.add_argument("--save", metavar="FICHERO", help="guardar los resultados como línea base (JSON)")
+    parser.add_argument("--baseline", metavar="FICHERO", help="comparar con una línea base guardada con --save")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="empeoramiento admitido del p95 y del rendimiento")
+    args = parser.parse_args()
+
+    parameters = {key: value for key, value in vars(args).items() if key not in ("scenarios", "save", "baseline", "tolerance")}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    run_migrations()
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    sheet_path = os.path.join(workdir, "pedidos.csv")
+    source = f"file:{os.path.abspath(sheet_path)}"
+    write_sheet(sheet_path, 0)
+    cleanup(SEED_PREFIX)
+    seed(args.customers, args.shipments, args.interactions)
+    process, base_url = start_server(sheet_path, args.twilio_latency_ms)
+    results = []
+    try:
+        with httpx.Client(base_url=base_url, headers={"Authorization": f"Bearer {API_KEY}"}, timeout=60) as client:
+            # Las consultas de la siembra y el arranque no cuentan; una petición de cada tipo calienta las conexiones
+            for path in ("/shipments", "/customers", "/stats"):
+                client.get(path)
+            if "dashboard" in args.scenarios:
+                results += scenario_dashboard(client, args)
+            if "webhook" in args.scenarios:
+                results += scenario_webhook(client, args)
+            if "import" in args.scenarios:
+                results += scenario_import(client, args, sheet_path, source)
+    finally:
+        process.terminate()
+        process.wait()
+        cleanup(SEED_PREFIX)
+        cleanup(IMPORT_PREFIX, source)
+        os.remove(sheet_path)
+        os.rmdir(workdir)
+
+    print_table(results)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"machine": platform.node(), "parameters": parameters, "results": results}, f, indent=2, ensure_ascii=False)
+        print(f"Línea base guardada en {args.save}")
+    if baseline is not None:
+        if baseline.get("parameters") != parameters:
+            print("Aviso: la línea base se midió con otros parámetros, las cifras pueden no ser comparables")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESIÓN {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print("Sin regresiones respecto a la línea base")
@@ -0,0 +1,150 @@
+'''
+Micro-benchmark del cliente Twilio: un Client nuevo por mensaje vs. un cliente compartido con pool keep-alive
+    Levanta un servidor HTTPS local (certificado autofirmado) que imita la API de mensajes de Twilio
+    y mide la latencia por mensaje de ambos enfoques, en serie y con varios hilos concurrentes.
+    No hace peticiones a Twilio.
+
+    Uso (desde backend/):
+        python -m utils.bench_twilio_client --messages 200 --threads 1 4
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import os
+import ssl
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client
+
+# messaging importa database, que necesita una URL aunque aquí no se use la DB
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app import messaging
+
+ACCOUNT_SID = "AC" + "0" * 32
+AUTH_TOKEN = "token"
+
+
+class FakeTwilioHandler(BaseHTTPRequestHandler):
+    """Responde a POST .../Messages.json como Twilio, manteniendo la conexión abierta (HTTP/1.1)"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"sid": f"SM{uuid.uuid4().hex}", "status": "queued", "account_sid": ACCOUNT_SID}).encode()
+        self.send_response(201)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server() -> str:
+    """Arranca el servidor HTTPS en un puerto libre y devuelve su URL base"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now).not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    tmp = tempfile.mkdtemp()
+    cert_path, key_path = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTwilioHandler)
+    server.daemon_threads = True
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"https://127.0.0.1:{server.server_address[1]}"
+
+
+def local_http_client(base_url: str, http_client: TwilioHttpClient) -> TwilioHttpClient:
+    """Redirige las peticiones de api.twilio.com al servidor local (sin verificar el certificado autofirmado)"""
+    request = http_client.request
+    http_client.session.verify = False
+    http_client.session.trust_env = False
+
+    def local_request(method, url, **kwargs):
+        return request(method, url.replace("https://api.twilio.com", base_url), **kwargs)
+
+    http_client.request = local_request
+    return http_client
+
+
+def send(client):
+    client.messages.create(from_="whatsapp:+14155238886", to="whatsapp:+34600000000", body="Mensaje de prueba")
+
+
+def run(name: str, messages: int, threads: int, get_client) -> dict:
+    latencies = []
+
+    def timed_send(_):
+        start = time.perf_counter()
+        send(get_client())
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(timed_send, range(messages)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "client": name,
+        "threads": threads,
+        "msg_per_s": round(messages / elapsed, 1),
+        "avg_ms": round(statistics.mean(latencies), 2),
+        "p50_ms": round(latencies[len(latencies) // 2], 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    import urllib3
+    urllib3.disable_warnings()
+    base_url = start_server()
+
+    for threads in args.threads:
+        # Antes: un Client (y por tanto una sesión HTTP y un handshake TLS) por mensaje
+        def per_message_client():
+            return Client(ACCOUNT_SID, AUTH_TOKEN, http_client=local_http_client(base_url, TwilioHttpClient()))
+
+        # Después: un único cliente con pool keep-alive dimensionado para los hilos
+        shared = Client(
+            ACCOUNT_SID, AUTH_TOKEN,
+            http_client=local_http_client(base_url, messaging.create_twilio_http_client(pool_size=threads)),
+        )
+
+        print(run("client-per-message", args.messages, threads, per_message_client))
+        print(run("shared-pooled", args.messages, threads, lambda: shared))
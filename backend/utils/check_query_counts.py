@@ -0,0 +1,144 @@
+'''
+Número de consultas de los listados con datos relacionados, a medida que crecen los datos (N+1)
+    Crea N envíos (cada uno con su cliente y hasta 3 interacciones), pide la página de N envíos de
+    GET /shipments?include=customer,last_interaction y las interacciones de un envío con N interacciones,
+    y cuenta las consultas SQL que lanza cada petición (evento before_cursor_execute del engine asíncrono).
+    Falla si el número de consultas cambia con N. También comprueba que el cliente y la última interacción
+    incluidos coinciden con los de GET /customers/{id} y GET /shipments/{id}/interactions.
+    Los clientes usan teléfonos +3495... y se borran al terminar (la DB queda como estaba).
+    Necesita DATABASE_URL y API_KEY.
+
+    Uso (desde backend/):
+        python -m utils.check_query_counts --sizes 10 100 1000
+'''
+
+import argparse
+import asyncio
+import os
+
+import httpx
+from sqlalchemy import event, text
+
+from app import main
+from app.database import SessionLocal, get_async_engine, dispose_async_engine
+from app.migrate import run_migrations
+
+PHONE_PREFIX = "+3495"
+
+SEED_SQL = [
+    """
+    INSERT INTO customer (name, phone, delivery_hours_open, delivery_hours_close, timezone, created_at, updated_at)
+    SELECT 'Check ' || i, :prefix || lpad(i::text, 7, '0'), '09:00', '21:00', 'Europe/Madrid', now(), now()
+    FROM generate_series(1, :n) i
+    """,
+    """
+    INSERT INTO shipment (customer_id, description, planned_delivery_time, status, created_at, updated_at)
+    SELECT c.id, 'Pedido check ' || c.phone, now() + interval '1 day', 'pending',
+           now() + make_interval(secs => right(c.phone, 7)::int), now()
+    FROM customer c WHERE c.phone LIKE :prefix || '%'
+    """,
+    """
+    INSERT INTO delivery_interaction (shipment_id, channel, direction, content, response_code, created_at)
+    SELECT s.id, 'whatsapp', 'outbound', 'Mensaje ' || k, NULL, now() + make_interval(secs => k)
+    FROM shipment s JOIN customer c ON c.id = s.customer_id
+    CROSS JOIN generate_series(1, 3) k
+    WHERE c.phone LIKE :prefix || '%' AND k <= right(c.phone, 7)::int % 4
+    """,
+]
+
+
+def seed(n: int):
+    cleanup()
+    with SessionLocal() as db:
+        for sql in SEED_SQL:
+            db.execute(text(sql), {"prefix": PHONE_PREFIX, "n": n})
+        # Un envío con n interacciones para GET /shipments/{id}/interactions
+        shipment_id = db.execute(text(
+            "SELECT s.id FROM shipment s JOIN customer c ON c.id = s.customer_id WHERE c.phone = :phone"
+        ), {"phone": f"{PHONE_PREFIX}0000001"}).scalar_one()
+        db.execute(text(
+            "INSERT INTO delivery_interaction (shipment_id, channel, direction, content, created_at) "
+            "SELECT :id, 'whatsapp', 'inbound', 'Respuesta ' || k, now() + make_interval(secs => 10 + k) "
+            "FROM generate_series(1, :n) k"
+        ), {"id": shipment_id, "n": n})
+        db.commit()
+    return shipment_id
+
+
+def cleanup():
+    pattern = f"{PHONE_PREFIX}%"
+    with SessionLocal() as db:
+        db.execute(text(
+            "DELETE FROM delivery_interaction WHERE shipment_id IN "
+            "(SELECT s.id FROM shipment s JOIN customer c ON c.id = s.customer_id WHERE c.phone LIKE :p)"
+        ), {"p": pattern})
+        db.execute(text(
+            "DELETE FROM shipment WHERE customer_id IN (SELECT id FROM customer WHERE phone LIKE :p)"
+        ), {"p": pattern})
+        db.execute(text("DELETE FROM customer WHERE phone LIKE :p"), {"p": pattern})
+        db.commit()
+
+
+async def measure(n: int, shipment_id) -> dict:
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = get_async_engine().sync_engine
+    event.listen(engine, "before_cursor_execute", count)
+    headers = {"Authorization": f"Bearer {os.getenv('API_KEY', '')}"}
+    transport = httpx.ASGITransport(app=main.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://check", headers=headers) as client:
+            statements.clear()
+            response = await client.get("/shipments", params={"include": "customer,last_interaction", "limit": n})
+            response.raise_for_status()
+            page = [s for s in response.json() if s["customer"]["phone"].startswith(PHONE_PREFIX)]
+            listing = len(statements)
+
+            statements.clear()
+            response = await client.get(f"/shipments/{shipment_id}/interactions")
+            response.raise_for_status()
+            interactions = response.json()
+            detail = len(statements)
+
+            # Lo incluido debe ser lo mismo que devuelven los endpoints de cada entidad
+            for shipment in page[:5]:
+                customer = (await client.get(f"/customers/{shipment['customer_id']}")).json()
+                assert shipment["customer"] == customer, (shipment["customer"], customer)
+                history = (await client.get(f"/shipments/{shipment['id']}/interactions")).json()
+                latest = max(history, key=lambda i: (i["created_at"], i["id"])) if history else None
+                assert shipment["last_interaction"] == latest, (shipment["last_interaction"], latest)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return {"shipments": len(page), "listing": listing, "interactions": len(interactions), "detail": detail}
+
+
+async def run(sizes) -> list:
+    results = []
+    try:
+        for n in sizes:
+            shipment_id = await asyncio.to_thread(seed, n)
+            results.append(await measure(n, shipment_id))
+    finally:
+        await dispose_async_engine()
+        await asyncio.to_thread(cleanup)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    run_migrations()
+    results = asyncio.run(run(args.sizes))
+    print(f"{'N':>6} {'envíos':>8} {'consultas listado':>18} {'interacciones':>14} {'consultas detalle':>18}")
+    for n, result in zip(args.sizes, results):
+        print(f"{n:>6} {result['shipments']:>8} {result['listing']:>18} {result['interactions']:>14} {result['detail']:>18}")
+    for key in ("listing", "detail"):
+        counts = {result[key] for result in results}
+        if len(counts) != 1:
+            raise SystemExit(f"El número de consultas cambia con el tamaño de los datos ({key}: {sorted(counts)})")
+    print("Número de consultas constante")
@@ -0,0 +1,82 @@
+'''
+Fusión de envíos duplicados (paso previo a la migración 0002_hot_path_indexes)
+    La migración 0002 añade la restricción única uq_shipment_dedup sobre (customer_id, description,
+    planned_delivery_time) y falla si ya hay envíos duplicados, sin modificar los datos.
+    Este script los lista y, solo con --apply, los fusiona en una transacción: de cada grupo se conserva el envío más
+    antiguo (created_at, id), se le reasignan las interacciones de los demás y se borran los demás. Cada fusión queda
+    en el log (envío conservado, envíos borrados e interacciones movidas) para poder revisarla después.
+    Necesita DATABASE_URL. No aplica migraciones.
+
+    Uso (desde backend/):
+        python -m utils.fix_duplicate_shipments           # solo informe
+        python -m utils.fix_duplicate_shipments --apply   # fusiona los duplicados
+'''
+
+import argparse
+import logging
+
+from sqlalchemy import text
+
+from app.database import SessionLocal
+from app.logs import setup_logging
+
+logger = logging.getLogger("utils.fix_duplicate_shipments")
+
+DUPLICATES_SQL = text("""
+    SELECT customer_id, description, planned_delivery_time,
+           array_agg(id ORDER BY created_at, id) AS ids,
+           array_agg(status ORDER BY created_at, id) AS statuses
+    FROM shipment
+    GROUP BY customer_id, description, planned_delivery_time
+    HAVING count(*) > 1
+    ORDER BY customer_id, planned_delivery_time
+""")
+
+MOVE_INTERACTIONS_SQL = text("""
+    UPDATE delivery_interaction SET shipment_id = :keep_id WHERE shipment_id = ANY(:ids)
+""")
+
+DELETE_SQL = text("DELETE FROM shipment WHERE id = ANY(:ids)")
+
+
+def fix_duplicates(apply: bool) -> int:
+    """Lista (y con apply fusiona) los grupos de envíos duplicados; devuelve cuántos grupos hay"""
+    with SessionLocal() as db:
+        # Bloquea la tabla para que no aparezcan duplicados nuevos mientras se fusiona
+        if apply:
+            db.execute(text("LOCK TABLE shipment IN SHARE ROW EXCLUSIVE MODE"))
+        groups = db.execute(DUPLICATES_SQL).all()
+        for group in groups:
+            keep_id, duplicate_ids = group.ids[0], group.ids[1:]
+            extra = {
+                "customer_id": str(group.customer_id),
+                "description": group.description,
+                "planned_delivery_time": group.planned_delivery_time.isoformat(),
+                "keep_id": str(keep_id),
+                "duplicate_ids": [str(id) for id in duplicate_ids],
+                "statuses": list(group.statuses),
+            }
+            if not apply:
+                logger.info("Envíos duplicados", extra=extra)
+                continue
+            moved = db.execute(MOVE_INTERACTIONS_SQL, {"keep_id": keep_id, "ids": duplicate_ids}).rowcount
+            db.execute(DELETE_SQL, {"ids": duplicate_ids})
+            logger.warning("Envíos duplicados fusionados", extra={**extra, "interactions_moved": moved})
+        if apply:
+            db.commit()
+    return len(groups)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="fusionar los duplicados (sin esta opción solo se listan)")
+    args = parser.parse_args()
+
+    setup_logging()
+    count = fix_duplicates(args.apply)
+    if not count:
+        print("No hay envíos duplicados")
+    elif args.apply:
+        print(f"{count} grupos de envíos duplicados fusionados")
+    else:
+        print(f"{count} grupos de envíos duplicados; se fusionan con --apply")
@@ -0,0 +1,147 @@
+'''
+Prueba de carga del webhook de Twilio (POST /twilio/incoming)
+    Crea N clientes con un shipment pendiente cada uno, levanta la app con uvicorn en un puerto local
+    y reproduce una ráfaga de N respuestas SI/NO con C peticiones concurrentes, como en la hora punta de respuestas.
+    Mientras dura la ráfaga, otro hilo mide la latencia de un endpoint trivial (GET /dashboard) para ver
+    si el event loop queda bloqueado. Al terminar borra los datos sembrados.
+    Necesita DATABASE_URL apuntando a una DB de desarrollo. No envía WhatsApp (DISABLE_WHATSAPP=true).
+
+    Uso (desde backend/):
+        python -m utils.load_twilio_webhook --messages 500 --concurrency 32
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+import random
+import socket
+import statistics
+import threading
+import time
+
+os.environ.setdefault("DISABLE_WHATSAPP", "true")
+
+import requests
+import uvicorn
+from sqlalchemy import text
+
+from app.database import engine
+from app.main import app
+from app.migrate import run_migrations
+
+PHONE_PREFIX = "+3498"
+
+
+def seed(messages: int):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO customer (name, phone, delivery_hours_open, delivery_hours_close, timezone, created_at, updated_at)
+            SELECT 'Carga ' || i, :prefix || lpad(i::text, 7, '0'), '09:00', '21:00', 'Europe/Madrid', now(), now()
+            FROM generate_series(1, :n) i
+        """), {"prefix": PHONE_PREFIX, "n": messages})
+        conn.execute(text("""
+            INSERT INTO shipment (customer_id, description, planned_delivery_time, status, created_at, updated_at)
+            SELECT id, 'Pedido carga', now() + interval '1 day', 'pending', now(), now()
+            FROM customer WHERE phone LIKE :prefix || '%'
+        """), {"prefix": PHONE_PREFIX})
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(text("""
+            DELETE FROM delivery_interaction WHERE shipment_id IN (
+                SELECT s.id FROM shipment s JOIN customer c ON c.id = s.customer_id WHERE c.phone LIKE :prefix || '%'
+            )
+        """), {"prefix": PHONE_PREFIX})
+        conn.execute(text("""
+            DELETE FROM shipment WHERE customer_id IN (SELECT id FROM customer WHERE phone LIKE :prefix || '%')
+        """), {"prefix": PHONE_PREFIX})
+        conn.execute(text("DELETE FROM customer WHERE phone LIKE :prefix || '%'"), {"prefix": PHONE_PREFIX})
+
+
+def start_server() -> str:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    base_url = f"http://127.0.0.1:{port}"
+    while not server.started:
+        time.sleep(0.05)
+    return base_url
+
+
+def percentiles(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    pick = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 1)
+    return {
+        "count": len(latencies),
+        "avg_ms": round(statistics.mean(latencies), 1),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(latencies[-1], 1),
+    }
+
+
+def run(base_url: str, messages: int, concurrency: int) -> dict:
+    local = threading.local()
+    latencies, probe_latencies, statuses = [], [], []
+    done = threading.Event()
+
+    def post(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        data = {"From": f"whatsapp:{PHONE_PREFIX}{i:07d}", "Body": random.choice(["SI", "NO", "Si, gracias"])}
+        start = time.perf_counter()
+        r = local.session.post(f"{base_url}/twilio/incoming", data=data)
+        latencies.append((time.perf_counter() - start) * 1000)
+        statuses.append(r.status_code)
+
+    def probe():
+        session = requests.Session()
+        while not done.is_set():
+            start = time.perf_counter()
+            session.get(f"{base_url}/dashboard")
+            probe_latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.01)
+
+    probe_thread = threading.Thread(target=probe)
+    probe_thread.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(post, range(1, messages + 1)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    probe_thread.join()
+
+    return {
+        "concurrency": concurrency,
+        "req_per_s": round(messages / elapsed, 1),
+        "errors": sum(1 for s in statuses if s != 200),
+        "webhook": percentiles(latencies),
+        "event_loop_probe": percentiles(probe_latencies),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    run_migrations()
+    cleanup()
+    seed(args.messages)
+    try:
+        base_url = start_server()
+        result = run(base_url, args.messages, args.concurrency)
+        with engine.connect() as conn:
+            result["pending_left"] = conn.execute(text("""
+                SELECT count(*) FROM shipment s JOIN customer c ON c.id = s.customer_id
+                WHERE c.phone LIKE :prefix || '%' AND s.status = 'pending'
+            """), {"prefix": PHONE_PREFIX}).scalar()
+        print(result)
+    finally:
+        cleanup()
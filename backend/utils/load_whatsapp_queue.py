@@ -0,0 +1,77 @@
+'''
+Prueba de carga de la cola de WhatsApp (sin conexión)
+    Encola N mensajes con el cliente Twilio falso (latencia simulada) y mide el throughput
+    para distintos tamaños del pool de workers. No escribe en la DB.
+    Con --rate se aplica el token bucket local y con --throttle-rate el cliente falso responde 429
+    en esa fracción de envíos, para ver el efecto del backoff.
+
+    Uso (desde backend/):
+        python -m utils.load_whatsapp_queue --messages 500 --workers 1 4 16 --latency-ms 300
+        python -m utils.load_whatsapp_queue --messages 200 --workers 8 --rate 20 --throttle-rate 0.05
+'''
+
+import argparse
+import os
+import time
+import uuid
+
+# messaging importa database, que necesita una URL aunque aquí no se use la DB
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app import messaging
+from app.ratelimit import TokenBucket
+
+
+def run(messages: int, workers: int, latency_ms: float, error_rate: float, rate: float, throttle_rate: float) -> dict:
+    metrics = messaging.SendMetrics()
+    limiter = TokenBucket(rate, rate) if rate else TokenBucket(float("inf"), float("inf"))
+    client = messaging.RateLimitedTwilioClient(
+        messaging.FakeTwilioClient(latency_ms=latency_ms, error_rate=error_rate, throttle_rate=throttle_rate),
+        limiter,
+        metrics=metrics,
+        backoff_base_ms=50,
+    )
+    dispatcher = messaging.WhatsAppDispatcher(
+        workers=workers,
+        maxsize=messages,
+        client_factory=lambda: client,
+        session_factory=None,
+        metrics=metrics,
+    )
+    dispatcher.start()
+
+    start = time.perf_counter()
+    for i in range(messages):
+        dispatcher.enqueue(uuid.uuid4(), f"+3460000{i:04d}", f"Mensaje de prueba {i}")
+    enqueue_elapsed = time.perf_counter() - start
+
+    dispatcher.join()
+    elapsed = time.perf_counter() - start
+    dispatcher.stop()
+
+    stats = dispatcher.stats()
+    return {
+        "workers": workers,
+        "enqueue_ms": round(enqueue_elapsed * 1000, 1),
+        "total_s": round(elapsed, 2),
+        "msg_per_s": round(messages / elapsed, 1),
+        "sent": stats["sent"],
+        "errors": stats["errors"],
+        "retries": stats["retries"],
+        "timings": stats["timings"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate", type=float, default=0.0, help="mensajes/segundo (0 = sin límite)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fracción de envíos que responden 429")
+    args = parser.parse_args()
+
+    print(f"{args.messages} mensajes, latencia simulada {args.latency_ms} ms")
+    for workers in args.workers:
+        print(run(args.messages, workers, args.latency_ms, args.error_rate, args.rate, args.throttle_rate))
@@ -0,0 +1,4 @@
+#!/bin/bash
+# Permite las conexiones de replicación de la réplica de lectura (docker-compose.replica.yml)
+set -e
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"